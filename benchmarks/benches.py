@@ -0,0 +1,271 @@
+import os, json, random, socket, select, shutil, tempfile
+from multiprocessing import Pipe
+import engine_server.game_engine as game_engine
+from engine_server.object import Object
+from engine_server.npc import NPC
+from common.game_comm import GameComm
+from common.object_message import NPCUpdateMessage
+from game_server import GameClientConnection
+from tournament import Tournament, TS_OVER
+from tournament_cache import TournamentCache
+
+BENCH_SEED = 2014
+EVOLVE_DT = 1.0/30.0
+
+class Benchmark:
+    """
+    One timed piece of work.  setup() builds everything the work needs,
+    run() does ops operations, and teardown() throws it away.  Each
+    repeat gets a fresh setup() from the same seed, so every repeat,
+    and every run of the suite, does the same work.
+    """
+
+    name = "benchmark"
+    ops = 1
+
+    def setup(self):
+        return
+
+    def run(self):
+        return
+
+    def teardown(self):
+        return
+
+def make_npcs(count, rng, width=game_engine.FIELD_WIDTH, height=game_engine.FIELD_HEIGHT):
+    Object.next_object_id = 1
+    npcs = []
+    for i in range(count):
+        x = rng.uniform(0, width - game_engine.NPC_WIDTH)
+        y = rng.uniform(0, height - game_engine.NPC_HEIGHT)
+        npcs.append(NPC(x, y, game_engine.NPC_WIDTH, game_engine.NPC_HEIGHT))
+    return npcs
+
+class EvolveBenchmark(Benchmark):
+    """GameEngine.evolve() with npcs NPCs on the field."""
+
+    def __init__(self, npcs, ticks=300):
+        self.npcs = npcs
+        self.name = "engine_evolve_%d_npcs" % (npcs,)
+        self.ops = ticks
+        self.engine = None
+        return
+
+    def setup(self):
+        Object.next_object_id = 1
+        num_npcs = game_engine.NUM_NPCS
+        game_engine.NUM_NPCS = self.npcs
+        try:
+            self.engine = game_engine.GameEngine(BENCH_SEED)
+        finally:
+            game_engine.NUM_NPCS = num_npcs
+        return
+
+    def run(self):
+        for i in range(self.ops):
+            self.engine.evolve(EVOLVE_DT)
+        return
+
+    def teardown(self):
+        self.engine = None
+        return
+
+class CollideBenchmark(Benchmark):
+    """Object.collide() between NPCs at random places, about a third of them touching."""
+
+    name = "object_collide"
+    ops = 20000
+
+    def setup(self):
+        rng = random.Random(BENCH_SEED)
+        # a small field, so some pairs touch
+        npcs = make_npcs(64, rng, 60, 60)
+        self.pairs = []
+        for i in range(self.ops):
+            (a, b) = rng.sample(npcs, 2)
+            self.pairs.append((a, b, a.get_x(), a.get_y()))
+        return
+
+    def run(self):
+        for (a, b, x, y) in self.pairs:
+            a.collide(x, y, b)
+        return
+
+    def teardown(self):
+        self.pairs = None
+        return
+
+class MessageJsonBenchmark(Benchmark):
+    """ObjectData.set_message() and json.dumps(), as the server encodes a full update."""
+
+    name = "object_message_json"
+    ops = 5000
+
+    def setup(self):
+        rng = random.Random(BENCH_SEED)
+        self.objs = make_npcs(100, rng)
+        return
+
+    def run(self):
+        objs = self.objs
+        n = len(objs)
+        for i in range(self.ops):
+            msg = NPCUpdateMessage()
+            objs[i % n].get_data().set_message(msg)
+            json.dumps(msg.data)
+        return
+
+    def teardown(self):
+        self.objs = None
+        return
+
+def make_update_messages(count):
+    rng = random.Random(BENCH_SEED)
+    return [ NPCUpdateMessage(npc.get_data()) for npc in make_npcs(count, rng) ]
+
+class GameCommBenchmark(Benchmark):
+    """GameComm.write_mesg() and read_mesg() of object updates over a socketpair."""
+
+    name = "game_comm_roundtrip"
+    ops = 5000
+
+    def setup(self):
+        (self.sock1, self.sock2) = socket.socketpair()
+        self.writer = GameComm(self.sock1)
+        self.reader = GameComm(self.sock2)
+        self.msgs = make_update_messages(100)
+        return
+
+    def run(self):
+        msgs = self.msgs
+        n = len(msgs)
+        for i in range(self.ops):
+            self.writer.write_mesg(msgs[i % n])
+            self.reader.read_mesg()
+        return
+
+    def teardown(self):
+        self.sock1.close()
+        self.sock2.close()
+        return
+
+class PipeRelayBenchmark(Benchmark):
+    """
+    Object updates from the game's pipe, through GameClientConnection's
+    send queue, to the client's socket, as a relay process does it,
+    batch messages at a time.  Each message in a batch has its own oid,
+    so none are merged in the send queue.
+    """
+
+    name = "pipe_relay"
+    ops = 5000
+    batch = 50
+
+    def setup(self):
+        (self.sock, self.client_sock) = socket.socketpair()
+        (self.game_pipe, pipe) = Pipe()
+        self.connection = GameClientConnection(0, self.sock, pipe)
+        self.connection.poll = select.poll()
+        self.sock.setblocking(0)
+        self.connection.poll.register(self.sock.fileno(), select.POLLIN)
+        self.connection.poll.register(pipe.fileno(), select.POLLIN)
+        self.client_sock.settimeout(5.)
+        self.client = GameComm(self.client_sock)
+        self.msgs = make_update_messages(self.batch)
+        return
+
+    def run(self):
+        for i in range(self.ops / self.batch):
+            for msg in self.msgs:
+                self.game_pipe.send(msg)
+            self.connection.receive_pipe_messages()
+            received = 0
+            while received < self.batch:
+                received += len(self.client.read_mesgs())
+                self.connection.send_socket_messages()
+        return
+
+    def teardown(self):
+        self.connection.close_sock()
+        self.game_pipe.close()
+        self.client_sock.close()
+        return
+
+class TournamentBenchmark(Benchmark):
+    """Tournament.get_eligible_players() with players players, each in 2 * games finished games."""
+
+    ops = 5
+
+    def __init__(self, players=1000, games=3):
+        self.players = players
+        self.games = games
+        self.name = "tournament_eligible_%d_players" % (players,)
+        self.directory = None
+        return
+
+    def setup(self):
+        rng = random.Random(BENCH_SEED)
+        self.directory = tempfile.mkdtemp()
+        self.tournament = Tournament()
+        self.tournament.filename = os.path.join(self.directory, "tournament.db")
+        self.tournament.open()
+        self.tournament.set_max_losses(3)
+        names = [ "player%04d" % (i,) for i in range(self.players) ]
+        # filled in one transaction, the commit per row of add_player() is far too slow
+        cursor = self.tournament.cursor
+        cursor.executemany("""INSERT INTO players (name) VALUES (?)""", [ (name,) for name in names ])
+        # one game with each of the next few players, as end_game() would leave it
+        games = []
+        for i in range(self.players):
+            for j in range(1, self.games + 1):
+                (p1, p2) = (names[i], names[(i + j) % self.players])
+                games.append((p1, p2, str(TS_OVER), rng.choice((p1, p2))))
+        cursor.executemany("""INSERT INTO games (player1, player2, state, winner) VALUES (?,?,?,?)""", games)
+        self.tournament.connection.commit()
+        return
+
+    def run(self):
+        for i in range(self.ops):
+            self.tournament.get_eligible_players()
+        return
+
+    def teardown(self):
+        self.tournament.close()
+        shutil.rmtree(self.directory)
+        return
+
+class TournamentCacheBenchmark(TournamentBenchmark):
+    """TournamentCache.get_eligible_players(), the lobby's copy of the same tournament."""
+
+    ops = 50
+
+    def __init__(self, players=1000, games=3):
+        TournamentBenchmark.__init__(self, players, games)
+        self.name = "tournament_cache_%d_players" % (players,)
+        return
+
+    def setup(self):
+        TournamentBenchmark.setup(self)
+        self.tournament.close()
+        self.cache = TournamentCache(self.tournament.filename)
+        return
+
+    def run(self):
+        for i in range(self.ops):
+            self.cache.get_eligible_players()
+        return
+
+    def teardown(self):
+        self.cache.close()
+        shutil.rmtree(self.directory)
+        return
+
+BENCHMARKS = [ EvolveBenchmark(10),
+               EvolveBenchmark(100),
+               EvolveBenchmark(500),
+               CollideBenchmark(),
+               MessageJsonBenchmark(),
+               GameCommBenchmark(),
+               PipeRelayBenchmark(),
+               TournamentBenchmark(),
+               TournamentCacheBenchmark() ]
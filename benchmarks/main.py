@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+import logging, sys, getopt, time, json, gc, platform
+sys.path.append('..')
+sys.path.append('../server')
+from benches import BENCHMARKS
+
+def time_benchmark(bench, repeats):
+    """Seconds per operation of bench, the best of repeats runs."""
+    best = None
+    for i in range(repeats):
+        bench.setup()
+        # as timeit does, so a collection doesn't land in one run and not another
+        gc.disable()
+        try:
+            t0 = time.time()
+            bench.run()
+            t1 = time.time()
+        finally:
+            gc.enable()
+            bench.teardown()
+        if best is None or t1 - t0 < best:
+            best = t1 - t0
+    return best / bench.ops
+
+def run_benchmarks(benches, repeats):
+    results = {}
+    for bench in benches:
+        seconds = time_benchmark(bench, repeats)
+        results[bench.name] = { "ops": bench.ops,
+                                "repeats": repeats,
+                                "us_per_op": 1e6 * seconds,
+                                "ops_per_sec": 1. / max(seconds, 1e-12) }
+        print "%-32s %12.3f us/op %14.1f ops/s" % (bench.name, results[bench.name]["us_per_op"],
+                                                    results[bench.name]["ops_per_sec"])
+        sys.stdout.flush()
+    return results
+
+def compare(results, baseline, threshold):
+    """Prints each benchmark against baseline, returns the names more than threshold slower."""
+    regressions = []
+    print
+    print "%-32s %12s %12s %8s" % ("compared with baseline", "baseline", "now", "change")
+    for name in sorted(results.keys()):
+        if name not in baseline:
+            print "%-32s %12s %12.3f" % (name, "-", results[name]["us_per_op"])
+            continue
+        old = baseline[name]["us_per_op"]
+        new = results[name]["us_per_op"]
+        change = (new - old) / max(old, 1e-12)
+        flag = ""
+        if change > threshold:
+            flag = "  SLOWER"
+            regressions.append(name)
+        elif change < -threshold:
+            flag = "  faster"
+        print "%-32s %12.3f %12.3f %+7.1f%%%s" % (name, old, new, 100. * change, flag)
+    return regressions
+
+def usage():
+    print "usage: %s [-r|--repeats count] [-o|--output file] [-b|--baseline file] [-t|--threshold percent] [-f|--filter text] [-l|--list] [-L|--logging level] [-h|--help]" % (sys.argv[0])
+    print "times the engine, serialization, transport and tournament hot paths"
+    print "-r|--repeats count      : runs of each benchmark, the fastest counts (default 5)"
+    print "-o|--output file        : write the results to file, as JSON"
+    print "-b|--baseline file      : compare with results written by -o, exit 2 if any are slower"
+    print "-t|--threshold percent  : how much slower than the baseline is slower (default 20)"
+    print "-f|--filter text        : only run benchmarks with text in their name"
+    print "-l|--list               : list the benchmarks and exit"
+    print "-L|--logging info|debug|warning|error: logging level"
+    print "-h|--help               : show this message and exit"
+    return
+
+def main():
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hr:o:b:t:f:lL:",
+                                   ["help", "repeats=", "output=", "baseline=", "threshold=",
+                                    "filter=", "list", "logging="])
+    except getopt.GetoptError as e:
+        print str(e)
+        usage()
+        sys.exit(1)
+
+    show_help = False
+    repeats = 5
+    output = None
+    baseline_file = None
+    threshold = 20.
+    filters = []
+    list_only = False
+    logging_level = "error"
+    try:
+        for o, a in opts:
+            if o in ("-h", "--help"):
+                show_help = True
+            elif o in ("-r", "--repeats"):
+                repeats = int(a)
+            elif o in ("-o", "--output"):
+                output = a
+            elif o in ("-b", "--baseline"):
+                baseline_file = a
+            elif o in ("-t", "--threshold"):
+                threshold = float(a)
+            elif o in ("-f", "--filter"):
+                filters.append(a)
+            elif o in ("-l", "--list"):
+                list_only = True
+            elif o in ("-L", "--logging"):
+                logging_level = a
+            else:
+                print "Unexpected option: %s" % (o)
+                usage()
+                sys.exit(1)
+    except ValueError as e:
+        print str(e)
+        usage()
+        sys.exit(1)
+    if show_help or args or repeats < 1:
+        usage()
+        sys.exit(1)
+
+    levels = { "info": logging.INFO, "debug": logging.DEBUG,
+               "warning": logging.WARNING, "error": logging.ERROR }
+    logging.basicConfig(level=levels.get(logging_level, logging.ERROR))
+
+    benches = BENCHMARKS
+    if filters:
+        benches = [ b for b in benches if [ f for f in filters if f in b.name ] ]
+    if list_only:
+        for b in benches:
+            print "%-32s %s" % (b.name, " ".join(b.__doc__.split()).split(". ")[0])
+        return
+
+    baseline = None
+    if baseline_file:
+        try:
+            f = open(baseline_file, 'r')
+            baseline = json.load(f)['results']
+            f.close()
+        except (IOError, ValueError, KeyError) as e:
+            print "can't read baseline %s: %s" % (baseline_file, e)
+            sys.exit(1)
+
+    results = run_benchmarks(benches, repeats)
+    if output:
+        f = open(output, 'w')
+        json.dump({ "time": time.strftime('%Y-%m-%d %H:%M:%S'),
+                    "python": platform.python_version(),
+                    "machine": platform.machine(),
+                    "platform": platform.platform(),
+                    "results": results }, f, indent=2, sort_keys=True)
+        f.write("\n")
+        f.close()
+    if baseline is not None:
+        regressions = compare(results, baseline, threshold / 100.)
+        if regressions:
+            print "%d of %d benchmarks are more than %.0f%% slower than the baseline" % (
+                len(regressions), len(results), threshold)
+            sys.exit(2)
+    return
+
+if __name__ == "__main__":
+    main()
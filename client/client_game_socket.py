@@ -14,8 +14,9 @@ class ClientGameSocket:
     connect_to_server()         : connects to the configured server
     disconnect_from_server()    : disconnects from the server
     is_ready(fd)                : true if fd belongs to socket object
+    send_message(msg)           : sends one message to game server
     send_messages(engine)       : sends all messages to game server, empties engine queue
-    process_event(engine)       : receives one message from server, updates engine
+    process_event(engine)       : receives available messages from server, updates engine
     """
 
     def __init__(self, read_list, server_host="127.0.0.1", server_port=9999):
@@ -25,6 +26,7 @@ class ClientGameSocket:
         self.server_host = server_host
         self.server_port = server_port
         self.sock = None
+        self.gc = None
         return
 
     def get_sock(self):
@@ -36,6 +38,8 @@ class ClientGameSocket:
             self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             # connect to server
             self.sock.connect( (self.server_host, self.server_port) )
+            # one GameComm for the life of the socket, it buffers partial messages
+            self.gc = GameComm(self.sock)
             # register for select
             self.read_list.append(self.sock.fileno())
             # make non-blocking so recv errors will trigger an exception
@@ -55,6 +59,7 @@ class ClientGameSocket:
                 self.sock.close()
                 # remove reference
                 self.sock = None
+                self.gc = None
         except socket.error as e:
             self.logger.error("socket.error: %s", e)
             raise
@@ -63,13 +68,16 @@ class ClientGameSocket:
     def is_ready(self, fd):
         return self.sock and fd == self.sock.fileno()
 
+    def send_message(self, msg):
+        if not self.gc:
+            return False
+        return self.gc.write_mesg(msg)
+
     def send_messages(self, engine):
         if not engine: return
         try:
-            gc = GameComm(self.sock)
-            for msg in engine.get_message_queue():
-                if not gc.write_mesg(msg):
-                    self.logger.error("Error writing message: %s", msg)
+            if self.gc and not self.gc.write_mesgs(engine.get_message_queue()):
+                self.logger.error("Error writing messages.")
             engine.clear_message_queue()
         except:
             self.logger.error("Error in send_messages.")
@@ -77,14 +85,21 @@ class ClientGameSocket:
         return
         
     def process_event(self, engine):
-        """Should not be called unless there is a message to read from the socket."""
+        """
+        Should not be called unless there is data to read from the socket.
+        Handles every complete message received, not only the first.
+        """
         
-        try:
-            gc = GameComm(self.sock)
-            msg = gc.read_mesg()
-        except:
-            raise
-            
+        msgs = self.gc.read_mesgs()
+        if not msgs:
+            self.logger.debug("Waiting for the rest of a message.")
+        for msg in msgs:
+            self.process_message(engine, msg)
+            if not self.sock:
+                break
+        return
+
+    def process_message(self, engine, msg):
         code = msg.get_command()
         if code == M_ECHO:
             print msg.get_text()
@@ -100,4 +115,3 @@ class ClientGameSocket:
             if engine:
                 engine.process_server_message(msg)
         return
-
@@ -28,24 +28,21 @@ class GameCommandPrompt:
         words = line.split(' ')
         if len(words) > 0:
             if words[0] == 'echo':
-                gc = GameComm(self.game_socket.get_sock())
                 msg = GameMessageEcho()
                 msg.set_text(' '.join(words[1:]))
-                if not gc.write_mesg(msg):
+                if not self.game_socket.send_message(msg):
                     self.logger.error("Error in write_mesg.")
             elif words[0] == 'broadcast':
-                gc = GameComm(self.game_socket.get_sock())
                 msg = GameMessageBroadcast()
                 msg.set_text(' '.join(words[1:]))
-                if not gc.write_mesg(msg):
+                if not self.game_socket.send_message(msg):
                     self.logger.error("Error in write_mesg.")
             elif words[0] == 'login':
                 if len(words) > 1:
-                    gc = GameComm(self.game_socket.get_sock())
                     msg = GameMessageLogin()
                     msg.set_user(words[1])
                     msg.set_request(True)
-                    if not gc.write_mesg(msg):
+                    if not self.game_socket.send_message(msg):
                         self.logger.error("Error in write_mesg.")
                 else:
                     print "Usage: login username"
@@ -0,0 +1,69 @@
+import json
+from common.game_message import *
+from common.object_message import *
+from common.event_message import *
+
+M_TICK_BATCH = "TICK_BATCH"
+
+# messages a TickBatchMessage can carry
+BATCH_MESSAGE_CLASSES = { M_PLAYER_UPDATE:         PlayerUpdateMessage,
+                          M_WALL_UPDATE:           WallUpdateMessage,
+                          M_NPC_UPDATE:            NPCUpdateMessage,
+                          M_MISSILE_UPDATE:        MissileUpdateMessage,
+                          M_EVENT:                 EventMessage,
+                          M_MISSILE_FIRE_EVENT:    MissileFireEventMessage,
+                          M_MISSILE_MISFIRE_EVENT: MissileMisfireEventMessage,
+                          M_MISSILE_HIT_EVENT:     MissileHitEventMessage,
+                          M_MISSILE_DYING_EVENT:   MissileDyingEventMessage,
+                          M_GAME_OVER:             GameOverMessage }
+
+def dict_to_message(tmp):
+    """Builds a batchable message from its {'command': ..., 'data': ...} form."""
+    code = tmp['command']
+    if code not in BATCH_MESSAGE_CLASSES:
+        raise ValueError("message %s can't be in a batch" % (code,))
+    msg = BATCH_MESSAGE_CLASSES[code]()
+    msg.data = tmp['data']
+    return msg
+
+class TickBatchMessage(GameMessage):
+    """
+    Every object update, event and game over message for one tick,
+    so the game sends each client one pipe message per tick, and the
+    relay writes it with one send.  Clients that don't ask for
+    batches at login get the messages one at a time, see GameComm.
+    """
+
+    def __init__(self, msgs=None):
+        GameMessage.__init__(self, M_TICK_BATCH)
+        if msgs is None:
+            msgs = []
+        self.messages = msgs
+        return
+
+    def add_message(self, msg):
+        self.messages.append(msg)
+        return
+
+    def get_messages(self):
+        return self.messages
+
+    def from_string(self, string):
+        tmp = json.loads(string)
+        self.command = tmp['command']
+        self.data = {}
+        self.messages = [ dict_to_message(m) for m in tmp['data']['messages'] ]
+        return
+
+    def __str__(self):
+        msgs = [ { 'command': m.command, 'data': m.data } for m in self.messages ]
+        tmp = { 'command': self.command, 'data': { 'messages': msgs } }
+        return json.dumps(tmp)
+
+def string_to_tick_batch_message(string):
+    msg = TickBatchMessage()
+    msg.from_string(string)
+    return msg
+
+#
+BATCH_MESSAGES = { M_TICK_BATCH: string_to_tick_batch_message }
@@ -0,0 +1,233 @@
+#
+# Compact binary encoding for object update and event messages.
+#
+# A client asks for it with GameMessageLogin.set_encoding(ENCODING_BINARY).
+# The server then sends those messages in frames with code M_BINARY,
+# "BIN SIZE payload", where the payload is
+#
+#   type id (1 byte), field mask (4 bytes), packed fields
+#
+# all little endian.  The type id selects the message class and its
+# field list, bit i of the mask is set if field i is present, and the
+# present fields are packed in field list order with struct.  Floats
+# are sent as 4 byte floats.  Decoding builds the same message class,
+# with the same data keys, as the JSON path, so clients don't need to
+# know which encoding was used.  Any other message, or one with a
+# value that can't be packed, is sent as JSON.
+#
+import struct, operator, json
+from common.game_message import *
+from common.object_message import *
+from common.event_message import *
+from common.batch_message import *
+from common.snapshot_message import *
+from common.event import *
+
+M_BINARY = "BIN"
+
+HEADER = struct.Struct('<BI')
+
+# OBJECT_FIELDS, PLAYER_FIELDS and MISSILE_FIELDS are shared with
+# snapshots, see common/snapshot_message.py
+
+class BinaryType:
+    """The field layout of one message type."""
+
+    def __init__(self, type_id, code, message_class, fields, constants={}):
+        self.type_id = type_id
+        self.code = code
+        self.message_class = message_class
+        self.keys = [ key for (key, fmt) in fields ]
+        self.formats = [ fmt for (key, fmt) in fields ]
+        self.constants = constants # data keys implied by the type, not sent
+        self.full_mask = (1 << len(fields)) - 1
+        self.structs = {} # mask -> struct.Struct
+        # fast path for messages with every field, the usual case
+        self.get_all = operator.itemgetter(*self.keys)
+        self.full_header = HEADER.pack(type_id, self.full_mask)
+        self.full_struct = self.get_struct(self.full_mask)
+        return
+
+    def get_struct(self, mask):
+        if mask not in self.structs:
+            if mask & ~self.full_mask:
+                raise ValueError("bad field mask %x for %s" % (mask, self.code))
+            fmt = '<'
+            for i in range(len(self.formats)):
+                if mask & (1 << i):
+                    fmt += self.formats[i]
+            self.structs[mask] = struct.Struct(fmt)
+        return self.structs[mask]
+
+    def encode(self, msg):
+        """Returns the payload for msg, or None if a value can't be packed."""
+        data = msg.data
+        try:
+            values = self.get_all(data)
+            if len(self.keys) == 1:
+                values = (values,)
+            if None not in values:
+                return self.full_header + self.full_struct.pack(*values)
+        except KeyError:
+            pass
+        except struct.error:
+            return None
+        mask = 0
+        values = []
+        for i in range(len(self.keys)):
+            value = data.get(self.keys[i])
+            if value is not None:
+                mask |= (1 << i)
+                values.append(value)
+        try:
+            return HEADER.pack(self.type_id, mask) + self.get_struct(mask).pack(*values)
+        except struct.error:
+            return None
+
+    def decode(self, mask, payload):
+        values = self.get_struct(mask).unpack_from(payload, HEADER.size)
+        msg = self.message_class()
+        if mask == self.full_mask:
+            msg.data = dict(zip(self.keys, values))
+        else:
+            keys = [ self.keys[i] for i in range(len(self.keys)) if mask & (1 << i) ]
+            msg.data = dict(zip(keys, values))
+        msg.data.update(self.constants)
+        return msg
+
+BINARY_TYPES = [
+    BinaryType(1, M_PLAYER_UPDATE, PlayerUpdateMessage, PLAYER_FIELDS),
+    BinaryType(2, M_WALL_UPDATE, WallUpdateMessage, OBJECT_FIELDS),
+    BinaryType(3, M_NPC_UPDATE, NPCUpdateMessage, OBJECT_FIELDS),
+    BinaryType(4, M_MISSILE_UPDATE, MissileUpdateMessage, MISSILE_FIELDS),
+    BinaryType(10, M_MISSILE_FIRE_EVENT, MissileFireEventMessage,
+               (('player_oid', 'i'), ('missile_oid', 'i'), ('missile_range', 'f'), ('missile_power', 'f')),
+               { 'kind': E_MISSILE_FIRE }),
+    BinaryType(11, M_MISSILE_MISFIRE_EVENT, MissileMisfireEventMessage,
+               (('player_oid', 'i'),),
+               { 'kind': E_MISSILE_MISFIRE }),
+    BinaryType(12, M_MISSILE_HIT_EVENT, MissileHitEventMessage,
+               (('player_oid', 'i'), ('missile_oid', 'i'), ('target_oid', 'i')),
+               { 'kind': E_MISSILE_HIT }),
+    BinaryType(13, M_MISSILE_DYING_EVENT, MissileDyingEventMessage,
+               (('player_oid', 'i'), ('missile_oid', 'i')),
+               { 'kind': E_MISSILE_DYING }),
+    ]
+TYPES_BY_CODE = dict([ (t.code, t) for t in BINARY_TYPES ])
+TYPES_BY_ID = dict([ (t.type_id, t) for t in BINARY_TYPES ])
+
+#
+# A TickBatchMessage is type id BATCH_TYPE_ID, with the message count
+# in place of the field mask, followed by one record per message:
+#
+#   record kind (1 byte), record size (2 bytes), record
+#
+# where the record is a binary payload as above, or the JSON form of a
+# message that can't be packed.
+#
+BATCH_TYPE_ID = 20
+RECORD_HEADER = struct.Struct('<BH')
+RECORD_BINARY = 0
+RECORD_JSON = 1
+
+def encode_batch(batch):
+    parts = [ HEADER.pack(BATCH_TYPE_ID, len(batch.get_messages())) ]
+    for msg in batch.get_messages():
+        record = encode_message(msg)
+        kind = RECORD_BINARY
+        if record is None:
+            record = str(msg)
+            kind = RECORD_JSON
+        if len(record) > 0xffff:
+            return None
+        parts.append(RECORD_HEADER.pack(kind, len(record)))
+        parts.append(record)
+    return "".join(parts)
+
+def decode_batch(count, payload):
+    batch = TickBatchMessage()
+    pos = HEADER.size
+    for i in range(count):
+        (kind, size) = RECORD_HEADER.unpack_from(payload, pos)
+        pos += RECORD_HEADER.size
+        record = payload[pos:pos + size]
+        if len(record) != size:
+            raise ValueError("short batch record")
+        pos += size
+        if kind == RECORD_BINARY:
+            batch.add_message(decode_message(record))
+        elif kind == RECORD_JSON:
+            batch.add_message(dict_to_message(json.loads(record)))
+        else:
+            raise ValueError("unknown batch record kind %d" % (kind,))
+    if pos != len(payload):
+        raise ValueError("bad binary batch size %d" % (len(payload),))
+    return batch
+
+#
+# A SnapshotMessage is type id SNAPSHOT_TYPE_ID, with the tick in
+# place of the field mask, followed by, for each kind of object in
+# SNAPSHOT_ORDER, a count (4 bytes) and that many rows packed with
+# every field of the kind's update message.
+#
+SNAPSHOT_TYPE_ID = 21
+COUNT = struct.Struct('<I')
+
+def encode_snapshot(snapshot):
+    parts = [ HEADER.pack(SNAPSHOT_TYPE_ID, snapshot.get_tick()) ]
+    try:
+        for code in SNAPSHOT_ORDER:
+            rows = snapshot.get_rows(code)
+            pack = TYPES_BY_CODE[code].full_struct.pack
+            parts.append(COUNT.pack(len(rows)))
+            for row in rows:
+                parts.append(pack(*row))
+    except struct.error:
+        return None
+    return "".join(parts)
+
+def decode_snapshot(tick, payload):
+    snapshot = SnapshotMessage(tick)
+    pos = HEADER.size
+    for code in SNAPSHOT_ORDER:
+        (count,) = COUNT.unpack_from(payload, pos)
+        pos += COUNT.size
+        row_struct = TYPES_BY_CODE[code].full_struct
+        if pos + count * row_struct.size > len(payload):
+            raise ValueError("short snapshot")
+        rows = snapshot.get_rows(code)
+        for i in range(count):
+            rows.append(list(row_struct.unpack_from(payload, pos)))
+            pos += row_struct.size
+    if pos != len(payload):
+        raise ValueError("bad binary snapshot size %d" % (len(payload),))
+    return snapshot
+
+def encode_message(msg):
+    """Returns the binary payload for msg, or None if it must be sent as JSON."""
+    code = msg.get_command()
+    if code == M_TICK_BATCH:
+        return encode_batch(msg)
+    if code == M_SNAPSHOT:
+        return encode_snapshot(msg)
+    btype = TYPES_BY_CODE.get(code)
+    if btype is None:
+        return None
+    return btype.encode(msg)
+
+def decode_message(payload):
+    """Returns the message in payload.  Raises ValueError if it is malformed."""
+    try:
+        (type_id, mask) = HEADER.unpack_from(payload)
+        if type_id == BATCH_TYPE_ID:
+            return decode_batch(mask, payload)
+        if type_id == SNAPSHOT_TYPE_ID:
+            return decode_snapshot(mask, payload)
+        btype = TYPES_BY_ID.get(type_id)
+        if btype is None:
+            raise ValueError("unknown binary message type %d" % (type_id,))
+        if HEADER.size + btype.get_struct(mask).size != len(payload):
+            raise ValueError("bad binary message size %d" % (len(payload),))
+        return btype.decode(mask, payload)
+    except struct.error as e:
+        raise ValueError(str(e))
@@ -96,6 +96,11 @@ class GameData:
         
     def get_objects(self):
         return self.objects
+
+    def set_objects(self, objects):
+        """Replaces every object, with an oid -> object dict."""
+        self.objects = objects
+        return
         
     def update_object(self, obj):
         oid = obj.get_oid()
@@ -1,13 +1,19 @@
 #
 # Don't change this file
 #
-import socket, errno, logging
+import socket, errno, logging, re, collections
 from common.game_message import *
 from common.object_message import *
 from common.command_message import *
 from common.event_message import *
+from common.batch_message import *
+from common.snapshot_message import *
+from common.stats_message import *
+from common.binary_message import M_BINARY, encode_message, decode_message
 
 WINDOWS_EAGAIN = 10035
+# flush() joins small queued chunks into sends of up to this many bytes
+SEND_CHUNK_SIZE = 65536
 
 ALL_MESSAGES = {}
 ALL_MESSAGE_CODES = []
@@ -22,6 +28,12 @@ def setup_message_types():
         ALL_MESSAGES[k] = COMMAND_MESSAGES[k]
     for k in EVENT_MESSAGES:
         ALL_MESSAGES[k] = EVENT_MESSAGES[k]
+    for k in BATCH_MESSAGES:
+        ALL_MESSAGES[k] = BATCH_MESSAGES[k]
+    for k in SNAPSHOT_MESSAGES:
+        ALL_MESSAGES[k] = SNAPSHOT_MESSAGES[k]
+    for k in STATS_MESSAGES:
+        ALL_MESSAGES[k] = STATS_MESSAGES[k]
     ALL_MESSAGE_CODES = ALL_MESSAGES.keys()
     return
 setup_message_types()
@@ -40,7 +52,7 @@ class GameCommException(Exception):
         return self.msg == E_0BYTES
         
     def is_bad_command(self):
-        return self.msg == E_BAD_CMD
+        return self.msg.startswith(E_BAD_CMD)
         
     def get_msg(self):
         return self.msg
@@ -50,87 +62,169 @@ class GameCommException(Exception):
         
 ####################################################################        
 
+RECV_SIZE = 4096
+FRAME_HEADER = re.compile(r'(\S+) (\d+) ')
+
 class GameComm:
+    """
+    Reads and writes GameMessages on one socket, framed as
+    "CODE SIZE payload".  Bytes are received in large chunks and kept
+    in a buffer, so keep one GameComm per socket for its lifetime;
+    a chunk may hold more than one message, or only part of one.
+
+    After set_binary(True), messages that common.binary_message can
+    encode are written as M_BINARY frames.  M_BINARY frames are always
+    understood when reading.
+
+    After set_tick_batches(True), a TickBatchMessage is written as one
+    frame.  Otherwise its messages are written as separate frames, in
+    the same send.
+
+    After set_snapshots(True), a SnapshotMessage is written as one
+    frame.  Otherwise it is written as a full update message for each
+    object.
+
+    For non-blocking sockets, queue_mesgs() and flush() keep the
+    frames the socket would not take, instead of blocking in sendall().
+    """
 
     def __init__(self, sock):
         self.logger = logging.getLogger('GameComm')
         self.ok = True
         self.sock = sock
+        self.buffer = ""
+        self.pos = 0       # start of the unparsed part of buffer
+        self.out = collections.deque() # chunks of frames queued but not yet taken by the socket
+        self.out_pos = 0   # bytes of out[0] already taken
+        self.out_size = 0  # bytes in out, less out_pos
+        self.binary = False
+        self.tick_batches = False
+        self.snapshots = False
         return
 
     def __nonzero__(self):
         return self.ok
-        
-    def _read_int(self):
-        """skips whitespace, reads ascii digits, converts to int.  throws away first non-digit character after"""
-        n = 0
-        first = True
-        while True:
-            try:
-                c = self.sock.recv(1)
-                if len(c) == 0:
-                    self.ok = False
-                    raise GameCommException(E_0BYTES)
-                    break
-                if first and c.isspace():
-                    continue
-                elif c >= '0' and c <= '9':
-                    n = n * 10 + ord(c) - ord('0')
-                    first = False
-                else:
-                    break
-            except socket.error as e:
-                if e.errno == errno.EAGAIN or e.errno == WINDOWS_EAGAIN:
-                    self.logger.warning("_read_int: %s", e.strerror)
-                else:
-                    raise e
-        return n
-        
-    def _read_word(self):
-        """skips whitespace, reads ascii characters, builds a string.  throws away first whitespace character after"""
-        word = ""
-        first = True
-        while True:
-            try:
-                c = self.sock.recv(1)
-                if len(c) == 0:
-                    self.ok = False
-                    raise GameCommException(E_0BYTES)
-                    break
-                if first and c.isspace():
-                    continue
-                elif (not first) and c.isspace():
-                    break
-                else:
-                    word += c
-                    first = False
-            except socket.error as e:
-                if e.errno == errno.EAGAIN or e.errno == WINDOWS_EAGAIN:
-                    self.logger.warning("_read_word: %s", e.strerror)
-                else:
-                    raise e
-        return word
-        
-    def _read_nbytes(self, n):
-        """reads n bytes"""
-        nread = 0
-        msg = ""
-        while n > nread:
+
+    def set_binary(self, value):
+        self.binary = value
+        return
+
+    def set_tick_batches(self, value):
+        self.tick_batches = value
+        return
+
+    def set_snapshots(self, value):
+        self.snapshots = value
+        return
+
+    def get_unread_bytes(self):
+        """Bytes received but not yet parsed, for handing the socket to another process."""
+        return self.buffer[self.pos:]
+
+    def set_unread_bytes(self, data):
+        self.buffer = data
+        self.pos = 0
+        return
+
+    def _fill(self):
+        """one recv() into the buffer.  socket.error (including EAGAIN) is left to the caller"""
+        data = self.sock.recv(RECV_SIZE)
+        if len(data) == 0:
+            self.ok = False
+            raise GameCommException(E_0BYTES)
+        # drop the frames already parsed
+        self.buffer = self.buffer[self.pos:] + data
+        self.pos = 0
+        return
+
+    def _find_frame(self):
+        """
+        Returns (code, start, end) for the first complete frame in the buffer,
+        where buffer[start:end] is the payload, or None if the buffer doesn't
+        hold a complete frame yet.  Like the old byte-at-a-time reader,
+        whitespace before the code and size is skipped, and one character
+        after the size is thrown away.
+        """
+        buf = self.buffer
+        n = len(buf)
+        m = FRAME_HEADER.match(buf, self.pos)
+        if m:
+            # "CODE SIZE ", as written by _mesg_to_frame()
+            i = m.end()
+            end = i + int(m.group(2))
+            if end > n:
+                return None
+            return (m.group(1), i, end)
+        i = self.pos
+        while i < n and buf[i].isspace():
+            i += 1
+        start = i
+        while i < n and not buf[i].isspace():
+            i += 1
+        if i >= n:
+            return None
+        code = buf[start:i]
+        i += 1
+        while i < n and buf[i].isspace():
+            i += 1
+        start = i
+        while i < n and buf[i] >= '0' and buf[i] <= '9':
+            i += 1
+        if i >= n:
+            return None
+        if i > start:
+            size = int(buf[start:i])
+        else:
+            size = 0
+        i += 1
+        if i + size > n:
+            return None
+        return (code, i, i + size)
+
+    def _parse_frame(self):
+        """Takes the first complete frame from the buffer, returns (code, string) or None."""
+        frame = self._find_frame()
+        if frame is None:
+            return None
+        (code, start, end) = frame
+        self.pos = end
+        return (code, self.buffer[start:end])
+
+    def _frame_to_mesg(self, code, string):
+        self.logger.debug('read_mesg: code: %s size: %d string: %r', code, len(string), string)
+        if code == M_BINARY:
             try:
-                msg0 = self.sock.recv(n-nread)
-                if len(msg0) == 0:
-                    self.ok = False
-                    raise GameCommException(E_0BYTES)
-                    break
-                nread += len(msg0)
-                msg += msg0
-            except socket.error as e:
-                if e.errno == errno.EAGAIN or e.errno == WINDOWS_EAGAIN:
-                    self.logger.warning("_read_nbytes: %s", e.strerror)
-                else:
-                    raise e
-        self.logger.debug("'" + msg + "'" + str(len(msg)) + " " + str(n))
-        return msg
+                return decode_message(string)
+            except ValueError as e:
+                self.logger.error("read_mesg: bad binary message: %s", e)
+        elif code in ALL_MESSAGES:
+            msg = ALL_MESSAGES[code](string)
+            self.logger.debug('read_mesg: msg: %s', msg)
+            return msg
+        self.ok = False
+        raise GameCommException(E_BAD_CMD + ":" + code)
+
+    def _exception_to_mesg(self, e):
+        """The message read_mesg() returns in place of the exception e."""
+        if isinstance(e, GameCommException):
+            if e.is_0_bytes_read():
+                return GameMessageClosed()
+            elif e.is_bad_command():
+                return GameMessageBadCommand()
+            self.logger.error("Unexpected GameCommException: %s", e)
+            raise e
+        if e.errno == errno.EAGAIN or e.errno == WINDOWS_EAGAIN:
+            self.logger.debug("read_mesg: %s", e.strerror)
+            return GameMessageEagain()
+        elif e.errno == errno.ETIMEDOUT or e.errno == errno.ECONNRESET:
+            self.logger.debug("read_mesg: %s", e.strerror)
+            return GameMessageClosed()
+        self.logger.error("Unexpected socket.error: %s", e)
+        raise e
+
+    def has_buffered_mesg(self):
+        """True if a complete message is already in the buffer, so read_mesg() won't recv()."""
+        return self.ok and self._find_frame() is not None
 
     def read_mesg(self):
         """Reads one GameMessage object from the socket.
@@ -139,55 +233,58 @@ class GameComm:
              M_NONE if the GameComm has previously failed
              M_CLOSED if a 0 read occurs
              M_BAD_COMMAND if an unknown message type is received
+             M_EAGAIN if a non-blocking socket has no complete message yet
         """
+        if not self.ok:
+            return GameMessage()
         try:
-            msg = GameMessage()
-            if not self.ok:
-                return msg
-            
-            code = self._read_word()
-            self.logger.debug('read_mesg: code: %s', code)
-            size = self._read_int()
-            self.logger.debug('read_mesg: size: %d', size)
-            string = self._read_nbytes(size)
-            self.logger.debug('read_mesg: string: %s', string)
-
-            if code in ALL_MESSAGES:
-                msg = ALL_MESSAGES[code](string)
-                self.logger.debug('read_mesg: msg: %s', msg)
-            else:
-                self.ok = False
-                raise GameCommException(E_BAD_CMD + ":" + code)
+            frame = self._parse_frame()
+            while frame is None:
+                self._fill()
+                frame = self._parse_frame()
+            return self._frame_to_mesg(frame[0], frame[1])
+        except (GameCommException, socket.error) as e:
+            return self._exception_to_mesg(e)
 
-            return msg
-        except GameCommException as e:
-            if e.is_0_bytes_read():
-                msg = GameMessageClosed()
-            elif e.is_bad_command():
-                msg = GameMessageBadCommand()
-            else:
-                self.logger.error("Unexpected GameCommException: %s", e)
-                raise e
-        except socket.error as e:
-            if e.errno == errno.EAGAIN or e.errno == WINDOWS_EAGAIN:
-                self.logger.debug("read_mesg: %s", e.strerror)
-                msg = GameMessageEagain()
-            elif e.errno == errno.ETIMEDOUT:
-                self.logger.debug("read_mesg: %s", e.strerror)
-                msg = GameMessageClosed()
-            elif e.errno == errno.ECONNRESET:
-                self.logger.debug("read_mesg: %s", e.strerror)
-                msg = GameMessageClosed()
-            else:
-                self.logger.error("Unexpected socket.error: %s", e)
-                raise e
-                
-        return msg
+    def read_mesgs(self):
+        """Reads all complete messages available, with at most one recv().
+           Only calls recv() if the buffer doesn't already hold a complete
+           message, so it won't block after poll() reports the socket readable.
+           Returns a list of GameMessages, which may be empty.  A closed
+           socket or bad command ends the list with M_CLOSED or M_BAD_COMMAND.
+        """
+        msgs = []
+        if not self.ok:
+            return msgs
+        try:
+            frame = self._parse_frame()
+            if frame is None:
+                self._fill()
+                frame = self._parse_frame()
+            while frame is not None:
+                msgs.append(self._frame_to_mesg(frame[0], frame[1]))
+                frame = self._parse_frame()
+        except (GameCommException, socket.error) as e:
+            msg = self._exception_to_mesg(e)
+            if msg.get_command() != M_EAGAIN:
+                msgs.append(msg)
+        return msgs
 
-    def _write_mesg(self, code, size, text):
-        string = "%s %d %s" % (code, size, text)
-        self.sock.sendall(string)
-        return
+    def _mesg_to_frame(self, msg):
+        code = msg.get_command()
+        if code not in ALL_MESSAGE_CODES:
+            self.ok = False
+            raise GameCommException(E_BAD_CMD + ":" + code)
+        if code == M_TICK_BATCH and not self.tick_batches:
+            return "".join([ self._mesg_to_frame(m) for m in msg.get_messages() ])
+        if code == M_SNAPSHOT and not self.snapshots:
+            return "".join([ self._mesg_to_frame(m) for m in msg.get_object_messages() ])
+        if self.binary:
+            payload = encode_message(msg)
+            if payload is not None:
+                return "%s %d %s" % (M_BINARY, len(payload), payload)
+        string = msg.to_string()
+        return "%s %d %s" % (code, len(string), string)
         
     def write_mesg(self, msg):
         try:
@@ -196,20 +293,11 @@ class GameComm:
                 return False
             
             self.logger.debug('write_mesg: msg: %s', msg)
-            code = msg.get_command()
-            
-            if code in ALL_MESSAGE_CODES:
-                # known command
-                string = msg.to_string()
-                size = len(string)
-                self._write_mesg(code, size, string)
-            else:
-                self.ok = False
-                raise GameCommException(E_BAD_CMD)
+            self.sock.sendall(self._mesg_to_frame(msg))
 
         except GameCommException as e:
             if e.is_bad_command():
-                self.logger.error('write_mesg: bad command %s', code)
+                self.logger.error('write_mesg: %s', e)
                 return False
             else:
                 self.logger.error('write_mesg: exception %s', e)
@@ -225,3 +313,90 @@ class GameComm:
                 
         return True
         
+
+    def encode_mesgs(self, msgs):
+        """The frames for msgs, as this GameComm would write them."""
+        frames = []
+        for msg in msgs:
+            self.logger.debug('encode_mesgs: msg: %s', msg)
+            frames.append(self._mesg_to_frame(msg))
+        return "".join(frames)
+
+    def get_format(self):
+        """GameComms with the same format write the same bytes for the same messages."""
+        return (self.binary, self.tick_batches, self.snapshots)
+
+    def queue_mesgs(self, msgs):
+        """Adds frames for msgs to the output queue, to be sent by flush()."""
+        self.queue_bytes(self.encode_mesgs(msgs))
+        return
+
+    def queue_bytes(self, data):
+        """Adds frames already made by encode_mesgs() to the output queue."""
+        if data:
+            self.out.append(data)
+            self.out_size += len(data)
+        return
+
+    def has_unsent(self):
+        return self.out_size > 0
+
+    def get_unsent_size(self):
+        return self.out_size
+
+    def flush(self):
+        """Sends as much of the output queue as the socket takes without blocking.
+           Returns True if it is empty.  Errors other than EAGAIN are raised.
+        """
+        while self.out:
+            if (self.out_pos == 0 and len(self.out) > 1 and
+                len(self.out[0]) + len(self.out[1]) <= SEND_CHUNK_SIZE):
+                # one send for many small chunks
+                chunks = []
+                size = 0
+                while self.out and size + len(self.out[0]) <= SEND_CHUNK_SIZE:
+                    size += len(self.out[0])
+                    chunks.append(self.out.popleft())
+                self.out.appendleft("".join(chunks))
+            try:
+                count = self.sock.send(buffer(self.out[0], self.out_pos))
+            except socket.error as e:
+                if e.errno == errno.EAGAIN or e.errno == WINDOWS_EAGAIN:
+                    return False
+                raise e
+            self.out_pos += count
+            self.out_size -= count
+            if self.out_pos >= len(self.out[0]):
+                self.out.popleft()
+                self.out_pos = 0
+        return True
+
+    def write_mesgs(self, msgs):
+        """Writes a list of GameMessages with a single sendall().  Returns False on error."""
+        try:
+            if not self.ok:
+                self.logger.error('write_mesgs: self.ok = False')
+                return False
+
+            frames = []
+            for msg in msgs:
+                self.logger.debug('write_mesgs: msg: %s', msg)
+                frames.append(self._mesg_to_frame(msg))
+            if frames:
+                self.sock.sendall("".join(frames))
+
+        except GameCommException as e:
+            if e.is_bad_command():
+                self.logger.error('write_mesgs: %s', e)
+                return False
+            else:
+                self.logger.error('write_mesgs: exception %s', e)
+                raise e
+        except socket.error as e:
+            if e.errno == errno.EAGAIN or e.errno == WINDOWS_EAGAIN:
+                self.logger.warning("write_mesgs: %s", e.strerror)
+                return False
+            else:
+                raise e
+
+        return True
@@ -25,6 +25,10 @@ M_CLOSED         = "CLOSED"
 M_BAD_COMMAND    = "BAD_COMMAND"
 M_EAGAIN         = "EAGAIN"
 
+# encodings a client can ask for at login, see common/binary_message.py
+ENCODING_JSON    = "json"
+ENCODING_BINARY  = "binary"
+
 ####################################################################        
         
 class GameMessage:
@@ -50,6 +54,9 @@ class GameMessage:
             return None
         return self.data[key]
 
+    def has_data(self, key):
+        return key in self.data
+
     def to_string(self):
         return str(self)
         
@@ -111,6 +118,10 @@ class GameMessageLogin(GameMessage):
         self.set_user('')          # user
         self.set_request(False)    # True if client->server request, False if server->client response
         self.set_result(False)     # If is response, True  if login successful, False otherwise
+        self.set_encoding(ENCODING_JSON) # request: encoding wanted for updates, response: encoding granted
+        self.set_partial_updates(False)  # request: client can apply updates with only the changed fields
+        self.set_tick_batches(False)     # request: client understands TickBatchMessage
+        self.set_snapshots(False)        # request: client understands SnapshotMessage
         return
         
     def set_user(self, user):
@@ -134,6 +145,41 @@ class GameMessageLogin(GameMessage):
     def get_result(self):
         return self.get_data('result')
 
+    def set_encoding(self, value):
+        self.set_data('encoding', value)
+        return
+        
+    def get_encoding(self):
+        """Older clients and servers don't send an encoding, which means ENCODING_JSON."""
+        encoding = self.get_data('encoding')
+        if encoding is None:
+            return ENCODING_JSON
+        return encoding
+
+    def set_partial_updates(self, value):
+        self.set_data('partial_updates', value)
+        return
+        
+    def get_partial_updates(self):
+        """Older clients don't send it; they need every field in every update."""
+        return self.get_data('partial_updates') == True
+
+    def set_tick_batches(self, value):
+        self.set_data('tick_batches', value)
+        return
+        
+    def get_tick_batches(self):
+        """Older clients don't send it; they get each message of a tick batch on its own."""
+        return self.get_data('tick_batches') == True
+
+    def set_snapshots(self, value):
+        self.set_data('snapshots', value)
+        return
+        
+    def get_snapshots(self):
+        """Older clients don't send it; they get a snapshot as one update message per object."""
+        return self.get_data('snapshots') == True
+
 def string_to_login_message(string):
     msg = GameMessageLogin()
     msg.from_string(string)
@@ -221,9 +267,21 @@ def string_to_wait_for_ai_message(string):
     return msg
     
 class RequestViewMessage(GameMessage):
-    def __init__(self):
+    def __init__(self, player_name=""):
         GameMessage.__init__(self, M_REQUEST_VIEW)
+        self.set_player_name(player_name) # watch this player's match, "" for any
+        return
+
+    def set_player_name(self, player_name):
+        self.set_data('player_name', player_name)
         return
+
+    def get_player_name(self):
+        """Older clients don't send it, and watch any match."""
+        name = self.get_data('player_name')
+        if name is None:
+            return ""
+        return name
         
 def string_to_request_view_message(string):
     msg = RequestViewMessage()
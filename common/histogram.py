@@ -0,0 +1,63 @@
+import bisect, math
+
+class Histogram:
+    """
+    Times in milliseconds, kept as counts in buckets with their count,
+    sum, sum of squares and maximum, so they can be added to every tick
+    without keeping every sample.  buckets are the sorted upper bounds
+    of the buckets, there is one more for anything above the last.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [ 0 ] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.
+        self.squares = 0.
+        self.max = 0.
+        return
+
+    def add(self, ms):
+        self.counts[bisect.bisect_left(self.buckets, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.squares += ms * ms
+        if ms > self.max:
+            self.max = ms
+        return
+
+    def merge(self, other):
+        """Adds the samples of other, which has the same buckets."""
+        for i in range(len(self.counts)):
+            self.counts[i] += other.counts[i]
+        self.count += other.count
+        self.total += other.total
+        self.squares += other.squares
+        self.max = max(self.max, other.max)
+        return
+
+    def get_percentile(self, p):
+        """Upper bound of the bucket holding the p'th percentile, the maximum for the last bucket."""
+        if self.count == 0:
+            return 0.
+        rank = p / 100. * self.count
+        seen = 0
+        for i in range(len(self.buckets)):
+            seen += self.counts[i]
+            if seen >= rank:
+                return min(self.buckets[i], self.max)
+        return self.max
+
+    def get_stats(self):
+        mean = 0.
+        stddev = 0.
+        if self.count:
+            mean = self.total / self.count
+            stddev = math.sqrt(max(0., self.squares / self.count - mean * mean))
+        return { 'count': self.count,
+                 'mean': mean,
+                 'stddev': stddev,
+                 'max': self.max,
+                 'p50': self.get_percentile(50.),
+                 'p99': self.get_percentile(99.),
+                 'buckets': list(self.counts) }
@@ -32,10 +32,14 @@ class MissileData(ObjectData):
         
     def set_from_message(self, msg):
         ObjectData.set_from_message(self, msg)
-        self.set_range(msg.get_data('range'))
-        self.set_power(msg.get_data('power'))
-        self.set_player_oid(msg.get_data('player_oid'))
-        self.set_hit_max_range(msg.get_data('hit_max_range'))
+        if msg.has_data('range'):
+            self.set_range(msg.get_data('range'))
+        if msg.has_data('power'):
+            self.set_power(msg.get_data('power'))
+        if msg.has_data('player_oid'):
+            self.set_player_oid(msg.get_data('player_oid'))
+        if msg.has_data('hit_max_range'):
+            self.set_hit_max_range(msg.get_data('hit_max_range'))
         return
 
     def get_range(self):
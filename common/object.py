@@ -77,19 +77,33 @@ class ObjectData:
         return
 
     def set_from_message(self, msg):
-        self.set_oid(msg.get_data('oid'))
-        self.set_x(msg.get_data('x'))
-        self.set_y(msg.get_data('y'))
-        self.set_w(msg.get_data('w'))
-        self.set_h(msg.get_data('h'))
-        self.set_dx(msg.get_data('dx'))
-        self.set_dy(msg.get_data('dy'))
-        self.set_distance(msg.get_data('distance'))
-        self.set_speed(msg.get_data('speed'))
-        self.set_state(msg.get_data('state'))
-        self.set_health(msg.get_data('health'))
-        self.set_max_health(msg.get_data('max_health'))
-        self.set_dying_percent(msg.get_data('dying_percent'))
+        """Sets the fields in msg.  Update messages may hold only the fields that changed."""
+        if msg.has_data('oid'):
+            self.set_oid(msg.get_data('oid'))
+        if msg.has_data('x'):
+            self.set_x(msg.get_data('x'))
+        if msg.has_data('y'):
+            self.set_y(msg.get_data('y'))
+        if msg.has_data('w'):
+            self.set_w(msg.get_data('w'))
+        if msg.has_data('h'):
+            self.set_h(msg.get_data('h'))
+        if msg.has_data('dx'):
+            self.set_dx(msg.get_data('dx'))
+        if msg.has_data('dy'):
+            self.set_dy(msg.get_data('dy'))
+        if msg.has_data('distance'):
+            self.set_distance(msg.get_data('distance'))
+        if msg.has_data('speed'):
+            self.set_speed(msg.get_data('speed'))
+        if msg.has_data('state'):
+            self.set_state(msg.get_data('state'))
+        if msg.has_data('health'):
+            self.set_health(msg.get_data('health'))
+        if msg.has_data('max_health'):
+            self.set_max_health(msg.get_data('max_health'))
+        if msg.has_data('dying_percent'):
+            self.set_dying_percent(msg.get_data('dying_percent'))
         return
         
     def get_oid(self):
@@ -81,8 +81,18 @@ def string_to_missile_update_message(string):
     return msg
 
 
-def message_to_object(msg):
+def message_to_object(msg, obj=None):
+    """
+    Returns the object described by an update message.  If obj is
+    given, the message is applied to it, so a message with only
+    the changed fields updates an object the client already has.
+    """
     code = msg.get_command()
+    if code not in OBJECT_MESSAGES:
+        return None
+    if obj is not None:
+        obj.set_from_message(msg)
+        return obj
     if code == M_WALL_UPDATE:
         obj = WallData()
     elif code == M_NPC_UPDATE:
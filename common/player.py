@@ -53,17 +53,28 @@ class PlayerData(ObjectData):
         
     def set_from_message(self, msg):
         ObjectData.set_from_message(self, msg)
-        self.set_experience(msg.get_data('experience'))
-        self.set_missile_range(msg.get_data('missile_range'))
-        self.set_missile_dx(msg.get_data('missile_dx'))
-        self.set_missile_dy(msg.get_data('missile_dy'))
-        self.set_missile_power(msg.get_data('missile_power'))
-        self.set_missile_mana(msg.get_data('missile_mana'))
-        self.set_missile_mana_recharge_rate(msg.get_data('missile_mana_recharge_rate'))
-        self.set_missile_mana_max(msg.get_data('missile_mana_max'))
-        self.set_move_mana(msg.get_data('move_mana'))
-        self.set_move_mana_recharge_rate(msg.get_data('move_mana_recharge_rate'))
-        self.set_move_mana_max(msg.get_data('move_mana_max'))
+        if msg.has_data('experience'):
+            self.set_experience(msg.get_data('experience'))
+        if msg.has_data('missile_range'):
+            self.set_missile_range(msg.get_data('missile_range'))
+        if msg.has_data('missile_dx'):
+            self.set_missile_dx(msg.get_data('missile_dx'))
+        if msg.has_data('missile_dy'):
+            self.set_missile_dy(msg.get_data('missile_dy'))
+        if msg.has_data('missile_power'):
+            self.set_missile_power(msg.get_data('missile_power'))
+        if msg.has_data('missile_mana'):
+            self.set_missile_mana(msg.get_data('missile_mana'))
+        if msg.has_data('missile_mana_recharge_rate'):
+            self.set_missile_mana_recharge_rate(msg.get_data('missile_mana_recharge_rate'))
+        if msg.has_data('missile_mana_max'):
+            self.set_missile_mana_max(msg.get_data('missile_mana_max'))
+        if msg.has_data('move_mana'):
+            self.set_move_mana(msg.get_data('move_mana'))
+        if msg.has_data('move_mana_recharge_rate'):
+            self.set_move_mana_recharge_rate(msg.get_data('move_mana_recharge_rate'))
+        if msg.has_data('move_mana_max'):
+            self.set_move_mana_max(msg.get_data('move_mana_max'))
         return
         
     def get_experience(self):
@@ -0,0 +1,115 @@
+import json
+from common.game_message import *
+from common.object_message import *
+from common.player  import PlayerData
+from common.wall  import WallData
+from common.npc  import NPCData
+from common.missile  import MissileData
+from common.object import STATE_DEAD
+
+M_SNAPSHOT         = "SNAPSHOT"
+M_REQUEST_SNAPSHOT = "REQUEST_SNAPSHOT"
+
+# the fields of each kind of object, in the order they are kept in a
+# snapshot row, and sent in binary update messages.  The keys are also
+# the attribute names of the *Data classes.
+OBJECT_FIELDS = (('oid', 'i'), ('x', 'f'), ('y', 'f'), ('w', 'f'), ('h', 'f'),
+                 ('dx', 'f'), ('dy', 'f'), ('distance', 'f'), ('speed', 'f'),
+                 ('state', 'B'), ('health', 'f'), ('max_health', 'f'), ('dying_percent', 'f'))
+
+PLAYER_FIELDS = OBJECT_FIELDS + (('experience', 'f'), ('missile_range', 'f'),
+                                 ('missile_dx', 'f'), ('missile_dy', 'f'), ('missile_power', 'f'),
+                                 ('missile_mana', 'f'), ('missile_mana_recharge_rate', 'f'),
+                                 ('missile_mana_max', 'f'), ('move_mana', 'f'),
+                                 ('move_mana_recharge_rate', 'f'), ('move_mana_max', 'f'))
+
+MISSILE_FIELDS = OBJECT_FIELDS + (('range', 'f'), ('power', 'f'), ('player_oid', 'i'),
+                                  ('hit_max_range', '?'))
+
+# update message code -> (data class, message class, fields)
+SNAPSHOT_KINDS = { M_WALL_UPDATE:    (WallData, WallUpdateMessage, OBJECT_FIELDS),
+                   M_NPC_UPDATE:     (NPCData, NPCUpdateMessage, OBJECT_FIELDS),
+                   M_MISSILE_UPDATE: (MissileData, MissileUpdateMessage, MISSILE_FIELDS),
+                   M_PLAYER_UPDATE:  (PlayerData, PlayerUpdateMessage, PLAYER_FIELDS) }
+SNAPSHOT_ORDER = [ M_WALL_UPDATE, M_NPC_UPDATE, M_MISSILE_UPDATE, M_PLAYER_UPDATE ]
+
+class SnapshotMessage(GameMessage):
+    """
+    Every object in the game at one tick, the keyframe a client needs
+    when it has nothing yet, or may have missed something.  Objects are
+    kept as rows of field values, one list of rows per kind of object,
+    so there are no per object keys to send.  The client replaces all
+    of its objects with these, see ClientGameEngine.apply_snapshot().
+
+    Clients that don't ask for snapshots at login get one full update
+    message per object instead, see GameComm.
+    """
+
+    def __init__(self, tick=0):
+        GameMessage.__init__(self, M_SNAPSHOT)
+        self.set_data('tick', tick)
+        self.set_data('objects', dict([ (code, []) for code in SNAPSHOT_ORDER ]))
+        return
+
+    def get_tick(self):
+        return self.get_data('tick')
+
+    def add_message(self, msg):
+        """Adds the object in a full update message."""
+        (data_class, message_class, fields) = SNAPSHOT_KINDS[msg.get_command()]
+        data = msg.data
+        self.data['objects'][msg.get_command()].append([ data[key] for (key, fmt) in fields ])
+        return
+
+    def get_rows(self, code):
+        """Rows of field values for the objects with update message code."""
+        return self.data['objects'].get(code, [])
+
+    def get_object_count(self):
+        return sum([ len(rows) for rows in self.data['objects'].values() ])
+
+    def get_objects(self):
+        """A new oid -> *Data dict of the objects that aren't dead."""
+        objects = {}
+        for code in SNAPSHOT_ORDER:
+            (data_class, message_class, fields) = SNAPSHOT_KINDS[code]
+            keys = [ key for (key, fmt) in fields ]
+            for row in self.get_rows(code):
+                obj = data_class()
+                # the keys are the attribute names, skip the setters
+                obj.__dict__.update(zip(keys, row))
+                if obj.state != STATE_DEAD:
+                    objects[obj.oid] = obj
+        return objects
+
+    def get_object_messages(self):
+        """One full update message per object, for clients that don't take snapshots."""
+        msgs = []
+        for code in SNAPSHOT_ORDER:
+            (data_class, message_class, fields) = SNAPSHOT_KINDS[code]
+            keys = [ key for (key, fmt) in fields ]
+            for row in self.get_rows(code):
+                msg = message_class()
+                msg.data = dict(zip(keys, row))
+                msgs.append(msg)
+        return msgs
+
+def string_to_snapshot_message(string):
+    msg = SnapshotMessage()
+    msg.from_string(string)
+    return msg
+
+class RequestSnapshotMessage(GameMessage):
+    """Asks the server for a SnapshotMessage, before the next keyframe is due."""
+    def __init__(self):
+        GameMessage.__init__(self, M_REQUEST_SNAPSHOT)
+        return
+
+def string_to_request_snapshot_message(string):
+    msg = RequestSnapshotMessage()
+    msg.from_string(string)
+    return msg
+
+#
+SNAPSHOT_MESSAGES = { M_SNAPSHOT:         string_to_snapshot_message,
+                      M_REQUEST_SNAPSHOT: string_to_request_snapshot_message }
@@ -0,0 +1,40 @@
+from common.game_message import *
+
+M_REQUEST_STATS = "REQUEST_STATS"
+M_STATS         = "STATS"
+
+class RequestStatsMessage(GameMessage):
+    """Asks the lobby for the tick profile of every running match."""
+    def __init__(self):
+        GameMessage.__init__(self, M_REQUEST_STATS)
+        return
+
+def string_to_request_stats_message(string):
+    msg = RequestStatsMessage()
+    msg.from_string(string)
+    return msg
+
+class StatsMessage(GameMessage):
+    """
+    The lobby's answer to RequestStatsMessage.  One dictionary per
+    running match, with its 'match_id', the players' 'names', and its
+    'profile', or None if matches aren't profiled.
+    """
+    def __init__(self, matches=None):
+        GameMessage.__init__(self, M_STATS)
+        if matches is None:
+            matches = []
+        self.set_data('matches', matches)
+        return
+
+    def get_matches(self):
+        return self.get_data('matches')
+
+def string_to_stats_message(string):
+    msg = StatsMessage()
+    msg.from_string(string)
+    return msg
+
+#
+STATS_MESSAGES = { M_REQUEST_STATS: string_to_request_stats_message,
+                   M_STATS:         string_to_stats_message }
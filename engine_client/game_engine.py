@@ -44,6 +44,8 @@ from common.object_message import message_to_object
 from common.event_message import message_to_event
 from common.command_message import *
 from common.game_message import *
+from common.batch_message import M_TICK_BATCH
+from common.snapshot_message import M_SNAPSHOT, RequestSnapshotMessage
 
 MODE_DUAL = 1
 MODE_SINGLE = 2
@@ -82,6 +84,10 @@ class ClientGameEngine:
         msg = GameMessageLogin()
         msg.set_user(self.data.get_name())
         msg.set_request(True)
+        msg.set_encoding(ENCODING_BINARY)
+        msg.set_partial_updates(True)
+        msg.set_tick_batches(True)
+        msg.set_snapshots(True)
         self.add_message(msg)
         return
 
@@ -113,7 +119,16 @@ class ClientGameEngine:
         Other message types should be handled as well.
         """
         self.logger.debug('process_server_message')
-        obj = message_to_object(msg)
+        if msg.get_command() == M_TICK_BATCH:
+            # everything the server sent for one tick
+            for m in msg.get_messages():
+                self.process_server_message(m)
+            return
+        if msg.get_command() == M_SNAPSHOT:
+            self.apply_snapshot(msg)
+            return
+        # updates may hold only the changed fields, so apply them to the object we have
+        obj = message_to_object(msg, self.data.get_object(msg.get_data('oid')))
         event = message_to_event(msg)
         if obj is not None:
             self.logger.debug('update_object:(%s)', obj)
@@ -171,6 +186,19 @@ class ClientGameEngine:
                 self.logger.error("Unknown message type: %s", msg)
         return
 
+    def apply_snapshot(self, msg):
+        """Replaces every object with those in a SnapshotMessage, all at once."""
+        objects = msg.get_objects()
+        self.data.set_objects(objects)
+        if self.player_oid > 0 and self.player_oid not in objects:
+            self.player_oid = -1
+        self.opponent_oid = -1
+        if self.player_oid > 0:
+            for oid in objects:
+                if objects[oid].is_player() and oid != self.player_oid:
+                    self.opponent_oid = oid
+        return
+
     def __str__(self):
         return "ClientGameEngine(%d):\n%s" % (self.player_oid, self.data)
 
@@ -199,6 +227,11 @@ class ClientGameEngine:
     def get_objects(self):
         return self.data.get_objects()
 
+    def request_snapshot(self):
+        """Asks the server to resend every object, if the client may have missed updates."""
+        self.add_message(RequestSnapshotMessage())
+        return
+
     #
     # Game Action Methods
     #
@@ -0,0 +1,343 @@
+import logging
+try:
+    import numpy
+except ImportError:
+    numpy = None
+from common.object import STATE_ALIVE
+from game_engine import GameEngine
+from collision import time_of_impact
+from config import *
+
+INFINITY = float('inf')
+
+# columns of ObjectArrays, one row of the buffer each
+FIELDS = ('x', 'y', 'w', 'h', 'dx', 'dy', 'speed', 'distance',
+          'health', 'max_health', 'dying_percent', 'state', 'range')
+FIELD_INDEX = dict([ (FIELDS[i], i) for i in range(len(FIELDS)) ])
+
+# message fields that are not kept in the arrays, by data class
+PLAYER_MESSAGE_FIELDS = ('experience', 'missile_range', 'missile_dx', 'missile_dy', 'missile_power',
+                         'missile_mana', 'missile_mana_recharge_rate', 'missile_mana_max',
+                         'move_mana', 'move_mana_recharge_rate', 'move_mana_max')
+MISSILE_MESSAGE_FIELDS = ('range', 'power', 'player_oid', 'hit_max_range')
+
+def data_to_row(data):
+    if data.is_missile():
+        mrange = data.range
+    else:
+        mrange = INFINITY
+    return (data.x, data.y, data.w, data.h, data.dx, data.dy, data.speed, data.distance,
+            data.health, data.max_health, data.dying_percent, data.state, mrange)
+
+class ObjectArrays:
+    """
+    Struct-of-arrays copy of the state of every object that can move.
+    Each field in FIELDS is one row of self.values, and each object
+    owns one column (slot).  Slots are kept packed, so the first
+    self.count columns are the live objects.
+    """
+
+    def __init__(self, capacity=64):
+        self.count = 0
+        self.slots = {}     # oid -> slot
+        self.objects = []   # slot -> object
+        self.values = numpy.zeros((len(FIELDS), capacity))
+        self.oids = numpy.zeros(capacity, dtype=int)
+        return
+
+    def column(self, name):
+        return self.values[FIELD_INDEX[name], :self.count]
+
+    def grow(self):
+        capacity = 2 * self.values.shape[1]
+        values = numpy.zeros((len(FIELDS), capacity))
+        values[:, :self.count] = self.values[:, :self.count]
+        oids = numpy.zeros(capacity, dtype=int)
+        oids[:self.count] = self.oids[:self.count]
+        self.values = values
+        self.oids = oids
+        return
+
+    def add(self, obj):
+        if self.count == self.values.shape[1]:
+            self.grow()
+        oid = obj.get_object_id()
+        slot = self.count
+        self.count += 1
+        self.slots[oid] = slot
+        self.objects.append(obj)
+        self.oids[slot] = oid
+        self.load([obj])
+        return
+
+    def remove(self, oid):
+        if oid not in self.slots:
+            return
+        slot = self.slots.pop(oid)
+        last = self.count - 1
+        if slot != last:
+            # move the last object into the hole
+            moved = self.objects[last]
+            self.values[:, slot] = self.values[:, last]
+            self.oids[slot] = self.oids[last]
+            self.objects[slot] = moved
+            self.slots[moved.get_object_id()] = slot
+        self.objects.pop()
+        self.count -= 1
+        return
+
+    def get_slots(self, objs):
+        slots = []
+        for obj in objs:
+            slot = self.slots.get(obj.get_object_id())
+            if slot is not None:
+                slots.append(slot)
+        return slots
+
+    def load(self, objs):
+        """Copy the current state of objs into the arrays."""
+        objs = [ obj for obj in objs if obj.get_object_id() in self.slots ]
+        if not objs:
+            return
+        slots = self.get_slots(objs)
+        rows = [ data_to_row(obj.get_data()) for obj in objs ]
+        self.values[:, slots] = numpy.array(rows).T
+        return
+
+    def get_message_data(self, obj):
+        """Returns a dictionary of the ObjectData message fields, from the arrays."""
+        oid = obj.get_object_id()
+        row = self.values[:, self.slots[oid]].tolist()
+        data = { 'oid': oid }
+        for i in range(len(FIELDS) - 1): # range is sent by MissileData only
+            data[FIELDS[i]] = row[i]
+        data['state'] = int(row[FIELD_INDEX['state']])
+        return data
+
+
+class ArrayGameEngine(GameEngine):
+    """
+    GameEngine that keeps position, size, velocity, health and state
+    of the players, npcs and missiles in ObjectArrays.  Object behaviour
+    (npc wandering, player mana, missile range) still runs on the
+    objects, but moving and broadphase collision tests are done on all
+    movers at once with array operations.  Only movers whose swept
+    boxes overlap something are solved one at a time, in the same order
+    as GameEngine, so the results match GameEngine exactly.
+    """
+
+    def __init__(self, seed=None):
+        self.logger = logging.getLogger('ArrayGameEngine')
+        GameEngine.__init__(self, seed)
+        return
+
+    def new_game(self):
+        self.arrays = ObjectArrays()
+        GameEngine.new_game(self)
+        return
+
+    def make_walls(self):
+        GameEngine.make_walls(self)
+        self.wall_entries = [ (oid, self.walls[oid].get_box()) for oid in self.walls ]
+        boxes = numpy.array([ box for (oid, box) in self.wall_entries ]).reshape((-1, 4))
+        self.wall_x0 = boxes[:, 0]
+        self.wall_y0 = boxes[:, 1]
+        self.wall_x1 = boxes[:, 0] + boxes[:, 2]
+        self.wall_y1 = boxes[:, 1] + boxes[:, 3]
+        return
+
+    def add_player(self, p):
+        GameEngine.add_player(self, p)
+        self.arrays.add(p)
+        return
+
+    def add_npc(self, n):
+        GameEngine.add_npc(self, n)
+        self.arrays.add(n)
+        return
+
+    def add_missile(self, m):
+        GameEngine.add_missile(self, m)
+        self.arrays.add(m)
+        return
+
+    def delete_object(self, oid):
+        self.arrays.remove(oid)
+        GameEngine.delete_object(self, oid)
+        return
+
+    def evolve(self, dt):
+        GameEngine.evolve(self, dt)
+        # collisions, dying and respawns change objects after they move
+        self.arrays.load(self.get_changed_objects())
+        return
+
+    def evolve_objects(self, objs, dt):
+        for obj in objs:
+            obj.hit_oid = -1
+            obj.begin_evolve(self, dt)
+        movers = [ obj for obj in objs if obj.get_object_id() in self.arrays.slots ]
+        self.arrays.load(movers)
+        # order[slot] is the position of the object in objs
+        order = numpy.zeros(self.arrays.count, dtype=int)
+        order[self.arrays.get_slots(movers)] = numpy.arange(len(movers))
+        self.move_objects(dt, order)
+        for obj in objs:
+            obj.end_evolve(self, dt)
+        return
+
+    def move_objects(self, dt, order):
+        a = self.arrays
+        if a.count == 0:
+            return
+        x = a.column('x')
+        y = a.column('y')
+        w = a.column('w')
+        h = a.column('h')
+        dx = a.column('dx')
+        dy = a.column('dy')
+        speed = a.column('speed')
+        distance = a.column('distance')
+        alive = a.column('state') == STATE_ALIVE
+        moving = (alive & (numpy.abs(speed) > EPSILON) &
+                  ((numpy.abs(dx) > 0.) | (numpy.abs(dy) > 0.)))
+        movers = numpy.flatnonzero(moving)
+        if len(movers) == 0:
+            return
+
+        # swept boxes; objects that don't move sweep their own box
+        nx = x + dx * speed * dt
+        ny = y + dy * speed * dt
+        x0 = numpy.where(moving, numpy.minimum(x, nx), x)
+        y0 = numpy.where(moving, numpy.minimum(y, ny), y)
+        x1 = numpy.where(moving, numpy.maximum(x, nx), x) + w
+        y1 = numpy.where(moving, numpy.maximum(y, ny), y) + h
+
+        # broadphase, every mover against every object and wall
+        mx0 = x0[movers, None]
+        my0 = y0[movers, None]
+        mx1 = x1[movers, None]
+        my1 = y1[movers, None]
+        near = ((mx0 <= x1[None, :]) & (mx1 >= x0[None, :]) &
+                (my0 <= y1[None, :]) & (my1 >= y0[None, :]) &
+                alive[None, :])
+        near[numpy.arange(len(movers)), movers] = False
+        near_walls = ((mx0 <= self.wall_x1[None, :]) & (mx1 >= self.wall_x0[None, :]) &
+                      (my0 <= self.wall_y1[None, :]) & (my1 >= self.wall_y0[None, :]))
+        contested = near.any(axis=1) | near_walls.any(axis=1)
+
+        # movers that can't touch anything make the whole move at once
+        free = movers[~contested]
+        distance[free] += numpy.abs(x[free] - nx[free]) + numpy.abs(y[free] - ny[free])
+        x[free] = nx[free]
+        y[free] = ny[free]
+
+        # the rest are solved one at a time, in GameEngine order
+        rows = numpy.flatnonzero(contested)
+        rows = rows[numpy.argsort(order[movers[rows]], kind='mergesort')]
+        mrange = a.column('range')
+        for r in rows:
+            i = movers[r]
+            self.move_one(i, numpy.flatnonzero(near[r]), numpy.flatnonzero(near_walls[r]), alive, dt)
+            if distance[i] > mrange[i]:
+                # the missile starts dying in end_evolve, so later movers pass through it
+                alive[i] = False
+
+        # copy results back to the objects
+        for i in movers:
+            obj = a.objects[i]
+            data = obj.get_data()
+            new_x = float(x[i])
+            new_y = float(y[i])
+            if abs(new_x - data.x) > EPSILON or abs(new_y - data.y) > EPSILON:
+                obj.mark_changed('x', 'y')
+            data.x = new_x
+            data.y = new_y
+            data.distance = float(distance[i])
+            obj.mark_changed('distance')
+            self.object_moved(obj)
+        return
+
+    def move_one(self, i, near, near_walls, alive, dt):
+        """Object.move_swept() for the mover in slot i, reading positions from the arrays."""
+        a = self.arrays
+        values = a.values
+        X = FIELD_INDEX['x']
+        Y = FIELD_INDEX['y']
+        W = FIELD_INDEX['w']
+        H = FIELD_INDEX['h']
+        x = float(values[X, i])
+        y = float(values[Y, i])
+        w = float(values[W, i])
+        h = float(values[H, i])
+        dx = float(values[FIELD_INDEX['dx'], i])
+        dy = float(values[FIELD_INDEX['dy'], i])
+        speed = float(values[FIELD_INDEX['speed'], i])
+        vx = dx * speed
+        vy = dy * speed
+        hit_oid = -1
+        hit_t = dt
+        hit_v = 0.
+        candidates = [ self.wall_entries[k] for k in near_walls ]
+        for j in near:
+            if alive[j]:
+                box = (float(values[X, j]), float(values[Y, j]), float(values[W, j]), float(values[H, j]))
+                candidates.append((int(a.oids[j]), box))
+        for (oid, box) in candidates:
+            hit = time_of_impact(x, y, w, h, vx, vy, box, hit_t)
+            if hit is None:
+                continue
+            (t, v_axis) = hit
+            if hit_oid < 0 or t < hit_t or oid < hit_oid:
+                hit_oid = oid
+                hit_t = t
+                hit_v = v_axis
+        t = hit_t
+        if hit_oid > 0:
+            t -= COLLISION_GAP / abs(hit_v)
+            if t < 0.:
+                t = 0.
+        new_x = x + dx * speed * t
+        new_y = y + dy * speed * t
+        values[X, i] = new_x
+        values[Y, i] = new_y
+        values[FIELD_INDEX['distance'], i] += abs(x - new_x) + abs(y - new_y)
+        a.objects[i].hit_oid = hit_oid
+        return
+
+    def has_object_arrays(self):
+        return True
+
+    def get_object_message_data(self, objs):
+        """Message data dictionaries for objs, with the common fields read from the arrays."""
+        rows = []
+        for obj in objs:
+            data = obj.get_data()
+            if obj.get_object_id() in self.arrays.slots:
+                row = self.arrays.get_message_data(obj)
+            else:
+                # walls aren't in the arrays
+                row = {}
+                for key in FIELDS[:-1]:
+                    row[key] = getattr(data, key)
+                row['oid'] = data.oid
+            if data.is_player():
+                fields = PLAYER_MESSAGE_FIELDS
+            elif data.is_missile():
+                fields = MISSILE_MESSAGE_FIELDS
+            else:
+                fields = ()
+            for key in fields:
+                row[key] = getattr(data, key)
+            rows.append(row)
+        return rows
+
+
+def make_engine(backend=ENGINE_BACKEND, seed=None):
+    """Returns a new game engine using the requested physics backend, and random numbers from seed."""
+    if backend == ENGINE_BACKEND_NUMPY:
+        if numpy is not None:
+            return ArrayGameEngine(seed)
+        logging.getLogger('make_engine').warning("numpy is not available, using the %s backend",
+                                                 ENGINE_BACKEND_OBJECT)
+    return GameEngine(seed)
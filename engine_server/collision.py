@@ -0,0 +1,53 @@
+#
+# Continuous collision detection for axis aligned boxes.
+#
+# Boxes are closed rectangles (x, y, w, h), so boxes that only
+# touch along an edge are colliding, the same as Object.collide().
+#
+
+INFINITY = float('inf')
+
+def axis_overlap_times(p, size, v, op, osize):
+    """
+    Returns (t_enter, t_exit), the range of times when the moving
+    interval [p + v*t, p + v*t + size] overlaps the fixed interval
+    [op, op + osize], or None if they never overlap.
+    """
+    if v == 0.:
+        if p <= op + osize and p + size >= op:
+            return (-INFINITY, INFINITY)
+        return None
+    t0 = (op - size - p) / v
+    t1 = (op + osize - p) / v
+    if t0 > t1:
+        return (t1, t0)
+    return (t0, t1)
+
+def time_of_impact(x, y, w, h, vx, vy, (ox, oy, ow, oh), t_max):
+    """
+    Sweeps box (x, y, w, h) with velocity (vx, vy) against the fixed
+    box (ox, oy, ow, oh).
+
+    Returns (t, v_axis), where t is the first time in [0, t_max] that
+    the boxes touch and v_axis is the velocity along the axis that
+    made contact.  Returns None if they don't touch in that time, or
+    if they are touching at t=0 but moving apart.
+    """
+    tx = axis_overlap_times(x, w, vx, ox, ow)
+    if tx is None:
+        return None
+    ty = axis_overlap_times(y, h, vy, oy, oh)
+    if ty is None:
+        return None
+    if tx[0] >= ty[0]:
+        t_enter = tx[0]
+        v_axis = vx
+    else:
+        t_enter = ty[0]
+        v_axis = vy
+    t_exit = min(tx[1], ty[1])
+    if t_enter > t_exit or t_exit <= 0. or t_enter > t_max:
+        return None
+    if t_enter < 0.:
+        t_enter = 0.
+    return (t_enter, v_axis)
@@ -18,6 +18,24 @@ FIELD_HEIGHT = 640
 # number of objects
 NUM_WALLS = 20
 NUM_NPCS = 10
+# size of the cells in the collision grid.
+# should be at least as large as the largest moving object
+GRID_CELL_SIZE = 2 * PLAYER_WIDTH
+# size of the cells in the occupancy map used to place new objects.
+# NPCs and random wall pieces are placed on whole cells, so it should
+# be their size
+PLACEMENT_CELL_SIZE = WALL_THICK
+# free cells tried before placing an object is given up, for now
+PLACEMENT_ATTEMPTS = 16
+# distance left between an object and the object it ran into
+COLLISION_GAP = 0.125
+
+# physics backend for the server's game engine
+# "object" moves each object with its own methods
+# "numpy" keeps object state in arrays and moves them in batches (requires numpy)
+ENGINE_BACKEND_OBJECT = "object"
+ENGINE_BACKEND_NUMPY  = "numpy"
+ENGINE_BACKEND = ENGINE_BACKEND_OBJECT
 
 # Health of various object types
 HEALTH_OBJECT  = INFINITE_HEALTH
@@ -1,60 +1,95 @@
-import random
+import random, math
 from player import Player
 from wall import Wall
 from npc import NPC
 from missile import Missile
+from object import KIND_PLAYER, KIND_WALL, KIND_NPC, KIND_MISSILE
+from spatial_grid import SpatialGrid
+from static_geometry import StaticGeometry
+from occupancy_map import OccupancyMap
 from config import *
 from common.event import *
+from common.command_message import *
+
+# client->server messages handled by GameEngine.process_command()
+PLAYER_COMMANDS = ( M_SET_PLAYER_SPEED, M_SET_PLAYER_DIRECTION,
+                    M_SET_MISSILE_RANGE, M_SET_MISSILE_DIRECTION,
+                    M_SET_MISSILE_POWER, M_FIRE_MISSILE )
 
 class GameEngine:
 
-    def __init__(self):
+    def __init__(self, seed=None):
+        # every random choice in the match comes from here, so the same
+        # seed and commands always play the same match
+        self.seed = seed
+        self.random = random.Random(seed)
+        # if not None, a profiler with a mark(phase) method, told as
+        # each phase of evolve() ends
+        self.profiler = None
+        # (kind, kind) of the colliding objects -> (handler, swap), where
+        # the handler takes the oids in the order of its kinds, so swap
+        # says the hitting object is the second argument
+        self.collision_handlers = {
+            (KIND_MISSILE, KIND_MISSILE): (self.handle_missile_on_missile_collision, False),
+            (KIND_MISSILE, KIND_WALL):    (self.handle_missile_on_wall_collision, False),
+            (KIND_WALL, KIND_MISSILE):    (self.handle_missile_on_wall_collision, True),
+            (KIND_MISSILE, KIND_NPC):     (self.handle_missile_on_other_collision, False),
+            (KIND_NPC, KIND_MISSILE):     (self.handle_missile_on_other_collision, True),
+            (KIND_MISSILE, KIND_PLAYER):  (self.handle_missile_on_other_collision, False),
+            (KIND_PLAYER, KIND_MISSILE):  (self.handle_missile_on_other_collision, True) }
         self.new_game()
         return
 
+    def find_free_position(self, w, h):
+        """
+        (x, y) of a random block of free cells in the occupancy map with
+        room for a w by h object, or None if the block picked isn't free.
+        """
+        occupancy = self.occupancy
+        free = occupancy.get_free_count()
+        if free == 0:
+            return None
+        (cx, cy) = occupancy.get_free_cell(self.random.randrange(free))
+        for dy in range(int(math.ceil(h / occupancy.cell_size))):
+            for dx in range(int(math.ceil(w / occupancy.cell_size))):
+                if not occupancy.is_free(cx + dx, cy + dy):
+                    return None
+        return occupancy.get_cell_position(cx, cy)
+
     def place_one_npc(self):
         """
-        Randomly place npc object until it doesn't collide with any existing objects
+        Place an npc object on a random free cell.  Returns None if
+        PLACEMENT_ATTEMPTS cells are tried without finding room.
         """
-        
-        done = False
-        while not done:
-            x = random.randrange(self.npc_width, self.width - self.npc_width, self.npc_width)
-            y = random.randrange(self.npc_height, self.height - self.npc_height, self.npc_height)
-            npc = NPC(x, y, self.npc_width, self.npc_height)
-            
-            found = False
-            for oid in self.all_objects:
-                if npc.collide(npc.get_x(), npc.get_y(), self.all_objects[oid]):
-                    found = True
-            if not found:
-                done = True
-        return npc
+        for i in range(PLACEMENT_ATTEMPTS):
+            pos = self.find_free_position(self.npc_width, self.npc_height)
+            if pos is None:
+                continue
+            npc = NPC(pos[0], pos[1], self.npc_width, self.npc_height)
+            # free cells only miss a thin object crossing the npc
+            if not self.placement_collides(npc):
+                return npc
+        return None
         
     def make_npcs(self):
         for i in range(self.num_npcs):
             npc = self.place_one_npc()
+            if npc is None:
+                # no room, evolve() tries again
+                break
             self.add_npc(npc)
         return
 
     def place_one_wall(self):
         """
-        Randomly place wall object until it doesn't collide with any existing objects
+        Place a wall object on a random free cell, or return None if
+        there is no room.  Only walls are placed so far, and they are
+        all at least a cell thick, so a free cell is always room.
         """
-        
-        done = False
-        while not done:
-            x = random.randrange(self.wall_thick, self.width - self.wall_thick, self.wall_thick)
-            y = random.randrange(self.wall_thick, self.height - self.wall_thick, self.wall_thick)
-            wall = Wall(x, y, self.wall_thick, self.wall_thick)
-            
-            found = False
-            for oid in self.all_objects:
-                if wall.collide(wall.get_x(), wall.get_y(), self.all_objects[oid]):
-                    found = True
-            if not found:
-                done = True
-        return wall
+        pos = self.find_free_position(self.wall_thick, self.wall_thick)
+        if pos is None:
+            return None
+        return Wall(pos[0], pos[1], self.wall_thick, self.wall_thick)
         
     def make_walls(self):
         # top
@@ -73,33 +108,39 @@ class GameEngine:
         # random walls
         for i in range(self.num_walls):
             wall = self.place_one_wall()
+            if wall is None:
+                break
             self.add_wall(wall)
+
+        # walls don't move from here on
+        self.static_geometry = StaticGeometry(self.width, self.height, self.wall_thick,
+                                              self.walls.values())
         return
 
     def place_one_player(self):
         """
-        Randomly place player object until it doesn't collide with any existing objects
+        Place a player object on a random block of free cells.  Returns
+        None if PLACEMENT_ATTEMPTS blocks are tried without finding room.
         """
-        
-        done = False
-        while not done:
-            player = Player(random.randrange(self.player_width, self.width-2*self.player_width),
-                            random.randrange(self.player_height, self.height-2*self.player_height),
-                            self.player_width,
-                            self.player_height)
-            found = False
-            for oid in self.all_objects:
-                if player.collide(player.get_x(), player.get_y(), self.all_objects[oid]):
-                    found = True
-            if not found:
-                done = True
-        return player
+        for i in range(PLACEMENT_ATTEMPTS):
+            pos = self.find_free_position(self.player_width, self.player_height)
+            if pos is None:
+                continue
+            (x, y) = pos
+            player = Player(x, y, self.player_width, self.player_height)
+            if not self.placement_collides(player):
+                return player
+        return None
         
     def place_players(self):
         # add each player as created, so the next player's creation can use collision detection
         player1 = self.place_one_player()
+        if player1 is None:
+            raise RuntimeError("no room for player 1")
         self.add_player(player1)
         player2 = self.place_one_player()
+        if player2 is None:
+            raise RuntimeError("no room for player 2")
         self.add_player(player2)
         self.player_oid = [ player1.get_object_id(),
                             player2.get_object_id() ]
@@ -128,6 +169,20 @@ class GameEngine:
         self.missiles       = {}
         self.walls          = {}
         self.all_objects    = {}
+        # kind -> the container of that kind's objects, oid -> object
+        self.objects_by_kind = { KIND_PLAYER:  self.players,
+                                 KIND_WALL:    self.walls,
+                                 KIND_NPC:     self.npcs,
+                                 KIND_MISSILE: self.missiles }
+        self.changed_oids   = set()   # objects to send, see get_changed_objects()
+        self.dying_oids     = set()   # objects dying, or dead and not thrown out yet
+        self.awake_oids     = set()   # objects evolved each tick
+        self.sleeping       = {}      # oid -> tick it wakes, see sleep_object()
+        self.wake_schedule  = {}      # tick -> [ oid ]
+        self.ticks          = 0       # evolve() calls, until game over
+        self.grid           = SpatialGrid(GRID_CELL_SIZE) # moving objects
+        self.static_geometry = None                       # walls, built by make_walls()
+        self.occupancy      = OccupancyMap(self.width, self.height, PLACEMENT_CELL_SIZE)
         self.events         = []
         self.make_walls()
         self.place_players()
@@ -139,28 +194,75 @@ class GameEngine:
         self.max_total_time = 30. * 60. # 30 minutes
         return
 
+    def add_object(self, obj):
+        """Registers obj by oid and by kind, and where it is."""
+        oid = obj.get_object_id()
+        self.objects_by_kind[obj.kind][oid] = obj
+        self.all_objects[oid] = obj
+        obj.engine = self
+        if obj.is_changed():
+            self.changed_oids.add(oid)
+        if not obj.is_alive():
+            self.dying_oids.add(oid)
+        if obj.kind != KIND_WALL:
+            # walls never do anything
+            self.awake_oids.add(oid)
+        box = obj.get_box()
+        if obj.kind != KIND_WALL:
+            # walls go in static_geometry, once they are all made
+            self.grid.insert(oid, box)
+        self.occupancy.insert(oid, box)
+        return
+
     def add_player(self, p):
-        oid = p.get_object_id()
-        self.players[oid] = p
-        self.all_objects[oid] = p
+        self.add_object(p)
         return
         
     def add_wall(self, w):
-        oid = w.get_object_id()
-        self.walls[oid] = w
-        self.all_objects[oid] = w
+        self.add_object(w)
         return
 
     def add_npc(self, n):
-        oid = n.get_object_id()
-        self.npcs[oid] = n
-        self.all_objects[oid] = n
+        self.add_object(n)
         return
         
     def add_missile(self, m):
-        oid = m.get_object_id()
-        self.missiles[oid] = m
-        self.all_objects[oid] = m
+        self.add_object(m)
+        return
+
+    def get_nearby_objects(self, (x, y, w, h)):
+        """
+        Returns dictionary of oid -> object for non-wall objects whose
+        grid cells are touched by the box.  This is a superset of the
+        objects that can collide with anything inside the box.
+        """
+        nearby = {}
+        for oid in self.grid.query(x, y, w, h):
+            nearby[oid] = self.all_objects[oid]
+        return nearby
+
+    def get_nearby_walls(self, box):
+        """Returns a list of (oid, box) for the walls near box."""
+        return self.static_geometry.query(box)
+
+    def placement_collides(self, obj):
+        """True if obj, where it is, collides with any object already in the game."""
+        x = obj.get_x()
+        y = obj.get_y()
+        box = obj.get_box()
+        for (oid, wall_box) in self.get_nearby_walls(box):
+            if obj.collide(x, y, self.all_objects[oid]):
+                return True
+        for oid in self.grid.query(*box):
+            if obj.collide(x, y, self.all_objects[oid]):
+                return True
+        return False
+
+    def object_moved(self, obj):
+        """Keep the collision grid and occupancy map up to date after obj changes position."""
+        box = obj.get_box()
+        self.grid.move(obj.get_object_id(), box)
+        self.occupancy.move(obj.get_object_id(), box)
         return
 
     def check_game_over(self):
@@ -229,25 +331,16 @@ class GameEngine:
         if not oid2 in self.all_objects:
             print "Oops, oid2 %d doesn't exist" % (oid2)
             return
-        if (str(self.all_objects[oid1].__class__) == "engine_server.missile.Missile" and
-            str(self.all_objects[oid2].__class__) == "engine_server.missile.Missile"):
-            # oid1 = missile and oid2 = missile
-            self.handle_missile_on_missile_collision(oid1, oid2)
-        elif str(self.all_objects[oid1].__class__) == "engine_server.missile.Missile":
-            # oid1 = missile 
-            if str(self.all_objects[oid2].__class__) != "engine_server.wall.Wall":
-                self.handle_missile_on_other_collision(oid1, oid2)
-            else:
-                self.handle_missile_on_wall_collision(oid1, oid2)
-        elif str(self.all_objects[oid2].__class__) == "engine_server.missile.Missile":
-            # oid2 = missile
-            if str(self.all_objects[oid1].__class__) != "engine_server.wall.Wall":
-                self.handle_missile_on_other_collision(oid2, oid1)
-            else:
-                self.handle_missile_on_wall_collision(oid2, oid1)
-        else:
+        entry = self.collision_handlers.get((self.all_objects[oid1].kind,
+                                             self.all_objects[oid2].kind))
+        if entry is None:
             # no missile involved
-            pass
+            return
+        (handler, swap) = entry
+        if swap:
+            handler(oid2, oid1)
+        else:
+            handler(oid1, oid2)
         return
         
     def evolve(self, dt):
@@ -255,11 +348,12 @@ class GameEngine:
         if self.game_over_flag:
             self.game_over_percent += dt/GAME_OVER_TIME
             # let dying objects die
-            for oid in self.all_objects:
+            for oid in list(self.dying_oids):
                 if self.all_objects[oid].is_dying():
                     self.all_objects[oid].add_dying_percent(dt)
             # nothing else
             return
+        self.ticks += 1
 
         # if player has quit, kill them
         for oid in self.players:
@@ -269,58 +363,123 @@ class GameEngine:
                 self.set_missile_range_none(oid)
                 self.set_player_speed_stop(oid)
                 
-        # evolve each object
-        for oid in self.all_objects:
-            self.all_objects[oid].evolve(self, self.all_objects, dt, self.minimum_size)
+        # evolve each object that isn't asleep
+        self.wake_scheduled_objects()
+        objs = self.get_awake_objects()
+        self.evolve_objects(objs, dt)
+        if self.profiler:
+            self.profiler.mark('evolve_objects')
             
         # check for collisions, and apply results
-        for oid in self.all_objects:
-            hit_oid = self.all_objects[oid].hit_oid
-            if hit_oid > 0:
-                self.handle_collision(oid, hit_oid)
+        for obj in objs:
+            if obj.hit_oid > 0:
+                self.handle_collision(obj.get_object_id(), obj.hit_oid)
+        if self.profiler:
+            self.profiler.mark('collisions')
                 
         # throw out the dead, but only if not changed this round
         # allows dead objects to be removed from client
         dead_oid = []
-        for oid in self.all_objects:
+        for oid in self.dying_oids:
             if self.all_objects[oid].is_dead() and not self.all_objects[oid].is_changed():
                 dead_oid.append(oid)
         for oid in dead_oid:
             self.delete_object(oid)
+        if self.profiler:
+            self.profiler.mark('dead_sweep')
             
-        # spawn
+        # spawn, as many as there is room for this tick
         while len(self.npcs) < self.num_npcs:
             npc = self.place_one_npc()
+            if npc is None:
+                break
             self.add_npc(npc)
+        if self.profiler:
+            self.profiler.mark('respawn')
 
         self.check_game_over()
         return
 
+    def evolve_objects(self, objs, dt):
+        """Let each of objs behave and move, in order."""
+        for obj in objs:
+            obj.evolve(self, self.all_objects, dt, self.minimum_size)
+        return
+
     def delete_object(self, oid):
-        name = str(self.all_objects[oid].__class__)
-        del self.all_objects[oid]
-        if name == "engine_server.player.Player":
-            del self.players[oid]
-        elif name == "engine_server.npc.NPC":
-            del self.npcs[oid]
-        elif name == "engine_server.missiles.Missile":
-            del self.missiles[oid]
-        elif name == "engine_server.wall.Wall":
-            del self.walls[oid]
+        obj = self.all_objects.pop(oid)
+        del self.objects_by_kind[obj.kind][oid]
+        self.grid.remove(oid) # walls never die, so static_geometry is left alone
+        self.occupancy.remove(oid)
+        self.changed_oids.discard(oid)
+        self.dying_oids.discard(oid)
+        self.awake_oids.discard(oid)
+        self.sleeping.pop(oid, None)
+        obj.engine = None
         return
-        
+
+    #
+    # activity tracking, so each tick only looks at the objects doing something
+    #
+    def object_changed(self, obj):
+        """Called by obj.mark_changed()."""
+        self.changed_oids.add(obj.get_object_id())
+        return
+
+    def object_dying(self, obj):
+        """Called by obj.set_dying().  Dying objects evolve until they are dead."""
+        oid = obj.get_object_id()
+        self.dying_oids.add(oid)
+        self.wake_object(oid)
+        return
+
+    def object_alive(self, obj):
+        """Called by obj.set_alive()."""
+        self.dying_oids.discard(obj.get_object_id())
+        return
+
+    def sleep_object(self, obj, ticks):
+        """
+        Stop evolving obj until ticks evolve() calls from now, when it
+        will evolve again.  For objects that would do nothing until then.
+        """
+        oid = obj.get_object_id()
+        wake_tick = self.ticks + ticks
+        self.awake_oids.discard(oid)
+        self.sleeping[oid] = wake_tick
+        self.wake_schedule.setdefault(wake_tick, []).append(oid)
+        return
+
+    def wake_object(self, oid):
+        if oid in self.sleeping:
+            # its entry in wake_schedule is left to be ignored
+            del self.sleeping[oid]
+            self.awake_oids.add(oid)
+        return
+
+    def wake_scheduled_objects(self):
+        for oid in self.wake_schedule.pop(self.ticks, []):
+            if self.sleeping.get(oid) == self.ticks:
+                self.wake_object(oid)
+        return
+
+    def get_awake_objects(self):
+        """The objects to evolve this tick, in oid order."""
+        return [ self.all_objects[oid] for oid in sorted(self.awake_oids) ]
+
     def get_changed_objects(self):
-        objs = []
-        for oid in self.all_objects:
-            if self.all_objects[oid].is_changed():
-                objs.append(self.all_objects[oid])
-        return objs
+        return [ self.all_objects[oid] for oid in self.changed_oids ]
 
     def clear_changed_objects(self):
-        for oid in self.all_objects:
+        for oid in self.changed_oids:
             self.all_objects[oid].clear_changed()
+        self.changed_oids.clear()
         return
 
+    def has_object_arrays(self):
+        """True if object state is kept in arrays (see array_engine.ArrayGameEngine)."""
+        return False
+
     def get_events(self):
         return self.events
 
@@ -456,6 +615,59 @@ class GameEngine:
             self.add_missile_misfire_event(oid)
         return
 
+    # command messages
+    def process_command(self, oid, msg):
+        """
+        Apply a client command message (one of PLAYER_COMMANDS) to player oid.
+        Returns False if the message isn't a player command, or has an unexpected value.
+        """
+        code = msg.get_command()
+        if code == M_SET_PLAYER_SPEED:
+            speed = msg.get_speed()
+            if speed == T_SPEED_STOP:
+                self.set_player_speed_stop(oid)
+            elif speed == T_SPEED_SLOW:
+                self.set_player_speed_slow(oid)
+            elif speed == T_SPEED_MEDIUM:
+                self.set_player_speed_medium(oid)
+            elif speed == T_SPEED_FAST:
+                self.set_player_speed_fast(oid)
+            else:
+                return False
+        elif code == M_SET_PLAYER_DIRECTION:
+            self.set_player_direction(oid, msg.get_degrees())
+        elif code == M_SET_MISSILE_RANGE:
+            mrange = msg.get_range()
+            if mrange == T_RANGE_NONE:
+                self.set_missile_range_none(oid)
+            elif mrange == T_RANGE_SHORT:
+                self.set_missile_range_short(oid)
+            elif mrange == T_RANGE_MEDIUM:
+                self.set_missile_range_medium(oid)
+            elif mrange == T_RANGE_LONG:
+                self.set_missile_range_long(oid)
+            else:
+                return False
+        elif code == M_SET_MISSILE_DIRECTION:
+            self.set_missile_direction(oid, msg.get_degrees())
+        elif code == M_SET_MISSILE_POWER:
+            power = msg.get_power()
+            if power == T_POWER_NONE:
+                self.set_missile_power_none(oid)
+            elif power == T_POWER_LOW:
+                self.set_missile_power_low(oid)
+            elif power == T_POWER_MEDIUM:
+                self.set_missile_power_medium(oid)
+            elif power == T_POWER_HIGH:
+                self.set_missile_power_high(oid)
+            else:
+                return False
+        elif code == M_FIRE_MISSILE:
+            self.fire_missile(oid)
+        else:
+            return False
+        return True
+
     # player disconnected
     def set_player_disconnected(self, oid):
         self.players[oid].set_quit()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+#
+# Runs the same seeded game on GameEngine and ArrayGameEngine,
+# and reports the first tick where the object states differ.
+#
+import sys, random
+sys.path.append("..")
+from engine_server.game_engine import GameEngine
+from engine_server.array_engine import ArrayGameEngine
+from engine_server.object import Object
+
+def object_states(g):
+    states = []
+    for oid in sorted(g.all_objects):
+        d = g.all_objects[oid].get_data()
+        states.append((oid, d.x, d.y, d.dx, d.dy, d.speed, d.distance,
+                       d.health, d.state, d.dying_percent))
+    return states
+
+def run(engine_class, seed, ticks):
+    Object.next_object_id = 0
+    g = engine_class(seed)
+    commands = random.Random(seed)
+    history = []
+    for i in range(ticks):
+        for oid in (g.get_player1_oid(), g.get_player2_oid()):
+            if oid not in g.players:
+                continue
+            r = commands.random()
+            if r < 0.05:
+                g.set_player_direction(oid, commands.random() * 360.)
+            elif r < 0.10:
+                g.set_player_speed_slow(oid)
+            elif r < 0.12:
+                g.set_missile_direction(oid, commands.random() * 360.)
+            elif r < 0.16:
+                g.fire_missile(oid)
+        g.evolve(1./30.)
+        history.append((object_states(g), [ str(e) for e in g.get_events() ]))
+        g.clear_changed_objects()
+        g.clear_events()
+        if g.game_over():
+            break
+    return history
+
+def main():
+    seed = 1
+    ticks = 3000
+    if len(sys.argv) > 1:
+        seed = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        ticks = int(sys.argv[2])
+    h1 = run(GameEngine, seed, ticks)
+    h2 = run(ArrayGameEngine, seed, ticks)
+    for i in range(min(len(h1), len(h2))):
+        if h1[i] != h2[i]:
+            print "seed %d: engines differ at tick %d" % (seed, i)
+            sys.exit(1)
+    if len(h1) != len(h2):
+        print "seed %d: engines ran %d and %d ticks" % (seed, len(h1), len(h2))
+        sys.exit(1)
+    print "seed %d: %d ticks match" % (seed, len(h1))
+    return
+
+main()
@@ -1,10 +1,12 @@
 import random, math
 from common.missile import MissileData
-from object import Object
+from object import Object, KIND_MISSILE
 from config import *
 
 class Missile(Object):
 
+    kind = KIND_MISSILE
+
     def __init__(self, x, y, w, h, mrange, power, player_oid):
         # don't call base class constructor, because
         # data is initialized here
@@ -31,11 +33,12 @@ class Missile(Object):
     def get_mana_cost(self):
         return MISSILE_MANA_COST_RATE * math.log(self.data.get_range()) * math.log(10.*self.data.get_power())
 
-    def evolve(self, engine, boxes, dt, min_size):
-        Object.evolve(self, engine, boxes, dt, min_size)
+    def end_evolve(self, engine, dt):
+        Object.end_evolve(self, engine, dt)
         if self.data.get_distance() > self.get_range() and self.is_alive():
             self.set_dying()
             self.data.set_hit_max_range(True)
+            self.mark_changed('hit_max_range')
             engine.add_missile_dying_event(self)
         return
         
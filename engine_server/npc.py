@@ -1,10 +1,12 @@
-import random
+import math
 from common.npc import NPCData
-from object import Object
+from object import Object, KIND_NPC
 from config import *
 
 class NPC(Object):
 
+    kind = KIND_NPC
+
     def __init__(self, x, y, w, h):
         # don't call base class constructor, because
         # data is initialized here
@@ -17,17 +19,43 @@ class NPC(Object):
         self.move_time      = 0.0
         self.min_move_time  = 3.0
         self.move_chance    = 0.01
+        self.move_due       = False # woken to start moving, see schedule_move()
         return
 
-    def evolve(self, engine, boxes, dt, min_size):
+    def begin_evolve(self, engine, dt):
         self.move_time += dt
-        if (self.move_time >= self.min_move_time and
-            random.random() < self.move_chance):
-            degrees = random.random() * 360.
-            speed   = 20.0
-            self.set_direction_degrees(degrees)
-            self.set_speed(speed)
-            self.move_time = 0.0
-        Object.evolve(self, engine, boxes, dt, min_size)
+        if self.move_due:
+            self.move_due = False
+            if self.is_alive():
+                self.start_moving(engine)
+        elif self.is_moving() or not self.is_alive():
+            if (self.move_time >= self.min_move_time and
+                engine.random.random() < self.move_chance):
+                self.start_moving(engine)
+        else:
+            self.schedule_move(engine, dt)
+        return
+
+    def start_moving(self, engine):
+        degrees = engine.random.random() * 360.
+        speed   = 20.0
+        self.set_direction_degrees(degrees)
+        self.set_speed(speed)
+        self.move_time = 0.0
+        return
+
+    def schedule_move(self, engine, dt):
+        """
+        An npc standing still does nothing until it starts moving.  So
+        rather than take a move_chance every tick, count the ticks
+        until min_move_time, draw the number of chances missed after
+        that, and sleep until the tick it starts moving.
+        """
+        ticks = max(0, int(math.ceil((self.min_move_time - self.move_time) / dt)))
+        ticks += int(math.log(1.0 - engine.random.random()) / math.log(1.0 - self.move_chance))
+        if ticks == 0:
+            self.start_moving(engine)
+        else:
+            self.move_due = True
+            engine.sleep_object(self, ticks)
         return
-        
@@ -1,10 +1,32 @@
 import math
 from common.object import ObjectData
+from common.object_message import PlayerUpdateMessage, WallUpdateMessage, NPCUpdateMessage, MissileUpdateMessage
+from collision import time_of_impact
 from config import *
 
+# the kind of each object class, the key of GameEngine's per kind
+# containers and collision handlers
+KIND_OBJECT  = "object"
+KIND_PLAYER  = "player"
+KIND_WALL    = "wall"
+KIND_NPC     = "npc"
+KIND_MISSILE = "missile"
+
+# object kind -> the message that updates it
+UPDATE_MESSAGE_CLASSES = { KIND_PLAYER:  PlayerUpdateMessage,
+                           KIND_WALL:    WallUpdateMessage,
+                           KIND_NPC:     NPCUpdateMessage,
+                           KIND_MISSILE: MissileUpdateMessage }
+
 class Object:
 
+    kind = KIND_OBJECT
     next_object_id = 0
+    # the GameEngine the object is in, told about changes to the object
+    engine = None
+    # names of the ObjectData fields changed since the last clear_changed(),
+    # None until then, because an object that hasn't been sent needs all of them
+    changed_fields = None
     
     def __init__(self, x, y, w, h):
         self.data = ObjectData(x, y, w, h)
@@ -32,6 +54,29 @@ class Object:
         
     def clear_changed(self):
         self.data.changed = False
+        self.changed_fields = set()
+        return
+
+    def mark_changed(self, *fields):
+        self.data.changed = True
+        if self.engine is not None:
+            self.engine.object_changed(self)
+        if self.changed_fields is not None:
+            self.changed_fields.update(fields)
+        return
+
+    def get_changed_fields(self):
+        """Names of the fields changed since last sent, or None if all of them must be sent."""
+        return self.changed_fields
+
+    def set_message(self, msg):
+        """Fill an update message with the oid and the changed fields only."""
+        if self.changed_fields is None:
+            self.data.set_message(msg)
+        else:
+            msg.set_data('oid', self.data.oid)
+            for key in self.changed_fields:
+                msg.set_data(key, getattr(self.data, key))
         return
 
     def apply_damage(self, damage):
@@ -43,76 +88,121 @@ class Object:
             else:
                 dh = self.data.health
                 self.data.health = 0.0
-            self.data.changed = True
+            self.mark_changed('health')
             if self.data.health < EPSILON:
                 self.data.health = 0.0
                 self.set_dying()
         return dh
 
-    def move_until_hit_or_time(self, boxes, tstep, dt, t1):
-        keep_x = self.data.x
-        keep_y = self.data.y
-        keep_t1 = 0
-        while t1 < dt + EPSILON:
-            if t1 > dt:
-                t1 = dt
-            new_x = self.data.x + self.data.dx * self.data.speed * t1
-            new_y = self.data.y + self.data.dy * self.data.speed * t1
-
-            self.hit_oid = -1
-            for oid in boxes:
-                if boxes[oid] != self and boxes[oid].is_alive():
-                    if self.collide(new_x, new_y, boxes[oid]):
-                        self.hit_oid = oid
-                        break
-            if self.hit_oid < 0:
-                keep_x = new_x
-                keep_y = new_y
-                keep_t1 = t1
-            else:
-                break
-            t1 += tstep
-        return keep_x, keep_y, keep_t1
+    def find_first_hit(self, walls, boxes, dt):
+        """
+        Returns (oid, t, v_axis) for the first wall, from the list of
+        (oid, box) in walls, or live object in boxes that this object
+        would run into during dt, or (-1, dt, 0.) if the path is clear.
+        Each candidate is solved exactly, once.
+        """
+        x = self.data.x
+        y = self.data.y
+        w = self.data.w
+        h = self.data.h
+        vx = self.data.dx * self.data.speed
+        vy = self.data.dy * self.data.speed
+        hit_oid = -1
+        hit_t = dt
+        hit_v = 0.
+        for (oid, box) in walls:
+            hit = time_of_impact(x, y, w, h, vx, vy, box, hit_t)
+            if hit is None:
+                continue
+            (t, v_axis) = hit
+            if hit_oid < 0 or t < hit_t or oid < hit_oid:
+                hit_oid = oid
+                hit_t = t
+                hit_v = v_axis
+        for oid in boxes:
+            other = boxes[oid]
+            if other is self or not other.is_alive():
+                continue
+            hit = time_of_impact(x, y, w, h, vx, vy, other.get_box(), hit_t)
+            if hit is None:
+                continue
+            (t, v_axis) = hit
+            # t <= hit_t here.  ties go to the lowest oid,
+            # so the result doesn't depend on dict order
+            if hit_oid < 0 or t < hit_t or oid < hit_oid:
+                hit_oid = oid
+                hit_t = t
+                hit_v = v_axis
+        return (hit_oid, hit_t, hit_v)
 
-    def move_binary_search(self, boxes, dt, min_size):
+    def move_swept(self, walls, boxes, dt):
+        """
+        Move the object along its velocity for dt, stopping just short
+        of the first object it would hit.  Sets self.hit_oid to that
+        object, or -1 if the whole move was made.
+        """
         original_x = self.data.x
         original_y = self.data.y
-        while min_size >= 0.25 and dt > EPSILON:
-            total_dx = self.data.dx * self.data.speed * dt
-            total_dy = self.data.dy * self.data.speed * dt
-            largest_delta = max(abs(total_dx), abs(total_dy))
-            pixel_step = min_size
-            if largest_delta > pixel_step:
-                tstep = pixel_step * dt / largest_delta
-            else:
-                tstep = dt
-            t1 = tstep
-            keep_x, keep_y, t1 = self.move_until_hit_or_time(boxes, tstep, dt, t1)
-                
-            if abs(keep_x - self.data.x) > EPSILON or abs(keep_y - self.data.y) > EPSILON:
-                self.data.changed = True
-            self.data.x = keep_x
-            self.data.y = keep_y
-            dt -= t1
-            min_size /= 2.0
+        (self.hit_oid, t, v_axis) = self.find_first_hit(walls, boxes, dt)
+        if self.hit_oid > 0:
+            # back off, so the boxes are not left touching
+            t -= COLLISION_GAP / abs(v_axis)
+            if t < 0.:
+                t = 0.
+        new_x = self.data.x + self.data.dx * self.data.speed * t
+        new_y = self.data.y + self.data.dy * self.data.speed * t
+        if abs(new_x - self.data.x) > EPSILON or abs(new_y - self.data.y) > EPSILON:
+            self.mark_changed('x', 'y')
+        self.data.x = new_x
+        self.data.y = new_y
         # use manhattan distance to avoid sqrt
         distance = abs(original_x - self.data.x) + abs(original_y - self.data.y)
         self.add_distance(distance)
         return
 
+    def get_swept_box(self, dt):
+        """Box covering every position the object passes through in dt."""
+        x0 = self.data.x
+        y0 = self.data.y
+        x1 = x0 + self.data.dx * self.data.speed * dt
+        y1 = y0 + self.data.dy * self.data.speed * dt
+        x = min(x0, x1)
+        y = min(y0, y1)
+        return (x, y, max(x0, x1) - x + self.data.w, max(y0, y1) - y + self.data.h)
+
+    def is_moving(self):
+        return (abs(self.data.speed) > EPSILON and
+                (abs(self.data.dx) > 0. or abs(self.data.dy) > 0.) and
+                self.data.is_alive())
+
     # boxes is a dictionary of oid -> objects
     # dt is the amount of time since last evolve
-    # min_size is smallest dimension of any object
-    # self.hit_oid > 0 if collision stopped motion at smallest scale
+    # min_size is smallest dimension of any object (not needed by the swept solver)
+    # self.hit_oid > 0 if collision stopped motion
     def evolve(self, engine, boxes, dt, min_size):
         """
-        Move objects by minimum size increments, until collision occurs.
-        Then, do binary search to find point of collision.
+        Move object until it has used all of dt, or collides.
+        Only objects near the path of motion are tested.
+        Derived classes add behaviour in begin_evolve() and end_evolve().
         """
-        # if object is moving
         self.hit_oid = -1
-        if abs(self.data.speed) > EPSILON and (abs(self.data.dx) > 0. or abs(self.data.dy) > 0.) and self.data.is_alive():
-            self.move_binary_search(boxes, dt, min_size)
+        self.begin_evolve(engine, dt)
+        # if object is moving
+        if self.is_moving():
+            swept_box = self.get_swept_box(dt)
+            walls = engine.get_nearby_walls(swept_box)
+            candidates = engine.get_nearby_objects(swept_box)
+            self.move_swept(walls, candidates, dt)
+            engine.object_moved(self)
+        self.end_evolve(engine, dt)
+        return
+
+    def begin_evolve(self, engine, dt):
+        """Behaviour before the object moves."""
+        return
+
+    def end_evolve(self, engine, dt):
+        """Behaviour after the object moves."""
         if self.data.is_dying():
             self.add_dying_percent(dt)
         return
@@ -180,21 +270,21 @@ class Object:
         new_dy = math.sin(r)
         new_dx = math.cos(r)
         if abs(new_dx - self.data.dx) > 0.001 or abs(new_dy - self.data.dy) > 0.001:
-            self.data.changed = True
+            self.mark_changed('dx', 'dy')
         self.data.dx = new_dx
         self.data.dy = new_dy
         return
         
     def set_direction(self, new_dx, new_dy):
         if abs(new_dx - self.data.dx) > 0.001 or abs(new_dy - self.data.dy) > 0.001:
-            self.data.changed = True
+            self.mark_changed('dx', 'dy')
         self.data.dx = new_dx
         self.data.dy = new_dy
         return
         
     def add_distance(self, new_distance):
         self.data.add_distance(new_distance)
-        self.data.changed = True
+        self.mark_changed('distance')
         return
 
     def get_speed(self):
@@ -202,7 +292,7 @@ class Object:
         
     def set_speed(self, new_speed):
         if abs(new_speed - self.data.speed) > EPSILON:
-            self.data.changed = True
+            self.mark_changed('speed')
         self.data.speed = new_speed
         return
 
@@ -214,23 +304,27 @@ class Object:
         return self.data.is_dead()
     def set_alive(self):
         self.data.set_alive()
-        self.data.changed = True
+        self.mark_changed('state')
+        if self.engine is not None:
+            self.engine.object_alive(self)
         return
     def set_dying(self):
         self.data.set_dying()
         self.data.set_dying_percent(0.)
-        self.data.changed = True
+        self.mark_changed('state', 'dying_percent')
+        if self.engine is not None:
+            self.engine.object_dying(self)
         return
     def set_dead(self):
         self.data.set_dead()
-        self.data.changed = True
+        self.mark_changed('state')
         return
     def add_dying_percent(self, dt):
         dp = self.data.get_dying_percent() + dt/DYING_TIME
         self.data.set_dying_percent(dp)
         if dp >= 1.0:
             self.set_dead()
-        self.data.changed = True
+        self.mark_changed('dying_percent')
         return
 
         
@@ -0,0 +1,124 @@
+import math
+
+class OccupancyMap:
+    """
+    Which square cells of the field are free, for placing new objects.
+    The cells are the size of an NPC or a wall piece, so cell (cx, cy)
+    is free exactly when an object of that size at (cx*s, cy*s) would
+    touch nothing.  Each cell counts the objects whose closed box
+    touches the closed cell, kept up to date as objects are added,
+    moved and removed.
+
+    The free cells are also counted in a binary indexed tree, so
+    get_free_cell(k) finds the k'th free cell, in row major order, in a
+    few steps, with no retries on a crowded field.  The order depends
+    only on which cells are free, not on the order of the updates, so
+    the same seed places the same objects in every engine backend.
+    """
+
+    def __init__(self, width, height, cell_size):
+        self.cell_size = float(cell_size)
+        self.cols = int(math.floor(width / self.cell_size))
+        self.rows = int(math.floor(height / self.cell_size))
+        n = self.cols * self.rows
+        self.counts = [ 0 ] * n        # objects touching each cell
+        self.tree = [ 0 ] * (n + 1)    # binary indexed tree of free cells
+        for i in range(1, n + 1):
+            self.tree[i] += 1
+            parent = i + (i & -i)
+            if parent <= n:
+                self.tree[parent] += self.tree[i]
+        self.free_count = n
+        self.top_bit = 1
+        while self.top_bit * 2 <= n:
+            self.top_bit *= 2
+        self.object_range = {} # oid -> (cx0, cy0, cx1, cy1)
+        return
+
+    def get_cell_range(self, x, y, w, h):
+        """Cells that the closed box touches, clipped to the field."""
+        s = self.cell_size
+        cx0 = max(0, int(math.ceil(x / s)) - 1)
+        cy0 = max(0, int(math.ceil(y / s)) - 1)
+        cx1 = min(self.cols - 1, int(math.floor((x + w) / s)))
+        cy1 = min(self.rows - 1, int(math.floor((y + h) / s)))
+        return (cx0, cy0, cx1, cy1)
+
+    def _update_tree(self, cell, delta):
+        i = cell + 1
+        n = len(self.counts)
+        while i <= n:
+            self.tree[i] += delta
+            i += i & -i
+        self.free_count += delta
+        return
+
+    def _add_range(self, cell_range):
+        (cx0, cy0, cx1, cy1) = cell_range
+        for cy in range(cy0, cy1 + 1):
+            row = cy * self.cols
+            for cell in range(row + cx0, row + cx1 + 1):
+                if self.counts[cell] == 0:
+                    self._update_tree(cell, -1)
+                self.counts[cell] += 1
+        return
+
+    def _remove_range(self, cell_range):
+        (cx0, cy0, cx1, cy1) = cell_range
+        for cy in range(cy0, cy1 + 1):
+            row = cy * self.cols
+            for cell in range(row + cx0, row + cx1 + 1):
+                self.counts[cell] -= 1
+                if self.counts[cell] == 0:
+                    self._update_tree(cell, 1)
+        return
+
+    def insert(self, oid, (x, y, w, h)):
+        if oid in self.object_range:
+            self.remove(oid)
+        cell_range = self.get_cell_range(x, y, w, h)
+        self.object_range[oid] = cell_range
+        self._add_range(cell_range)
+        return
+
+    def remove(self, oid):
+        if oid in self.object_range:
+            self._remove_range(self.object_range.pop(oid))
+        return
+
+    def move(self, oid, (x, y, w, h)):
+        """Re-count oid, but only if its box now touches different cells."""
+        cell_range = self.get_cell_range(x, y, w, h)
+        old_range = self.object_range.get(oid)
+        if old_range == cell_range:
+            return
+        # add first, so cells in both ranges don't flip to free and back
+        self._add_range(cell_range)
+        if old_range is not None:
+            self._remove_range(old_range)
+        self.object_range[oid] = cell_range
+        return
+
+    def is_free(self, cx, cy):
+        if cx < 0 or cy < 0 or cx >= self.cols or cy >= self.rows:
+            return False
+        return self.counts[cy * self.cols + cx] == 0
+
+    def get_free_count(self):
+        return self.free_count
+
+    def get_free_cell(self, k):
+        """The (cx, cy) of the k'th free cell, 0 <= k < get_free_count()."""
+        cell = 0
+        bit = self.top_bit
+        n = len(self.counts)
+        while bit:
+            i = cell + bit
+            if i <= n and self.tree[i] <= k:
+                cell = i
+                k -= self.tree[i]
+            bit /= 2
+        return (cell % self.cols, cell / self.cols)
+
+    def get_cell_position(self, cx, cy):
+        return (cx * self.cell_size, cy * self.cell_size)
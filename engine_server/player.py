@@ -1,8 +1,10 @@
 import math
 from common.player import PlayerData
-from object import Object
+from object import Object, KIND_PLAYER
 from config import *
 class Player(Object):
+
+    kind = KIND_PLAYER
     
     def __init__(self, x, y, w, h):
         # don't call base class constructor, because
@@ -38,7 +40,7 @@ class Player(Object):
         if self.data.experience < min_xp:
             return
         if abs(mrange - self.data.missile_range) > EPSILON:
-            self.data.changed = True
+            self.mark_changed('missile_range')
         self.data.missile_range = mrange
         return
         
@@ -47,7 +49,7 @@ class Player(Object):
         new_dy = math.sin(r)
         new_dx = math.cos(r)
         if abs(new_dx - self.data.missile_dx) > EPSILON or abs(new_dy - self.data.missile_dy) > EPSILON:
-            self.data.changed = True
+            self.mark_changed('missile_dx', 'missile_dy')
         self.data.missile_dx = new_dx
         self.data.missile_dy = new_dy
         return
@@ -56,7 +58,7 @@ class Player(Object):
         if self.data.experience < min_xp:
             return
         if abs(power - self.data.missile_power) > EPSILON:
-            self.data.changed = True
+            self.mark_changed('missile_power')
         self.data.missile_power = power
         return
         
@@ -85,7 +87,7 @@ class Player(Object):
         value = MISSILE_MANA_MAX[j][0]
         if abs(value - self.data.missile_mana_max) > EPSILON:
             self.data.set_missile_mana_max(value)
-            self.data.changed = True
+            self.mark_changed('missile_mana_max')
         return
     def set_missile_mana_recharge_rate(self):
         i = 0
@@ -96,12 +98,12 @@ class Player(Object):
         value = MISSILE_MANA_RECHARGE_RATE[j][0]
         if abs(value - self.data.missile_mana_recharge_rate) > EPSILON:
             self.data.set_missile_mana_recharge_rate(value)
-            self.data.changed = True
+            self.mark_changed('missile_mana_recharge_rate')
         return
     def recharge_missile_mana(self, mana_amount):
         if self.data.missile_mana < self.data.missile_mana_max:
             self.data.missile_mana += mana_amount
-            self.data.changed = True
+            self.mark_changed('missile_mana')
             if self.data.missile_mana > self.data.missile_mana_max:
                 self.data.missile_mana = self.data.missile_mana_max
         return
@@ -109,7 +111,7 @@ class Player(Object):
         if self.data.missile_mana < mana_amount - EPSILON:
             return False
         self.data.missile_mana -= mana_amount
-        self.data.changed = True
+        self.mark_changed('missile_mana')
         return True
 
     def get_move_mana(self):
@@ -129,7 +131,7 @@ class Player(Object):
         value = MOVE_MANA_MAX[j][0]
         if abs(value - self.data.move_mana_max) > EPSILON:
             self.data.set_move_mana_max(value)
-            self.data.changed = True
+            self.mark_changed('move_mana_max')
         return
     def set_move_mana_recharge_rate(self):
         i = 0
@@ -140,12 +142,12 @@ class Player(Object):
         value = MOVE_MANA_RECHARGE_RATE[j][0]
         if abs(value - self.data.move_mana_recharge_rate) > EPSILON:
             self.data.set_move_mana_recharge_rate(value)
-            self.data.changed = True
+            self.mark_changed('move_mana_recharge_rate')
         return
     def recharge_move_mana(self, mana_amount):
         if self.data.move_mana < self.data.move_mana_max:
             self.data.move_mana += mana_amount
-            self.data.changed = True
+            self.mark_changed('move_mana')
             if self.data.move_mana > self.data.move_mana_max:
                 self.data.move_mana = self.data.move_mana_max
         return
@@ -153,24 +155,27 @@ class Player(Object):
         if self.data.move_mana < mana_amount - EPSILON:
             return False
         self.data.move_mana -= mana_amount
-        self.data.changed = True
+        self.mark_changed('move_mana')
         return True
         
     def add_experience(self, new_experience):
         self.data.add_experience(new_experience)
         self.set_missile_mana_max()
         self.set_move_mana_max()
-        self.data.changed = True
+        self.mark_changed('experience')
         return
 
-    def evolve(self, engine, boxes, dt, min_size):
+    def begin_evolve(self, engine, dt):
         if self.get_speed() >= 1.0:
             move_mana_cost = MOVE_MANA_COST_RATE * dt * math.log(self.get_speed()/10.)
             if not self.consume_move_mana(move_mana_cost):
                 self.set_speed(PLAYER_SPEED_STOP)
         else:
             self.set_speed(PLAYER_SPEED_STOP)
-        Object.evolve(self, engine, boxes, dt, min_size)
+        return
+
+    def end_evolve(self, engine, dt):
+        Object.end_evolve(self, engine, dt)
         self.recharge_missile_mana(self.get_missile_mana_recharge_rate()*dt)
         self.recharge_move_mana(self.get_move_mana_recharge_rate()*dt)
         return
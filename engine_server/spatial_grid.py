@@ -0,0 +1,85 @@
+import math
+
+class SpatialGrid:
+    """
+    Uniform grid of square cells laid over the field.  Each cell
+    remembers the oids of the objects whose box touches it, so a
+    collision query only has to look at objects in the cells that
+    the query box touches, not at every object in the game.
+
+    Boxes are treated as closed rectangles, to match Object.collide(),
+    so an object touching a cell edge is stored in both cells.
+    """
+
+    def __init__(self, cell_size):
+        self.cell_size = float(cell_size)
+        self.cells = {}        # (cx, cy) -> set of oids
+        self.object_range = {} # oid -> (cx0, cy0, cx1, cy1)
+        return
+
+    def get_cell_range(self, x, y, w, h):
+        s = self.cell_size
+        return (int(math.floor(x / s)), int(math.floor(y / s)),
+                int(math.floor((x + w) / s)), int(math.floor((y + h) / s)))
+
+    def _add_range(self, oid, cell_range):
+        (cx0, cy0, cx1, cy1) = cell_range
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                key = (cx, cy)
+                if key in self.cells:
+                    self.cells[key].add(oid)
+                else:
+                    self.cells[key] = set([oid])
+        return
+
+    def _remove_range(self, oid, cell_range):
+        (cx0, cy0, cx1, cy1) = cell_range
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                key = (cx, cy)
+                cell = self.cells.get(key)
+                if cell is not None:
+                    cell.discard(oid)
+                    if not cell:
+                        del self.cells[key]
+        return
+
+    def insert(self, oid, (x, y, w, h)):
+        if oid in self.object_range:
+            self.remove(oid)
+        cell_range = self.get_cell_range(x, y, w, h)
+        self.object_range[oid] = cell_range
+        self._add_range(oid, cell_range)
+        return
+
+    def remove(self, oid):
+        if oid in self.object_range:
+            self._remove_range(oid, self.object_range.pop(oid))
+        return
+
+    def move(self, oid, (x, y, w, h)):
+        """Re-bucket oid, but only if its box now touches different cells."""
+        cell_range = self.get_cell_range(x, y, w, h)
+        old_range = self.object_range.get(oid)
+        if old_range == cell_range:
+            return
+        if old_range is not None:
+            self._remove_range(oid, old_range)
+        self.object_range[oid] = cell_range
+        self._add_range(oid, cell_range)
+        return
+
+    def query(self, x, y, w, h):
+        """Returns the set of oids in the cells touched by the box."""
+        (cx0, cy0, cx1, cy1) = self.get_cell_range(x, y, w, h)
+        found = set()
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                cell = self.cells.get((cx, cy))
+                if cell:
+                    found |= cell
+        return found
+
+    def __len__(self):
+        return len(self.object_range)
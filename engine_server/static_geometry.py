@@ -0,0 +1,50 @@
+import math
+
+class StaticGeometry:
+    """
+    Immutable lookup structure for the walls, built once when the
+    match starts.  The field is rasterised into square cells, and each
+    cell stores a tuple of (oid, box) for the walls that touch it.
+    Finding the walls near a box is a direct index into the cells it
+    covers, and the boxes are precomputed, so no get_box() calls or
+    tuple building happen while objects move.
+
+    Walls never move or die after GameEngine.make_walls(), so the
+    structure is never updated.
+    """
+
+    def __init__(self, width, height, cell_size, walls):
+        self.cell_size = float(cell_size)
+        self.cols = int(math.ceil(width / self.cell_size)) + 1
+        self.rows = int(math.ceil(height / self.cell_size)) + 1
+        cells = [ [] for i in range(self.cols * self.rows) ]
+        for wall in walls:
+            entry = (wall.get_object_id(), wall.get_box())
+            (cx0, cy0, cx1, cy1) = self.get_cell_range(*entry[1])
+            for cy in range(cy0, cy1 + 1):
+                for cx in range(cx0, cx1 + 1):
+                    cells[cy * self.cols + cx].append(entry)
+        self.cells = tuple([ tuple(cell) for cell in cells ])
+        return
+
+    def get_cell_range(self, x, y, w, h):
+        """Cells touched by the closed box, clipped to the field."""
+        s = self.cell_size
+        cx0 = max(0, int(math.floor(x / s)))
+        cy0 = max(0, int(math.floor(y / s)))
+        cx1 = min(self.cols - 1, int(math.floor((x + w) / s)))
+        cy1 = min(self.rows - 1, int(math.floor((y + h) / s)))
+        return (cx0, cy0, cx1, cy1)
+
+    def query(self, (x, y, w, h)):
+        """Returns a list of (oid, box) for walls in the cells touched by the box."""
+        (cx0, cy0, cx1, cy1) = self.get_cell_range(x, y, w, h)
+        if cx0 == cx1 and cy0 == cy1:
+            return self.cells[cy0 * self.cols + cx0]
+        found = {}
+        for cy in range(cy0, cy1 + 1):
+            row = cy * self.cols
+            for cx in range(cx0, cx1 + 1):
+                for entry in self.cells[row + cx]:
+                    found[entry[0]] = entry
+        return found.values()
@@ -1,9 +1,11 @@
 from common.wall import WallData
-from object import Object
+from object import Object, KIND_WALL
 from config import *
 
 class Wall(Object):
 
+    kind = KIND_WALL
+
     def __init__(self, x, y, w, h):
         # don't call base class constructor, because
         # data is initialized here
@@ -0,0 +1,214 @@
+import socket, errno, logging
+from common.game_comm import *
+from common.batch_message import M_TICK_BATCH
+from common.histogram import Histogram
+from engine_client.game_engine import ClientGameEngine, MODE_DUAL, MODE_SINGLE, MODE_AI, MODE_VIEW
+
+MODES = { "dual":   MODE_DUAL,
+          "single": MODE_SINGLE,
+          "ai":     MODE_AI,
+          "view":   MODE_VIEW }
+
+# the states of a LoadClient
+LC_IDLE = 0        # not connected, waiting to connect
+LC_CONNECTING = 1  # connect() in progress
+LC_LOBBY = 2       # connected, logging in
+LC_WAITING = 3     # asked for a game, or to view one
+LC_PLAYING = 4     # in a game, or watching one
+LC_DONE = 5        # game over or closed
+
+# upper bounds, in milliseconds, of the buckets of the clients' Histograms
+SAMPLE_BUCKETS = [ 1., 2., 5., 10., 20., 30., 40., 50., 75., 100., 200., 500.,
+                   1000., 2000., 5000., 10000., 30000., 60000. ]
+
+class CountingGameComm(GameComm):
+    """A GameComm that counts the bytes it receives."""
+
+    def __init__(self, sock):
+        GameComm.__init__(self, sock)
+        self.bytes_received = 0
+        return
+
+    def _fill(self):
+        unparsed = len(self.buffer) - self.pos
+        GameComm._fill(self)
+        self.bytes_received += len(self.buffer) - unparsed
+        return
+
+class LoadClient:
+    """
+    One synthetic client of the lobby, driven by the caller's poll loop.
+    It logs in and asks for a game, or to view one, through its own
+    ClientGameEngine, the same as a real client, then sends random
+    commands every command_interval seconds until the game is over.
+    Its socket never blocks: messages wait in the GameComm until
+    flush() gets them out.
+
+    It measures the time from asking for a game to GAME_STARTING, the
+    time between TICK_BATCH messages, and the bytes it receives.
+    """
+
+    def __init__(self, name, mode, host, port, rng, command_interval=0.5):
+        self.logger = logging.getLogger('LoadClient')
+        self.name = name
+        self.mode = mode
+        self.host = host
+        self.port = port
+        self.rng = rng
+        self.command_interval = command_interval
+        self.state = LC_IDLE
+        self.sock = None
+        self.gc = None
+        self.engine = None
+        self.request_time = None  # when it asked for a game
+        self.last_tick = None     # when the last TICK_BATCH arrived
+        self.next_command = 0.
+        self.matchmaking = Histogram(SAMPLE_BUCKETS)
+        self.tick_intervals = Histogram(SAMPLE_BUCKETS)
+        self.bytes_received = 0
+        self.messages = 0
+        self.connects = 0
+        self.connect_failures = 0
+        self.games = 0
+        return
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def connect(self):
+        """Starts connecting, returns False if it failed at once."""
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setblocking(0)
+        e = self.sock.connect_ex((self.host, self.port))
+        if e not in (0, errno.EINPROGRESS):
+            self.logger.debug("%s connect: %s", self.name, errno.errorcode.get(e, e))
+            self.fail()
+            return False
+        self.state = LC_CONNECTING
+        return True
+
+    def connected(self):
+        """The socket is writable after connect().  Returns False if it didn't connect."""
+        e = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if e != 0:
+            self.logger.debug("%s connect: %s", self.name, errno.errorcode.get(e, e))
+            self.fail()
+            return False
+        self.connects += 1
+        self.state = LC_LOBBY
+        self.gc = CountingGameComm(self.sock)
+        self.engine = ClientGameEngine(self.name, self.mode)
+        self.last_tick = None
+        return True
+
+    def fail(self):
+        self.connect_failures += 1
+        self.close()
+        return
+
+    def close(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+        self.gc = None
+        self.engine = None
+        self.state = LC_DONE
+        return
+
+    def wants_write(self):
+        return self.state == LC_CONNECTING or bool(self.gc and self.gc.has_unsent())
+
+    def read(self, now):
+        """Handles every message that has arrived."""
+        try:
+            msgs = self.gc.read_mesgs()
+        except socket.error as e:
+            self.logger.debug("%s closed on recv: %s", self.name, e)
+            msgs = [ GameMessageClosed() ]
+        self.bytes_received += self.gc.bytes_received
+        self.gc.bytes_received = 0
+        for msg in msgs:
+            code = msg.get_command()
+            if code == M_CLOSED or code == M_BAD_COMMAND:
+                self.logger.debug("%s closed by the server", self.name)
+                self.close()
+                return
+            if code == M_EAGAIN:
+                continue
+            self.messages += 1
+            if code == M_TICK_BATCH:
+                if self.last_tick is not None:
+                    self.tick_intervals.add((now - self.last_tick) * 1000.)
+                self.last_tick = now
+            self.engine.process_server_message(msg)
+        self.update_state(now)
+        return
+
+    def update_state(self, now):
+        data = self.engine.get_data()
+        if self.state == LC_LOBBY and data.get_logged_in():
+            # the engine queued the request for a game when the login was accepted
+            self.state = LC_WAITING
+            self.request_time = now
+        if self.state == LC_WAITING and data.get_game_started():
+            self.matchmaking.add((now - self.request_time) * 1000.)
+            self.state = LC_PLAYING
+            self.next_command = now + self.rng.uniform(0., self.command_interval)
+        if self.state == LC_PLAYING and data.get_game_over():
+            self.games += 1
+            self.close()
+        return
+
+    def act(self, now):
+        """Sends random commands while playing, every command_interval seconds."""
+        if self.state != LC_PLAYING or self.mode == MODE_VIEW or now < self.next_command:
+            return
+        self.next_command = now + self.command_interval
+        engine = self.engine
+        if engine.get_player_oid() <= 0:
+            return
+        r = self.rng.random()
+        if r < 0.4:
+            engine.set_player_direction(self.rng.uniform(0., 360.))
+            self.rng.choice((engine.set_player_speed_stop, engine.set_player_speed_slow,
+                             engine.set_player_speed_medium))()
+        else:
+            engine.set_missile_direction(self.rng.uniform(0., 360.))
+            self.rng.choice((engine.set_missile_range_short, engine.set_missile_range_medium))()
+            self.rng.choice((engine.set_missile_power_low, engine.set_missile_power_medium))()
+            engine.fire_missile()
+        return
+
+    def flush(self):
+        """Queues the engine's messages and sends what the socket takes.  Returns False if it closed."""
+        if not self.gc:
+            return False
+        try:
+            queue = self.engine.get_message_queue()
+            if queue:
+                self.gc.queue_mesgs(queue)
+                self.engine.clear_message_queue()
+            self.gc.flush()
+        except socket.error as e:
+            self.logger.debug("%s closed on send: %s", self.name, e)
+            self.close()
+            return False
+        return True
+
+    def take_stats(self):
+        """What it measured since the last take_stats()."""
+        stats = { 'matchmaking': self.matchmaking,
+                  'tick_intervals': self.tick_intervals,
+                  'bytes_received': self.bytes_received,
+                  'messages': self.messages,
+                  'connects': self.connects,
+                  'connect_failures': self.connect_failures,
+                  'games': self.games }
+        self.matchmaking = Histogram(SAMPLE_BUCKETS)
+        self.tick_intervals = Histogram(SAMPLE_BUCKETS)
+        self.bytes_received = 0
+        self.messages = 0
+        self.connects = 0
+        self.connect_failures = 0
+        self.games = 0
+        return stats
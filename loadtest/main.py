@@ -0,0 +1,361 @@
+#!/usr/bin/env python
+import logging, sys, getopt, time, random, select, json
+sys.path.append('..')
+from load_client import *
+
+# how often, in seconds, playing clients are given the chance to send commands
+ACT_INTERVAL = 0.02
+# seconds a client waits after its game, or its connection, ends before connecting again
+REJOIN_DELAY = 0.5
+
+class LoadWindow:
+    """What every client measured over some time."""
+
+    def __init__(self):
+        self.start = time.time()
+        self.matchmaking = Histogram(SAMPLE_BUCKETS)
+        self.tick_intervals = Histogram(SAMPLE_BUCKETS)
+        self.bytes_received = 0
+        self.messages = 0
+        self.connects = 0
+        self.connect_failures = 0
+        self.games = 0
+        self.idle = 0.  # seconds the loop spent waiting in poll()
+        return
+
+    def add(self, stats):
+        self.matchmaking.merge(stats['matchmaking'])
+        self.tick_intervals.merge(stats['tick_intervals'])
+        self.bytes_received += stats['bytes_received']
+        self.messages += stats['messages']
+        self.connects += stats['connects']
+        self.connect_failures += stats['connect_failures']
+        self.games += stats['games']
+        return
+
+    def merge(self, other):
+        self.matchmaking.merge(other.matchmaking)
+        self.tick_intervals.merge(other.tick_intervals)
+        self.bytes_received += other.bytes_received
+        self.messages += other.messages
+        self.connects += other.connects
+        self.connect_failures += other.connect_failures
+        self.games += other.games
+        self.idle += other.idle
+        return
+
+    def get_stats(self):
+        seconds = max(time.time() - self.start, 1e-9)
+        return { 'seconds': seconds,
+                 'matchmaking': self.matchmaking.get_stats(),
+                 'tick_intervals': self.tick_intervals.get_stats(),
+                 'bytes_received': self.bytes_received,
+                 'bytes_per_sec': self.bytes_received / seconds,
+                 'messages': self.messages,
+                 'connects': self.connects,
+                 'connect_failures': self.connect_failures,
+                 'games': self.games,
+                 'busy': max(0., 1. - self.idle / seconds) }
+
+class LoadTest:
+    """
+    count LoadClients against one server, all in this process, on one
+    poll() loop.  Clients connect ramp_rate a second, until all of them
+    have, and each one that finishes a game, or loses its connection,
+    connects again after REJOIN_DELAY, if rejoin.  Every report_interval
+    seconds it logs what the clients measured, and how much of the time
+    the loop itself was busy.  A loop near 100% busy is measuring
+    itself, not the server, and needs fewer clients or more processes.
+    """
+
+    def __init__(self, count, modes, host="127.0.0.1", port=20149, seed=1,
+                 ramp_rate=50., command_interval=0.5, rejoin=True, report_interval=5.):
+        self.logger = logging.getLogger('LoadTest')
+        rng = random.Random(seed)
+        names = []
+        weights = []
+        for (name, weight) in modes:
+            names.append(name)
+            weights.append(weight)
+        self.clients = []
+        for i in range(count):
+            r = rng.uniform(0., sum(weights))
+            j = 0
+            while j < len(weights) - 1 and r >= weights[j]:
+                r -= weights[j]
+                j += 1
+            self.clients.append(LoadClient("load%05d" % (i,), MODES[names[j]], host, port,
+                                           random.Random(seed * 100003 + i), command_interval))
+        self.ramp_rate = ramp_rate
+        self.rejoin = rejoin
+        self.report_interval = report_interval
+        self.poll = select.poll()
+        self.by_fd = {}   # fd -> LoadClient, connected or connecting
+        self.rejoins = [] # (time, LoadClient), in time order
+        self.started = 0
+        self.window = LoadWindow()
+        self.total = LoadWindow()
+        return
+
+    def start_client(self, client):
+        if client.connect():
+            self.by_fd[client.fileno()] = client
+            self.poll.register(client.fileno(), select.POLLOUT)
+        else:
+            self.client_done(client, None)
+        return
+
+    def client_done(self, client, fd):
+        if fd is not None:
+            self.poll.unregister(fd)
+            del self.by_fd[fd]
+        if self.rejoin:
+            self.rejoins.append((time.time() + REJOIN_DELAY, client))
+        return
+
+    def handle(self, fd, event, now):
+        client = self.by_fd[fd]
+        if client.state == LC_CONNECTING:
+            if not client.connected():
+                self.client_done(client, fd)
+                return
+        elif event & (select.POLLIN | select.POLLHUP | select.POLLERR):
+            client.read(now)
+        if client.state == LC_DONE or not client.flush():
+            self.client_done(client, fd)
+            return
+        self.update_mask(client, fd)
+        return
+
+    def update_mask(self, client, fd):
+        mask = select.POLLIN
+        if client.wants_write():
+            mask |= select.POLLOUT
+        self.poll.modify(fd, mask)
+        return
+
+    def act(self, now):
+        for fd in self.by_fd.keys():
+            client = self.by_fd[fd]
+            if client.state != LC_PLAYING:
+                continue
+            client.act(now)
+            if not client.flush():
+                self.client_done(client, fd)
+            elif client.wants_write():
+                self.update_mask(client, fd)
+        return
+
+    def collect(self):
+        for client in self.clients:
+            self.window.add(client.take_stats())
+        return
+
+    def get_state_counts(self):
+        counts = [ 0 ] * (LC_DONE + 1)
+        for client in self.clients[:self.started]:
+            counts[client.state] += 1
+        return counts
+
+    def report(self, t):
+        self.collect()
+        stats = self.window.get_stats()
+        counts = self.get_state_counts()
+        mm = stats['matchmaking']
+        ti = stats['tick_intervals']
+        self.logger.info("%6.1fs clients: %d connecting %d lobby %d waiting %d playing  "
+                         "games: %d  matchmaking ms: p50 %.0f p99 %.0f max %.0f  "
+                         "tick interval ms: mean %.1f sd %.1f p99 %.0f max %.0f  "
+                         "recv: %.1f KB/s  connect failures: %d  loop busy: %.0f%%",
+                         t, counts[LC_CONNECTING], counts[LC_LOBBY], counts[LC_WAITING], counts[LC_PLAYING],
+                         stats['games'], mm['p50'], mm['p99'], mm['max'],
+                         ti['mean'], ti['stddev'], ti['p99'], ti['max'],
+                         stats['bytes_per_sec'] / 1024., stats['connect_failures'], 100. * stats['busy'])
+        self.total.merge(self.window)
+        self.window = LoadWindow()
+        return
+
+    def run(self, duration):
+        """Runs for duration seconds, returns the stats over all of it."""
+        t0 = time.time()
+        self.total = LoadWindow()
+        self.window = LoadWindow()
+        next_act = t0
+        next_report = t0 + self.report_interval
+        now = t0
+        while now - t0 < duration:
+            if self.started < len(self.clients):
+                target = len(self.clients)
+                if self.ramp_rate > 0.:
+                    target = min(target, int((now - t0) * self.ramp_rate) + 1)
+                while self.started < target:
+                    self.start_client(self.clients[self.started])
+                    self.started += 1
+            while self.rejoins and self.rejoins[0][0] <= now:
+                client = self.rejoins.pop(0)[1]
+                self.start_client(client)
+            if now >= next_act:
+                self.act(now)
+                next_act = now + ACT_INTERVAL
+            if now >= next_report:
+                self.report(now - t0)
+                next_report += self.report_interval
+            t = time.time()
+            events = self.poll.poll(1000. * max(0., min(next_act, next_report) - t))
+            now = time.time()
+            self.window.idle += now - t
+            for (fd, event) in events:
+                if fd in self.by_fd:
+                    self.handle(fd, event, now)
+            now = time.time()
+        self.report(now - t0)
+        for fd in self.by_fd.keys():
+            self.by_fd[fd].close()
+            self.poll.unregister(fd)
+        self.by_fd = {}
+        return self.total.get_stats()
+
+def parse_modes(text):
+    """"dual=3,view=1" -> [ ("dual", 3.), ("view", 1.) ]"""
+    modes = []
+    for part in text.split(","):
+        if "=" in part:
+            (name, weight) = part.split("=", 1)
+            weight = float(weight)
+        else:
+            (name, weight) = (part, 1.)
+        if name not in MODES or weight < 0.:
+            raise ValueError("bad mode: %s" % (part,))
+        modes.append((name, weight))
+    if not [ m for m in modes if m[1] > 0. ]:
+        raise ValueError("no modes: %s" % (text,))
+    return modes
+
+def raise_file_limit(count):
+    """Lets this process have a socket for every client, if the hard limit allows it."""
+    try:
+        import resource
+    except ImportError:
+        return
+    (soft, hard) = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = count + 64
+    if soft != resource.RLIM_INFINITY and soft < wanted:
+        if hard != resource.RLIM_INFINITY:
+            wanted = min(wanted, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (wanted, hard))
+        if wanted < count + 64:
+            logging.getLogger('LoadTest').warning("only %d files allowed, too few for %d clients", wanted, count)
+    return
+
+def usage():
+    print "usage: %s [-n|--clients count] [-m|--modes mix] [-s|--server host] [-p|--port port] [-r|--ramp rate] [-d|--duration seconds] [-c|--command-interval seconds] [-i|--report-interval seconds] [-1|--once] [-S|--seed seed] [-o|--output file] [-L|--logging level] [-h|--help]" % (sys.argv[0])
+    print "-n|--clients count              : number of clients (default 100)"
+    print "-m|--modes mix                  : what the clients ask for, with weights, from %s" % (", ".join(sorted(MODES.keys())))
+    print "                                  for example dual=8,view=2 (default dual)"
+    print "-s|--server host                : server to connect to (default 127.0.0.1)"
+    print "-p|--port port                  : server port (default 20149)"
+    print "-r|--ramp rate                  : clients connected per second, 0 for all at once (default 50)"
+    print "-d|--duration seconds           : how long to run (default 60)"
+    print "-c|--command-interval seconds   : time between a player's commands (default 0.5)"
+    print "-i|--report-interval seconds    : time between reports (default 5)"
+    print "-1|--once                       : play one game each, don't connect again"
+    print "-S|--seed seed                  : seed of the modes and commands (default 1)"
+    print "-o|--output file                : write the totals to file, as JSON"
+    print "-L|--logging info|debug|warning|error: logging level"
+    print "-h|--help                       : show this message and exit"
+    return
+
+def main():
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hn:m:s:p:r:d:c:i:1S:o:L:",
+                                   ["help", "clients=", "modes=", "server=", "port=", "ramp=", "duration=",
+                                    "command-interval=", "report-interval=", "once", "seed=", "output=",
+                                    "logging="])
+    except getopt.GetoptError as e:
+        print str(e)
+        usage()
+        sys.exit(1)
+
+    show_help = False
+    count = 100
+    modes = [ ("dual", 1.) ]
+    host = "127.0.0.1"
+    port = 20149
+    ramp_rate = 50.
+    duration = 60.
+    command_interval = 0.5
+    report_interval = 5.
+    rejoin = True
+    seed = 1
+    output = None
+    logging_level = "info"
+    try:
+        for o, a in opts:
+            if o in ("-h", "--help"):
+                show_help = True
+            elif o in ("-n", "--clients"):
+                count = int(a)
+            elif o in ("-m", "--modes"):
+                modes = parse_modes(a)
+            elif o in ("-s", "--server"):
+                host = a
+            elif o in ("-p", "--port"):
+                port = int(a)
+            elif o in ("-r", "--ramp"):
+                ramp_rate = float(a)
+            elif o in ("-d", "--duration"):
+                duration = float(a)
+            elif o in ("-c", "--command-interval"):
+                command_interval = float(a)
+            elif o in ("-i", "--report-interval"):
+                report_interval = float(a)
+            elif o in ("-1", "--once"):
+                rejoin = False
+            elif o in ("-S", "--seed"):
+                seed = int(a)
+            elif o in ("-o", "--output"):
+                output = a
+            elif o in ("-L", "--logging"):
+                logging_level = a
+            else:
+                print "Unexpected option: %s" % (o)
+                usage()
+                sys.exit(1)
+    except ValueError as e:
+        print str(e)
+        usage()
+        sys.exit(1)
+    if show_help or args or count < 1 or report_interval <= 0.:
+        usage()
+        sys.exit(1)
+
+    FORMAT = '%(asctime)-15s %(levelname)s:%(name)s:%(message)s'
+    levels = { "info": logging.INFO, "debug": logging.DEBUG,
+               "warning": logging.WARNING, "error": logging.ERROR }
+    logging.basicConfig(level=levels.get(logging_level, logging.ERROR), format=FORMAT)
+    # the clients' engines complain about every message they don't know
+    logging.getLogger('ClientGameEngine').setLevel(logging.CRITICAL)
+
+    raise_file_limit(count)
+    test = LoadTest(count, modes, host, port, seed, ramp_rate, command_interval, rejoin, report_interval)
+    stats = test.run(duration)
+    mm = stats['matchmaking']
+    ti = stats['tick_intervals']
+    print "clients: %d for %.1f s, %d connects, %d connect failures, %d games" % (
+        count, stats['seconds'], stats['connects'], stats['connect_failures'], stats['games'])
+    print "matchmaking: %d, p50 %.0f ms, p99 %.0f ms, max %.0f ms" % (mm['count'], mm['p50'], mm['p99'], mm['max'])
+    print "tick interval: mean %.1f ms, sd %.1f ms, p99 %.0f ms, max %.0f ms" % (ti['mean'], ti['stddev'], ti['p99'], ti['max'])
+    print "received: %d messages, %.1f MB, %.1f KB/s" % (stats['messages'], stats['bytes_received'] / 1048576.,
+                                                       stats['bytes_per_sec'] / 1024.)
+    print "loop busy: %.0f%%" % (100. * stats['busy'],)
+    if stats['busy'] > 0.9:
+        print "the load generator was the bottleneck, run fewer clients per process"
+    if output:
+        f = open(output, 'w')
+        json.dump({ "clients": count, "modes": dict(modes), "stats": stats }, f, indent=2, sort_keys=True)
+        f.write("\n")
+        f.close()
+    return
+
+if __name__ == "__main__":
+    main()
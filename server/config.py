@@ -0,0 +1,34 @@
+# game steps per second.  every step advances the engine by exactly 1/TICK_RATE
+TICK_RATE = 30.
+# update messages per second sent to each client.  rounded so that
+# updates go out every whole number of ticks, at most one per tick
+SEND_RATE = 30.
+# most steps taken at once to catch up after a stall.  time beyond
+# that is dropped and counted as an overrun, so the game runs slow
+# for a moment instead of spiralling
+MAX_CATCHUP_STEPS = 5
+# seconds a relay waits for a slow client to take its last messages
+# when the game ends
+CLOSE_DRAIN_TIME = 1.0
+# npcs farther than FAR_NPC_DISTANCE from a player are sent to that
+# player's client only every FAR_NPC_SEND_INTERVAL sends, with all of
+# their changes since.  1 sends every npc every time
+FAR_NPC_DISTANCE = 320.
+FAR_NPC_SEND_INTERVAL = 1
+# bytes a viewer may fall behind before it skips ticks, and gets a
+# new snapshot once it has caught up
+MAX_VIEWER_BACKLOG = 256 * 1024
+# ticks between keyframes, snapshots of every object sent to every
+# client and viewer, so anything missed is repaired.  0 for none
+KEYFRAME_INTERVAL = 150
+# match recordings are written when this many bytes are waiting, or
+# this many seconds have passed, between steps
+RECORD_FLUSH_BYTES = 64 * 1024
+RECORD_FLUSH_INTERVAL = 1.0
+# with profiling on (main.py -P), each match times the phases of its
+# ticks, logs a summary every PROFILE_LOG_INTERVAL seconds, and answers
+# the lobby's stats query.  PROFILE_BUCKETS are the upper bounds, in
+# milliseconds, of the histogram buckets; times above the last go in
+# one more bucket
+PROFILE_LOG_INTERVAL = 10.0
+PROFILE_BUCKETS = [ 0.05, 0.1, 0.2, 0.5, 1., 2., 5., 10., 20., 50. ]
@@ -1,18 +1,23 @@
 from multiprocessing import Process, Pipe
-import time, random, sys, socket, select
+import time, random, sys, socket, select, copy, hashlib
 import logging
 from main_server_client import *
-from tournament import Tournament
+from tournament_cache import TR_START, TR_END
 from common.game_comm import *
 from common.object_message import *
 from common.command_message import *
 from common.event_message import *
-from engine_server.game_engine import GameEngine
-from engine_server.player import Player
-from engine_server.wall import Wall
-from engine_server.npc import NPC
-from engine_server.missile import Missile
+from common.snapshot_message import *
+from engine_server.array_engine import make_engine
+from engine_server.game_engine import PLAYER_COMMANDS
+from engine_server.object import Object, UPDATE_MESSAGE_CLASSES
 from engine_server.config import EPSILON
+import engine_server.config as engine_config
+from config import *
+from send_queue import ClientSendQueue
+from spectator_hub import SpectatorHub
+from match_record import open_recorder
+from tick_profiler import TickProfiler, format_window
 
 class GameServer:
     """
@@ -20,9 +25,22 @@ class GameServer:
     from and to 2 separate client pipes.  It will
     sleep to achieve a desired frame rate.  Each
     client incoming pipe will be emptied each frame.
+
+    The pipes may be anything with the Connection methods
+    poll(), recv(), send() and close(); MatchHost passes
+    ClientEndpoints that talk to the client sockets directly,
+    and calls advance() itself instead of run().
+
+    The engine is always stepped by exactly 1/tick_rate seconds;
+    see advance().  The engine's random numbers come from seed, and
+    the match numbers its own objects, whatever other matches share
+    the process, so a recording of the seed and the commands replays
+    the match exactly; see match_record.py and replay.py.
     """
 
-    def __init__(self, pipe1, pipe2, client1, client2, pipe3, viewer):
+    def __init__(self, pipe1, pipe2, client1, client2, pipe3, viewer,
+                 tick_rate=TICK_RATE, send_rate=SEND_RATE, control=None,
+                 record_dir=None, seed=None, profile=False):
         self.logger = logging.getLogger('GameServer')
         self.logger.debug('__init__')
         self.pipe = [ pipe1, pipe2 ]
@@ -33,21 +51,113 @@ class GameServer:
         self.done = False
         self.sent_winner = False
         self.time   = 0.
-        self.frame_rate = 30.
-        self.desired_dt = 1.0/float(self.frame_rate)
-        self.engine = GameEngine()
-        self.tournament = Tournament()
-        self.tournament.open()
+        # fixed time step, and how many steps between sends
+        self.tick_dt = 1.0/float(tick_rate)
+        self.send_interval = max(1, int(round(float(tick_rate)/float(send_rate))))
+        self.max_catchup_steps = MAX_CATCHUP_STEPS
+        self.accumulator = 0.   # wall clock time not yet stepped
+        self.ticks = 0
+        self.sends = 0
+        self.overruns = 0       # times advance() gave up catching up
+        self.dropped_time = 0.  # wall clock time never stepped
+        # npc updates held back from each player's client, oid -> data
+        self.far_npc_distance = FAR_NPC_DISTANCE
+        self.far_npc_interval = FAR_NPC_SEND_INTERVAL
+        self.deferred = [ {} for pid in range(len(self.pipe)) ]
+        # snapshots of every object, every keyframe_interval ticks and on request
+        self.keyframe_interval = KEYFRAME_INTERVAL
+        self.last_keyframe = 0
+        self.keyframes = 0
+        self.snapshot_requests = set() # pids
+        # any number of viewers; new ones come on the control pipe, if any
+        self.hub = SpectatorHub(self, control)
+        # the engine has its own random numbers, from a seed that is
+        # recorded, and the match its own object ids, swapped in for
+        # each step.  the fairness shuffles have their own, unrecorded
+        if seed is None:
+            seed = random.SystemRandom().getrandbits(31)
+        self.seed = seed
+        self.shuffle_random = random.Random()
+        self.next_object_id = 0
+        outer = self.swap_in()
+        self.engine = make_engine(seed=self.seed)
+        self.swap_out(outer)
+        # if profile, the time of each phase of each tick, see tick_profiler.py
+        self.profiler = None
+        if profile:
+            self.profiler = TickProfiler(self.tick_dt)
+        self.engine.profiler = self.profiler
+        self.logger.info("match %s vs %s, seed %d", client1.name, client2.name, self.seed)
+        self.recorder = None
+        if record_dir:
+            self.recorder = open_recorder(record_dir, self.get_names(), self.get_record_header())
+        # reports for the lobby's tournament, if there is no control pipe to send them on
+        self.tournament_reports = []
+        return
+
+    def swap_in(self):
+        """Makes this match's object ids current.  Returns what to give swap_out()."""
+        outer = Object.next_object_id
+        Object.next_object_id = self.next_object_id
+        return outer
+
+    def swap_out(self, outer):
+        self.next_object_id = Object.next_object_id
+        Object.next_object_id = outer
+        return
+
+    def get_names(self):
+        return [ self.clients[0].name, self.clients[1].name ]
+
+    def get_record_header(self):
+        """What a replay needs, besides the commands, to play this match again."""
+        engine = {}
+        for key in dir(engine_config):
+            value = getattr(engine_config, key)
+            if key.isupper() and isinstance(value, (int, float, str)):
+                engine[key] = value
+        return { 'seed': self.seed,
+                 'names': self.get_names(),
+                 'tick_rate': 1.0/self.tick_dt,
+                 'send_interval': self.send_interval,
+                 'keyframe_interval': self.keyframe_interval,
+                 'time': time.time(),
+                 'engine': engine }
+
+    def get_state_digest(self):
+        """A digest of every object's state, to check that a replay matches."""
+        return hashlib.md5(str(self.get_snapshot())).hexdigest()
+
+    def flush_recording(self):
+        if self.recorder:
+            self.recorder.flush()
+        return
+
+    def close_recording(self):
+        if self.recorder:
+            self.recorder.close(self.ticks, self.get_state_digest())
+            self.recorder = None
+        return
+
+    def report_tournament(self, report):
+        """
+        Tells the lobby about this game, for its tournament.  A game in
+        its own process sends the report on its control pipe.  Otherwise
+        the MatchHost takes it from tournament_reports, and gives it to
+        the lobby, directly or through its worker's pipe.
+        """
+        if self.hub.control:
+            self.hub.report_tournament(report)
+        else:
+            self.tournament_reports.append(report)
         return
 
     def end_tournament_game(self, winner):
-        if self.tournament.either_game_exists(self.clients[0].name, self.clients[1].name):
-            self.tournament.end_game(self.clients[0].name, self.clients[1].name, winner)
+        self.report_tournament((TR_END, self.clients[0].name, self.clients[1].name, winner))
         return
         
     def start_tournament_game(self):
-        if self.tournament.either_game_exists(self.clients[0].name, self.clients[1].name):
-            self.tournament.start_game(self.clients[0].name, self.clients[1].name)
+        self.report_tournament((TR_START, self.clients[0].name, self.clients[1].name, None))
         return
         
     def evolve(self, dt):
@@ -77,6 +187,14 @@ class GameServer:
             self.close_pipe(pid)
         return
 
+    def player_disconnected(self, pid):
+        oid = self.oid_from_pid(pid)
+        if self.recorder:
+            self.recorder.add_disconnect(self.ticks, oid)
+        self.engine.set_player_disconnected(oid)
+        self.close_pipe(pid)
+        return
+
     def oid_from_pid(self, pid):
         if pid == 0 or pid == 2: # viewer == 2
             oid = self.engine.get_player1_oid()
@@ -90,9 +208,7 @@ class GameServer:
         code = msg.get_command()
         if code == M_CLOSED:
             self.logger.debug("pipe[%d] closed on M_CLOSED", pid)
-            oid = self.oid_from_pid(pid)
-            self.engine.set_player_disconnected(oid)
-            self.close_pipe(pid)
+            self.player_disconnected(pid)
         elif code == M_ECHO:
             rmsg = GameMessageEcho()
             rmsg.set_text(msg.get_text())
@@ -112,62 +228,16 @@ class GameServer:
             rmsg = PlayerOidMessage(oid)
             if self.pipe[pid]:
                 self.pipe[pid].send(rmsg)
-        elif code == M_SET_PLAYER_SPEED:
-            if pid < 2:
-                speed = msg.get_speed()
-                oid = self.oid_from_pid(pid)
-                if speed == T_SPEED_STOP:
-                    self.engine.set_player_speed_stop(oid)
-                elif speed == T_SPEED_SLOW:
-                    self.engine.set_player_speed_slow(oid)
-                elif speed == T_SPEED_MEDIUM:
-                    self.engine.set_player_speed_medium(oid)
-                elif speed == T_SPEED_FAST:
-                    self.engine.set_player_speed_fast(oid)
-                else:
-                    self.logger.error("Unexpected speed %s", speed)
-        elif code == M_SET_PLAYER_DIRECTION:
-            if pid < 2:
-                degrees = msg.get_degrees()
-                oid = self.oid_from_pid(pid)
-                self.engine.set_player_direction(oid, degrees)
-        elif code == M_SET_MISSILE_RANGE:
-            if pid < 2:
-                mrange = msg.get_range()
-                oid = self.oid_from_pid(pid)
-                if mrange == T_RANGE_NONE:
-                    self.engine.set_missile_range_none(oid)
-                elif mrange == T_RANGE_SHORT:
-                    self.engine.set_missile_range_short(oid)
-                elif mrange == T_RANGE_MEDIUM:
-                    self.engine.set_missile_range_medium(oid)
-                elif mrange == T_RANGE_LONG:
-                    self.engine.set_missile_range_long(oid)
-                else:
-                    self.logger.error("Unexpected range %s", mrange)
-        elif code == M_SET_MISSILE_DIRECTION:
+        elif code == M_REQUEST_SNAPSHOT:
+            # sent with the next update
+            self.snapshot_requests.add(pid)
+        elif code in PLAYER_COMMANDS:
             if pid < 2:
-                degrees = msg.get_degrees()
                 oid = self.oid_from_pid(pid)
-                self.engine.set_missile_direction(oid, degrees)
-        elif code == M_SET_MISSILE_POWER:
-            if pid < 2:
-                power = msg.get_power()
-                oid = self.oid_from_pid(pid)
-                if power == T_POWER_NONE:
-                    self.engine.set_missile_power_none(oid)
-                elif power == T_POWER_LOW:
-                    self.engine.set_missile_power_low(oid)
-                elif power == T_POWER_MEDIUM:
-                    self.engine.set_missile_power_medium(oid)
-                elif power == T_POWER_HIGH:
-                    self.engine.set_missile_power_high(oid)
-                else:
-                    self.logger.error("Unexpected power %s", power)
-        elif code == M_FIRE_MISSILE:
-            if pid < 2:
-                oid = self.oid_from_pid(pid)
-                self.engine.fire_missile(oid)
+                if self.recorder:
+                    self.recorder.add_command(self.ticks, oid, msg)
+                if not self.engine.process_command(oid, msg):
+                    self.logger.error("Unexpected command %s", msg)
         else:
             self.logger.error('Unknown message: %s', code)
             
@@ -184,14 +254,10 @@ class GameServer:
                 self.process_message(pid, msg)
         except EOFError as e:
             self.logger.error("pipe[%d] closed on recv: %s", pid, e)
-            oid = self.oid_from_pid(pid)
-            self.engine.set_player_disconnected(oid)
-            self.close_pipe(pid)
+            self.player_disconnected(pid)
         except:
             self.logger.error("pipe[%d] closed on recv: %s", pid, sys.exc_info()[0])
-            oid = self.oid_from_pid(pid)
-            self.engine.set_player_disconnected(oid)
-            self.close_pipe(pid)
+            self.player_disconnected(pid)
             raise
         return
 
@@ -201,28 +267,89 @@ class GameServer:
         self.logger.debug('receive_messages')
         pids = range(len(self.pipe))
         # randomize order for fairness
-        random.shuffle(pids)
+        self.shuffle_random.shuffle(pids)
         for pid in pids:
             self.process_pipe(pid)
         return
 
-    def get_object_messages(self, objs):
+    def get_object_messages(self, objs, partial):
+        """
+        Update messages for objs.  If partial, each message holds only
+        the oid and the fields changed since the object was last sent.
+        """
+        if self.engine.has_object_arrays():
+            # read the message fields straight from the engine's arrays
+            rows = self.engine.get_object_message_data(objs)
+        else:
+            rows = None
         msgs = []
-        for obj in objs:
-            if isinstance(obj, Player):
-                msg = PlayerUpdateMessage(obj.get_data())
-            elif isinstance(obj, Wall):
-                msg = WallUpdateMessage(obj.get_data())
-            elif isinstance(obj, NPC):
-                msg = NPCUpdateMessage(obj.get_data())
-            elif isinstance(obj, Missile):
-                msg = MissileUpdateMessage(obj.get_data())
-            else:
+        for i in range(len(objs)):
+            obj = objs[i]
+            message_class = UPDATE_MESSAGE_CLASSES.get(obj.kind)
+            if message_class is None:
                 self.logger.error("Unknown object type: %s", obj)
                 continue
+            msg = message_class()
+            if rows:
+                msg.data = rows[i]
+                fields = obj.get_changed_fields()
+                if partial and fields is not None:
+                    msg.data = dict([ (key, rows[i][key]) for key in fields ])
+                    msg.data['oid'] = rows[i]['oid']
+            elif partial:
+                obj.set_message(msg)
+            else:
+                obj.get_data().set_message(msg)
             msgs.append(msg)
         return msgs
 
+    def is_far(self, obj1, obj2):
+        (x1, y1) = obj1.get_center()
+        (x2, y2) = obj2.get_center()
+        return (x1 - x2)**2 + (y1 - y2)**2 > self.far_npc_distance**2
+
+    def filter_far_npcs(self, pid, msgs):
+        """
+        Holds back the updates of npcs far from pid's player, except
+        every far_npc_interval sends.  Held updates are merged, so the
+        client gets every change, only later.
+        """
+        deferred = self.deferred[pid]
+        player = self.engine.players.get(self.oid_from_pid(pid))
+        send_far = player is None or self.sends % self.far_npc_interval == 0
+        out = []
+        for msg in msgs:
+            if msg.get_command() != M_NPC_UPDATE:
+                out.append(msg)
+                continue
+            oid = msg.get_data('oid')
+            if oid in deferred:
+                data = deferred.pop(oid)
+                data.update(msg.data)
+                msg = copy.copy(msg) # msg is shared with other clients
+                msg.data = data
+            npc = self.engine.npcs.get(oid)
+            if not send_far and npc is not None and self.is_far(player, npc):
+                deferred[oid] = dict(msg.data)
+            else:
+                out.append(msg)
+        if send_far:
+            for oid in deferred:
+                msg = NPCUpdateMessage()
+                msg.data = deferred[oid]
+                out.append(msg)
+            deferred.clear()
+        return out
+
+    def get_snapshot(self):
+        """A SnapshotMessage of every object, for a client that has nothing yet."""
+        objs = self.engine.all_objects.values()
+        objs.sort(key=lambda obj: obj.get_object_id())
+        snapshot = SnapshotMessage(self.ticks)
+        for msg in self.get_object_messages(objs, False):
+            snapshot.add_message(msg)
+        return snapshot
+
     def get_event_messages(self, events):
         msgs = []
         for event in events:
@@ -239,18 +366,47 @@ class GameServer:
         self.logger.debug('send_messages')
         # randomize order for fairness
         pids = range(len(self.pipe))
-        random.shuffle(pids)
+        self.shuffle_random.shuffle(pids)
+
+        # a keyframe for everyone, or a snapshot for those who asked
+        snapshot = None
+        keyframe = (self.keyframe_interval > 0 and
+                    self.ticks - self.last_keyframe >= self.keyframe_interval)
+        if keyframe or self.snapshot_requests:
+            snapshot = self.get_snapshot()
+        if keyframe:
+            self.last_keyframe = self.ticks
+            self.keyframes += 1
 
-        # object update messages
+        # object update messages, with only the changed fields
+        # for clients that can apply them, every field for the others
         objs = self.engine.get_changed_objects()
-        msgs = self.get_object_messages(objs)
+        if keyframe:
+            # the snapshot has them all
+            objs = []
+        partial_msgs = []
+        full_msgs = []
+        need_partial = self.hub.needs(True)
+        need_full = self.hub.needs(False)
+        for pid in pids:
+            if self.pipe[pid]:
+                if self.clients[pid].partial_updates:
+                    need_partial = True
+                else:
+                    need_full = True
+        if need_partial:
+            partial_msgs = self.get_object_messages(objs, True)
+        if need_full:
+            full_msgs = self.get_object_messages(objs, False)
         self.engine.clear_changed_objects()
+        prof = self.profiler
+        if prof:
+            prof.mark('object_messages')
         
         # event messages
         events = self.engine.get_events()
-        emsgs = self.get_event_messages(events)
+        msgs = self.get_event_messages(events)
         self.engine.clear_events()
-        msgs.extend(emsgs)
 
         # game over message
         if self.engine.get_game_over_percent() > EPSILON and not self.sent_winner:
@@ -264,13 +420,38 @@ class GameServer:
             print "Winner is %s" % (wname)
             self.end_tournament_game(wname)
             self.sent_winner = True
+        if prof:
+            prof.mark('events')
             
+        # everything for this tick goes in one batch, one pipe send per client
+        partial_batch = TickBatchMessage(partial_msgs + msgs)
+        full_batch = TickBatchMessage(full_msgs + msgs)
+        if keyframe:
+            self.hub.broadcast(partial_batch.get_messages(), full_batch.get_messages(), snapshot)
+        else:
+            self.hub.broadcast(partial_batch.get_messages(), full_batch.get_messages())
         for pid in pids:
             try:
-                for msg in msgs:
-                    self.logger.debug("pipe[%d].send(%s)", pid, msg)
+                if self.clients[pid].partial_updates:
+                    batch = partial_batch
+                else:
+                    batch = full_batch
+                if keyframe or pid in self.snapshot_requests:
+                    # the snapshot replaces this tick's object updates
+                    self.deferred[pid].clear()
                     if self.pipe[pid]:
-                        self.pipe[pid].send(msg)
+                        self.pipe[pid].send(snapshot)
+                    batch = TickBatchMessage(msgs)
+                elif self.far_npc_interval > 1 and pid < 2:
+                    if self.clients[pid].partial_updates:
+                        object_msgs = partial_msgs
+                    else:
+                        object_msgs = full_msgs
+                    batch = TickBatchMessage(self.filter_far_npcs(pid, object_msgs) + msgs)
+                if batch.get_messages():
+                    self.logger.debug("pipe[%d].send(%s)", pid, batch)
+                    if self.pipe[pid]:
+                        self.pipe[pid].send(batch)
                 if self.done:
                     msg = GameMessageClosed()
                     self.logger.debug("pipe[%d].send(%s)", pid, msg)
@@ -278,17 +459,91 @@ class GameServer:
                         self.pipe[pid].send(msg)
             except ValueError as e:
                 self.logger.error("pipe[%d] closed on send: %s", pid, str(e))
-                oid = self.oid_from_pid(pid)
-                self.engine.set_player_disconnected(oid)
-                self.close_pipe(pid)
+                self.player_disconnected(pid)
             except:
                 self.logger.error("pipe[%d] closed on send: %s", pid, sys.exc_info()[0])
-                oid = self.oid_from_pid(pid)
-                self.engine.set_player_disconnected(oid)
-                self.close_pipe(pid)
+                self.player_disconnected(pid)
                 raise
+        self.snapshot_requests.clear()
+        if prof:
+            prof.mark('send')
         return
 
+    def step(self):
+        """
+        One fixed step: receive client messages, advance the game
+        tick_dt, and send updates if this is a send tick, or the end.
+        """
+        outer = self.swap_in()
+        prof = self.profiler
+        if prof:
+            prof.begin()
+        self.hub.service()
+        if prof:
+            prof.mark('hub')
+        self.receive_messages()
+        if prof:
+            prof.mark('receive')
+        self.evolve(self.tick_dt)
+        self.ticks += 1
+        if self.ticks % self.send_interval == 0 or self.done:
+            self.send_messages()
+            self.sends += 1
+        self.swap_out(outer)
+        if prof:
+            prof.end()
+            if prof.is_roll_due():
+                self.report_profile()
+        return
+
+    def get_profile_stats(self):
+        """This match's tick profile, or None if it isn't profiled."""
+        if not self.profiler:
+            return None
+        stats = self.profiler.get_stats()
+        stats['names'] = self.get_names()
+        stats['tick_stats'] = self.get_tick_stats()
+        return stats
+
+    def report_profile(self):
+        """Logs the window of the tick profile just closed, and sends the profile to the lobby."""
+        stats = self.profiler.roll()
+        names = self.get_names()
+        self.logger.info("profile %s vs %s: %s", names[0], names[1],
+                         format_window(stats, self.profiler.budget))
+        self.hub.report_stats(self.get_profile_stats())
+        return
+
+    def advance(self, elapsed):
+        """
+        Account for elapsed seconds of wall clock time, and take as
+        many fixed steps as are due, but no more than max_catchup_steps.
+        Returns the number of steps taken.
+        """
+        self.accumulator += elapsed
+        steps = 0
+        while self.accumulator >= self.tick_dt and not self.done:
+            if steps >= self.max_catchup_steps:
+                # too far behind, drop whole steps but keep the fraction
+                remainder = self.accumulator % self.tick_dt
+                dropped = self.accumulator - remainder
+                self.dropped_time += dropped
+                self.accumulator = remainder
+                self.overruns += 1
+                self.logger.warning("tick overrun, dropped %f s", dropped)
+                break
+            self.step()
+            self.accumulator -= self.tick_dt
+            steps += 1
+        return steps
+
+    def get_tick_stats(self):
+        return { 'ticks': self.ticks,
+                 'sends': self.sends,
+                 'overruns': self.overruns,
+                 'dropped_time': self.dropped_time,
+                 'keyframes': self.keyframes }
+
     def run(self):
         """Run one game."""
         
@@ -296,23 +551,23 @@ class GameServer:
         self.start_tournament_game()
         t1 = t0 = time.time()
         while not self.done:
-            # receive messages from clients
-            self.receive_messages()
-            # enforce frame-rate
-            dt = time.time() - t1
-            if dt < self.desired_dt:
-                time.sleep(self.desired_dt - dt)
             t2 = time.time()
-            dt = t2 - t1
-            # advance game state
-            self.evolve(dt)
-            # send messages to clients
-            self.send_messages()
+            self.advance(t2 - t1)
             t1 = t2
+            self.flush_recording()
+            # sleep until the next step is due
+            wait = self.tick_dt - self.accumulator - (time.time() - t2)
+            if wait > 0.:
+                time.sleep(wait)
 
         t1 = time.time()
-        self.logger.info("run done. self.time: %f  t1-t0: %f", self.time, t1 - t0)
+        self.logger.info("run done. self.time: %f  t1-t0: %f  stats: %s",
+                         self.time, t1 - t0, self.get_tick_stats())
+        if self.profiler and self.profiler.window.ticks.count:
+            self.report_profile()
         self.close_pipes()
+        self.close_recording()
+        self.hub.close(CLOSE_DRAIN_TIME)
         return
 
 class GameClientConnection:
@@ -321,18 +576,26 @@ class GameClientConnection:
     from and to the game via a pipe.  It also receives
     and sends messages from and to the client via
     network communications.
+
+    The socket is non-blocking.  Messages for the client wait in a
+    ClientSendQueue until the socket takes them, so a slow client
+    never stops this process from draining the game's pipe.
     """
 
-    def __init__(self, cid, sock, pipe):
+    def __init__(self, cid, sock, pipe, gc=None):
         self.logger = logging.getLogger('GameClientConnection_%d' % (cid,))
         self.logger.debug('__init__')
         self.cid = cid
         self.sock = sock
         self.pipe = pipe
+        # reuse the lobby's GameComm, its buffer may already hold messages
+        if gc is None:
+            gc = GameComm(sock)
+        self.gc = gc
+        self.queue = ClientSendQueue(gc)
+        self.poll_out = False # if POLLOUT is requested for the socket
         self.x = 0
         self.done = False
-        self.bad_write_count = 0
-        self.max_bad_write_count = 10
         return
 
     def close_pipe(self):
@@ -364,7 +627,7 @@ class GameClientConnection:
         return
         
     def receive_pipe_messages(self):
-        """Receive messages from the game class."""
+        """Receive messages from the game class, and relay them to the client in one write."""
         
         self.logger.debug('receive_pipe_messages')
         try:
@@ -374,21 +637,14 @@ class GameClientConnection:
                 code = msg.get_command()
                 if code == M_CLOSED:
                     self.logger.debug("pipe[%d] closing pipe", self.cid)
+                    if not self.queue.drain(CLOSE_DRAIN_TIME):
+                        self.logger.warning("sock[%d] closed with messages unsent", self.cid)
                     self.close_pipe()
                 elif code in ALL_MESSAGE_CODES:
-                    gc = GameComm(self.sock)
-                    if not gc.write_mesg(msg):
-                        self.logger.error("Error in write_mesg.")
-                        self.bad_write_count += 1
-                        if self.bad_write_count >= self.max_bad_write_count:
-                            self.logger.error("Too many write errors, closing down.")
-                            self.logger.debug("pipe[%d] closing pipe", self.cid)
-                            self.close_pipe()
-                            self.close_sock()
-                    else:
-                        self.bad_write_count = 0
+                    self.queue.add(msg)
                 else:
                     self.logger.error("pipe[%d] bad pipe message: %s", self.cid, str(msg))
+            self.send_socket_messages()
         except EOFError as e:
             self.logger.error("pipe[%d] closed on recv: %s", self.cid, e)
             self.close_pipe()
@@ -404,7 +660,7 @@ class GameClientConnection:
             raise
             
         return
-        
+
     def receive_socket_messages(self):
         """Receive messages from the remote client."""
         
@@ -416,11 +672,10 @@ class GameClientConnection:
             self.logger.error('receive_socket_messages: done (pipe=None)')
             return
             
+        msgs = []
         try:
-            msg = None
-            gc = GameComm(self.sock)
-            msg = gc.read_mesg()
-            self.logger.debug("sock.recv(): %s" , msg)
+            msgs = self.gc.read_mesgs()
+            self.logger.debug("sock.recv(): %s" , msgs)
         except socket.error as e:
             self.logger.error("sock[%d] closed on recv: %s", self.cid, e)
             if self.pipe:
@@ -431,19 +686,18 @@ class GameClientConnection:
             self.logger.error("Unknown exeption %s", sys.exc_info()[0])
             raise
 
-        if msg:
+        for msg in msgs:
             code = msg.get_command()
             if code == M_CLOSED:
                 if self.pipe:
                     msg = GameMessageClosed()
                     self.pipe.send(msg)
                 self.close_sock()
+                break
             elif code in ALL_MESSAGE_CODES:
                 if self.pipe:
                     self.logger.debug("pipe.send(%s)" , msg)
                     self.pipe.send(msg)
-            elif code == M_EAGAIN:
-                self.logger.debug("Waiting to try again.")
             else:
                 self.logger.error("Unexpected cmd: %s", code)
 
@@ -470,9 +724,27 @@ class GameClientConnection:
         return
         
     def send_socket_messages(self):
-        """Send messages to the remote client."""
+        """Send queued messages to the remote client, as far as the socket takes them."""
         
         self.logger.debug('send_socket_messages')
+        if not self.sock:
+            return
+        try:
+            done = self.queue.flush()
+        except socket.error as e:
+            self.logger.error("sock[%d] closed on send: %s", self.cid, e)
+            if self.pipe:
+                msg = GameMessageClosed()
+                self.pipe.send(msg)
+            self.close_sock()
+            return
+        # wait for room in the socket only while something is waiting
+        if done == self.poll_out:
+            self.poll_out = not done
+            mask = select.POLLIN
+            if self.poll_out:
+                mask |= select.POLLOUT
+            self.poll.modify(self.sock.fileno(), mask)
         return
         
     def run(self):
@@ -483,16 +755,21 @@ class GameClientConnection:
         self.logger.info('run')
         self.poll = select.poll()
         if self.sock:
+            self.sock.setblocking(0)
             self.poll.register(self.sock.fileno(), select.POLLIN)
         if self.pipe:
             self.poll.register(self.pipe.fileno(), select.POLLIN)
+        if self.gc.has_buffered_mesg():
+            # sent before the lobby handed over the socket
+            self.receive_socket_messages()
         while not self.done:
             self.logger.debug('poll start %d', self.cid)
             ready_list = self.poll.poll()
             self.logger.debug('poll end %d', self.cid)
             for (fd, event) in ready_list:
                 if self.sock and self.sock.fileno() == fd:
-                    self.receive_socket_messages()
+                    if event & ~select.POLLOUT:
+                        self.receive_socket_messages()
                 elif self.pipe and self.pipe.fileno() == fd:
                     self.receive_pipe_messages()
                 else:
@@ -500,11 +777,11 @@ class GameClientConnection:
             self.send_pipe_messages()
             self.send_socket_messages()
 
-        self.logger.info('run done')
+        self.logger.info('run done. send queue: %s', self.queue.get_stats())
         self.close_pipe()
         return
 
-def start_game(pipepair1,pipepair2,client1,client2,pipepair3,viewer0):
+def start_game(pipepair1,pipepair2,client1,client2,pipepair3,viewer0,tick_rate=TICK_RATE,send_rate=SEND_RATE,control=None,record_dir=None,profile=False):
     """Global function to launch Game process"""
     # pipepair1[0].close()
     # pipepair2[0].close()
@@ -512,20 +789,20 @@ def start_game(pipepair1,pipepair2,client1,client2,pipepair3,viewer0):
         p3 = pipepair3[1]
     else:
         p3 = None
-    g = GameServer(pipepair1[1],pipepair2[1],client1,client2,p3,viewer0)
+    g = GameServer(pipepair1[1],pipepair2[1],client1,client2,p3,viewer0,tick_rate,send_rate,control,record_dir,None,profile)
     g.run()
     return
     
-def start_client(cid, sock, pipepair1, pipepair2):
+def start_client(cid, client, pipepair1, pipepair2):
     """Global function to launch Client process"""
     # pipepair1[1].close()
     # pipepair2[0].close()
     # pipepair2[1].close()
-    c = GameClientConnection(cid, sock, pipepair1[0])
+    c = GameClientConnection(cid, client.sock, pipepair1[0], client.gc)
     c.run()
     return
 
-def main(client1,client2,viewer0):
+def main(client1,client2,viewer0,tick_rate=TICK_RATE,send_rate=SEND_RATE,control=None,record_dir=None,profile=False):
     """Global function to launch the game process,
     and two client managing processes."""
     
@@ -539,21 +816,19 @@ def main(client1,client2,viewer0):
     else:
         pipe_pair_3 = None
         
-    random.random()
-    p = Process(target=start_game, args=(pipe_pair_1, pipe_pair_2, client1, client2, pipe_pair_3, viewer0))
-    random.random()
-    c1 = Process(target=start_client, args=(0, client1.sock, pipe_pair_1, pipe_pair_2, ))
-    random.random()
-    c2 = Process(target=start_client, args=(1, client2.sock, pipe_pair_2, pipe_pair_1, ))
-    random.random()
+    p = Process(target=start_game, args=(pipe_pair_1, pipe_pair_2, client1, client2, pipe_pair_3, viewer0, tick_rate, send_rate, control, record_dir, profile))
+    c1 = Process(target=start_client, args=(0, client1, pipe_pair_1, pipe_pair_2, ))
+    c2 = Process(target=start_client, args=(1, client2, pipe_pair_2, pipe_pair_1, ))
     if viewer0:
-        v0 = Process(target=start_client, args=(2, viewer0.sock, pipe_pair_3, pipe_pair_1, ))
-        random.random()
+        v0 = Process(target=start_client, args=(2, viewer0, pipe_pair_3, pipe_pair_1, ))
     # pipe_pair_1[0].close()
     # pipe_pair_1[1].close()
     # pipe_pair_2[0].close()
     # pipe_pair_2[1].close()
     p.start()
+    if control:
+        # only the game holds it now, so the lobby sees it close
+        control.close()
     c1.start()
     c2.start()
     if viewer0:
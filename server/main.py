@@ -1,17 +1,24 @@
 #!/usr/bin/env python
-import logging, sys, getopt
+import logging, sys, getopt, multiprocessing
 sys.path.append('..')
 from main_server import MainServer
+from config import TICK_RATE, SEND_RATE
 
 def usage():
-    print "usage: %s [-L|--logging level] [-h|--help]" % (sys.argv[0])
+    print "usage: %s [-H|--hosted] [-w|--workers count] [-r|--tick-rate rate] [-s|--send-rate rate] [-R|--record dir] [-P|--profile] [-L|--logging level] [-h|--help]" % (sys.argv[0])
+    print "-H|--hosted      : run matches in the server process, not a process per player"
+    print "-w|--workers count: hand matches to count long lived worker processes, 0 for one per cpu"
+    print "-r|--tick-rate rate: game steps per second (default %g)" % (TICK_RATE)
+    print "-s|--send-rate rate: updates per second to each client (default %g)" % (SEND_RATE)
+    print "-R|--record dir  : record every match in dir, for replay.py"
+    print "-P|--profile     : time the phases of every tick, log them, and answer stats.py"
     print "-L|--logging info|debug|warning|error: logging level"
     print "-h|--help        : show this message and exit"
     return
 
 def main():
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "hL:", ["help", "logging="])
+        opts, args = getopt.getopt(sys.argv[1:], "hHw:r:s:R:PL:", ["help", "hosted", "workers=", "tick-rate=", "send-rate=", "record=", "profile", "logging="])
     except getopt.GetoptError as e:
         print str(e)
         usage()
@@ -19,15 +26,44 @@ def main():
 
     show_help = False
     logging_level = "info"
+    hosted = False
+    workers = None
+    tick_rate = TICK_RATE
+    send_rate = SEND_RATE
+    record_dir = None
+    profile = False
     for o, a in opts:
         if o in ("-h", "--help"):
             show_help = True
+        elif o in ("-H", "--hosted"):
+            hosted = True
+        elif o in ("-w", "--workers"):
+            try:
+                workers = int(a)
+            except ValueError:
+                show_help = True
+        elif o in ("-r", "--tick-rate"):
+            try:
+                tick_rate = float(a)
+            except ValueError:
+                show_help = True
+        elif o in ("-s", "--send-rate"):
+            try:
+                send_rate = float(a)
+            except ValueError:
+                show_help = True
+        elif o in ("-R", "--record"):
+            record_dir = a
+        elif o in ("-P", "--profile"):
+            profile = True
         elif o in ("-L", "--logging"):
             logging_level = a
         else:
             print "Unexpected option: %s" % (o)
             usage()
             sys.exit(1)
+    if tick_rate <= 0. or send_rate <= 0.:
+        show_help = True
     if show_help:
         usage()
         sys.exit(1)
@@ -45,7 +81,14 @@ def main():
         logging.basicConfig(level=logging.ERROR,format=FORMAT)
 
 
-    server = MainServer()
+    worker_count = 0
+    if workers == 0:
+        worker_count = multiprocessing.cpu_count()
+    elif workers is not None and workers > 0:
+        worker_count = workers
+    server = MainServer(hosted=hosted, worker_count=worker_count,
+                        tick_rate=tick_rate, send_rate=send_rate, record_dir=record_dir,
+                        profile=profile)
     server.run()
     return
 
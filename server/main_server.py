@@ -1,12 +1,63 @@
-from multiprocessing import Process
+from multiprocessing import Process, Pipe
+from multiprocessing.reduction import send_handle
 import socket, select, logging, errno, sys, random
 import game_server
+from match_host import MatchHost
+from match_worker import WorkerHandle
+from spectator_hub import HUB_VIEW, HUB_STATS, HUB_TOURNAMENT
+from config import *
 from common.game_comm import *
 from common.game_message import *
+from common.stats_message import *
 from main_server_client import *
-from tournament import Tournament
+from tournament_cache import TournamentCache
 import client_ai.main
 
+class RunningMatch:
+    """
+    The lobby's record of a match it started, so viewers can be sent
+    to it.  The match is a game in this process, a match in a worker,
+    or a game process with a control pipe to its SpectatorHub.
+    """
+
+    def __init__(self, match_id, names):
+        self.match_id = match_id
+        self.names = names
+        self.game = None
+        self.worker = None
+        self.process = None
+        self.control = None
+        self.stats = None # tick profile, as last sent on the control pipe
+        return
+
+    def is_running(self):
+        if self.game:
+            return not self.game.done
+        if self.worker:
+            return self.match_id in self.worker.running
+        if self.process and self.process.is_alive():
+            return True
+        return False
+
+    def get_stats(self):
+        """The match's tick profile, or None if it isn't profiled, or hasn't sent one yet."""
+        if self.game:
+            return self.game.get_profile_stats()
+        if self.worker:
+            return self.worker.stats.get(self.match_id)
+        return self.stats
+
+    def add_viewer(self, client):
+        """Raises IOError, OSError or ValueError if the match can't be reached."""
+        if self.game:
+            self.game.hub.add_viewer(client)
+        elif self.worker:
+            self.worker.add_viewer(self.match_id, client)
+        else:
+            self.control.send((HUB_VIEW, client.get_handoff()))
+            send_handle(self.control, client.sock.fileno(), self.process.pid)
+        return
+
 class MainServer:
     """
     Accepts pairs of connections and spawns game server to handle the game.
@@ -30,7 +81,8 @@ class MainServer:
         -> pair with a user who wants to player single game
         <- send acknowledgement message
       + request to view
-        -> put in viewer queue, allow to view next viewerless match
+        -> send to the newest running match, or the one with the
+           named player, or wait for the next one to start
         <- send acknowledgement message
 
       + request active game list
@@ -46,7 +98,8 @@ class MainServer:
         -> close socket
     """
 
-    def __init__(self, ip="0.0.0.0", port=20149, listen_count=8):
+    def __init__(self, ip="0.0.0.0", port=20149, listen_count=8, hosted=False, worker_count=0,
+                 tick_rate=TICK_RATE, send_rate=SEND_RATE, record_dir=None, profile=False):
         self.logger = logging.getLogger('MainServer')
         self.logger.debug('__init__')
         self.ip = ip
@@ -57,8 +110,23 @@ class MainServer:
         self.done = False
         self.clients = [] # list of MainServerClient objects waiting for action
         self.processes = []
-        self.tournament = Tournament()
-        self.tournament.open()
+        self.matches = [] # RunningMatch objects, oldest first
+        self.next_match_id = 1
+        # if hosted, matches run in this process instead of their own processes
+        self.hosted = hosted
+        self.match_host = None
+        # if worker_count, matches are handed to that many long lived worker processes
+        self.worker_count = worker_count
+        self.workers = []
+        # for every game
+        self.tick_rate = tick_rate
+        self.send_rate = send_rate
+        # if record_dir, every match is recorded there, see match_record.py
+        self.record_dir = record_dir
+        # if profile, every match times the phases of its ticks, see tick_profiler.py
+        self.profile = profile
+        # the tournament, in memory, see tournament_cache.py
+        self.tournament = TournamentCache()
         return
 
     def prepare_socket(self):
@@ -96,19 +164,166 @@ class MainServer:
         self.poll = select.poll()
         if self.sock:
             self.poll.register(self.sock.fileno(), select.POLLIN)
+        if self.hosted:
+            self.match_host = MatchHost(self.poll, self.tick_rate, self.send_rate, self.record_dir, self.profile)
+        for worker in self.workers:
+            self.poll.register(worker.fileno(), select.POLLIN)
         return
 
-    def get_next_viewer(self):
-        v0 = None
-        i = 0
-        while i < len(self.clients):
-            if self.clients[i].state == MS_STATE_VIEWER:
-                v0 = self.clients.pop(i)
-                self.remove_client(v0.sock)
-                break
-            i += 1
-        return v0
-        
+    def start_workers(self):
+        """Starts the match workers, before the listening socket exists so they don't hold it."""
+        for i in range(self.worker_count):
+            conns = [ worker.conn for worker in self.workers ]
+            self.workers.append(WorkerHandle(i, conns, self.tick_rate, self.send_rate, self.record_dir, self.profile))
+        return
+
+    def close_workers(self):
+        for worker in self.workers:
+            worker.close()
+        self.workers = []
+        return
+
+    def remove_worker(self, worker):
+        self.logger.error("Removing match worker %d", worker.index)
+        self.workers.remove(worker)
+        worker.running.clear()
+        try:
+            self.poll.unregister(worker.fileno())
+        except:
+            pass
+        worker.close()
+        return
+
+    def handle_worker(self, fd):
+        for worker in self.workers:
+            if worker.fileno() == fd:
+                if not worker.receive_report():
+                    self.remove_worker(worker)
+                self.apply_tournament_reports(worker.take_tournament_reports())
+                return True
+        return False
+
+    def hand_off_game(self, match_id, clients):
+        """Gives the clients to the least loaded worker.  Returns the worker, or None if no worker took them."""
+        while self.workers:
+            worker = min(self.workers, key=lambda w: w.load)
+            try:
+                worker.hand_off(match_id, clients)
+            except (IOError, OSError, ValueError) as e:
+                self.logger.error("Match worker %d failed on hand off: %s", worker.index, e)
+                self.remove_worker(worker)
+                continue
+            self.logger.info('handed game to worker %d, load %d.', worker.index, worker.load)
+            # the worker has its own copies of the sockets now
+            for client in clients:
+                if client:
+                    self.close_client(client.sock)
+            return worker
+        return None
+
+    def apply_tournament_reports(self, reports):
+        """Records the start and end of tournament games, as the games report them."""
+        for report in reports:
+            self.tournament.apply_report(report)
+        return
+
+    def close_control(self, match):
+        if match.control:
+            # the game's last messages, such as its tournament result
+            try:
+                while match.control.poll():
+                    self.handle_control_message(match, match.control.recv())
+            except (EOFError, IOError):
+                pass
+            try:
+                self.poll.unregister(match.control.fileno())
+            except KeyError:
+                pass
+            match.control.close()
+            match.control = None
+        return
+
+    def handle_control(self, fd):
+        """Reads a message from a game process's control pipe.  Returns False if fd isn't one."""
+        for match in self.matches:
+            if match.control and match.control.fileno() == fd:
+                try:
+                    msg = match.control.recv()
+                except (EOFError, IOError):
+                    # the game is over
+                    self.close_control(match)
+                    return True
+                self.handle_control_message(match, msg)
+                return True
+        return False
+
+    def handle_control_message(self, match, msg):
+        if msg[0] == HUB_STATS:
+            match.stats = msg[1]
+        elif msg[0] == HUB_TOURNAMENT:
+            self.tournament.apply_report(msg[1])
+        else:
+            self.logger.error("Unexpected control message: %s", msg)
+        return
+
+    def prune_matches(self):
+        """Forgets the matches that are over."""
+        running = []
+        for match in self.matches:
+            if match.is_running():
+                running.append(match)
+            else:
+                self.close_control(match)
+        self.matches = running
+        return
+
+    def get_match_stats(self):
+        """The tick profile of every running match, for a StatsMessage."""
+        self.prune_matches()
+        stats = []
+        for match in self.matches:
+            stats.append({ 'match_id': match.match_id,
+                           'names': match.names,
+                           'profile': match.get_stats() })
+        return stats
+
+    def find_match(self, name):
+        """The newest running match, or the newest with player name, or None."""
+        self.prune_matches()
+        for match in reversed(self.matches):
+            if not name or name in match.names:
+                return match
+        return None
+
+    def attach_viewer(self, client):
+        """Sends a waiting viewer to a running match.  Returns False if there is none to watch."""
+        match = self.find_match(client.view_player)
+        if match is None:
+            return False
+        self.remove_client(client.sock)
+        client.name = match.names[0]
+        client.opponent_name = match.names[1]
+        msg = GameStartingMessage(client.opponent_name)
+        self.send_client_socket_message(client, msg)
+        self.logger.info('viewer %s watching %s vs %s.', client.address, match.names[0], match.names[1])
+        try:
+            match.add_viewer(client)
+        except (IOError, OSError, ValueError) as e:
+            self.logger.error("Failed to send viewer to match %d: %s", match.match_id, e)
+            self.close_client(client.sock)
+            return True
+        if not self.match_host:
+            # the match has its own copy of the socket now
+            self.close_client(client.sock)
+        return True
+
+    def attach_waiting_viewers(self):
+        for client in self.clients[:]:
+            if client.state == MS_STATE_VIEWER:
+                self.attach_viewer(client)
+        return
+
+
     def spawn_game(self, dualers):
         dualers.sort()
         # pop higher index first
@@ -119,23 +334,32 @@ class MainServer:
         #
         c0.opponent_name = c1.name
         msg = GameStartingMessage(c0.opponent_name)
-        self.send_client_socket_message(c0.sock, msg)
+        self.send_client_socket_message(c0, msg)
         #
         c1.opponent_name = c0.name
         msg = GameStartingMessage(c1.opponent_name)
-        self.send_client_socket_message(c1.sock, msg)
+        self.send_client_socket_message(c1, msg)
         #
-        v0 = self.get_next_viewer()
-        if v0:
-            v0.name = c0.name
-            v0.opponent_name = c0.opponent_name
-            msg = GameStartingMessage(v0.opponent_name)
-            self.send_client_socket_message(v0.sock, msg)
-        
-        self.logger.info('spawning game for %s vs %s.', c0.address, c1.address)
-        p = Process(target=game_server.main, args=(c0, c1, v0,))
-        p.start()
-        self.processes.append(p)
+        # viewers join through the match's SpectatorHub, not a relay
+        match = RunningMatch(self.next_match_id, [ c0.name, c1.name ])
+        self.next_match_id += 1
+        if self.match_host:
+            self.logger.info('hosting game for %s vs %s.', c0.address, c1.address)
+            match.game = self.match_host.add_match(c0, c1, None)
+        elif self.workers:
+            match.worker = self.hand_off_game(match.match_id, [ c0, c1, None ])
+        if not (match.game or match.worker):
+            self.logger.info('spawning game for %s vs %s.', c0.address, c1.address)
+            (match.control, control) = Pipe()
+            p = Process(target=game_server.main, args=(c0, c1, None, self.tick_rate, self.send_rate, control, self.record_dir, self.profile))
+            p.start()
+            control.close()
+            self.poll.register(match.control.fileno(), select.POLLIN)
+            self.processes.append(p)
+            match.process = p
+        self.matches.append(match)
+        self.attach_waiting_viewers()
+        return
 
     def spawn_ai(self):
         self.logger.info('spawning ai.')
@@ -192,12 +416,11 @@ class MainServer:
         """If there are at least 2 tournament connections, spawn a game."""
         self.logger.debug('spawn_tournament_game')
         eligible = []
-        eligible_players = self.tournament.get_eligible_players()
 
         i = 0
         while i < len(self.clients):
             if (self.clients[i].state == MS_STATE_WAIT_TOURNAMENT_GAME and
-                self.clients[i].name in eligible_players):
+                self.tournament.is_eligible(self.clients[i].name)):
                 eligible.append(i)
             i += 1
 
@@ -220,7 +443,7 @@ class MainServer:
             self.spawn_game(dualers[:2])
         else:
             self.logger.warn("No tournament game spawned. dualers: %d eligible: %d  eligible_players: %d",
-                             len(dualers), len(eligible), len(eligible_players))
+                             len(dualers), len(eligible), len(self.tournament.get_eligible_players()))
         return
 
 
@@ -269,12 +492,11 @@ class MainServer:
                 self.logger.error("remove_client:Unknown exception: %s", sys.exc_info()[0])
         return
 
-    def send_client_socket_message(self, sock, msg):
+    def send_client_socket_message(self, client, msg):
         """Send a message to a remote client."""
         
         try:
-            gc = GameComm(sock)
-            if not gc.write_mesg(msg):
+            if not client.gc.write_mesg(msg):
                 self.logger.error("Error writing message: %s", msg)
         except:
             self.logger.error("Error in send_client_socket_message.")
@@ -294,8 +516,7 @@ class MainServer:
             
         try:
             msg = None
-            gc = GameComm(sock)
-            msg = gc.read_mesg()
+            msg = client.gc.read_mesg()
             self.logger.debug("sock.recv(): %s", msg)
         except socket.error as e:
             self.logger.error("sock[%d] closed on recv: %s", client_index, e)
@@ -305,60 +526,77 @@ class MainServer:
             self.logger.error("receive_client_socket_message:Unknown exception %s", sys.exc_info()[0])
             raise
 
+        if msg:
+            self.process_client_message(client_index, msg)
+        # one recv() may have brought more than one message; stop if the
+        # client was handed to a game, the game's relay reads the rest
+        while client in self.clients and client.gc.has_buffered_mesg():
+            msg = client.gc.read_mesg()
+            self.logger.debug("sock.recv(): %s", msg)
+            self.process_client_message(self.clients.index(client), msg)
+
+        self.logger.debug('receive_client_socket_message: done')
+        return
+
+    def process_client_message(self, client_index, msg):
+        """Handle one message from a remote client."""
+
+        client = self.clients[client_index]
+        sock = client.sock
         if msg:
             code = msg.get_command()
             if code == M_CLOSED:
                 self.remove_client(sock)
             elif code == M_LOGIN:
                 if msg.get_request():
-                    rmsg = GameMessageLogin()
-                    rmsg.set_request(False)
-                    rmsg.set_result(True)
-                    rmsg.set_user(msg.get_user())
-                    self.clients[client_index].name = msg.get_user()
-                    self.send_client_socket_message(sock, rmsg)
+                    rmsg = make_login_response(client, msg)
+                    self.send_client_socket_message(client, rmsg)
+                    apply_login_response(client, rmsg)
                     self.clients[client_index].state = MS_STATE_LOGGED_IN
                     self.logger.info("Logged in %s", msg.get_user())
                 else:
                     self.logger.error("Unexpected non-request login message: %s", msg)
             elif code == M_REQUEST_DUAL:
                 rmsg = WaitForDualMessage()
-                self.send_client_socket_message(sock, rmsg)
+                self.send_client_socket_message(client, rmsg)
                 self.clients[client_index].state = MS_STATE_WAIT_DUAL_GAME
                 self.logger.info("Dual Requested")
                 self.spawn_dual_game()
             elif code == M_REQUEST_SINGLE:
                 rmsg = WaitForSingleMessage()
-                self.send_client_socket_message(sock, rmsg)
+                self.send_client_socket_message(client, rmsg)
                 self.clients[client_index].state = MS_STATE_WAIT_SINGLE_GAME
                 self.logger.info("Single Requested")
                 self.spawn_single_game()
             elif code == M_REQUEST_TOURNAMENT:
                 self.tournament.add_player(self.clients[client_index].name)
-                eligible_players = self.tournament.get_eligible_players()
-                if self.clients[client_index].name in eligible_players:
+                if self.tournament.is_eligible(self.clients[client_index].name):
                     rmsg = WaitForTournamentMessage()
-                    self.send_client_socket_message(sock, rmsg)
+                    self.send_client_socket_message(client, rmsg)
                     self.clients[client_index].state = MS_STATE_WAIT_TOURNAMENT_GAME
                     self.logger.info("Tournament Requested")
                     self.spawn_tournament_game()
                 else:
                     rmsg = WaitForDualMessage()
-                    self.send_client_socket_message(sock, rmsg)
+                    self.send_client_socket_message(client, rmsg)
                     self.clients[client_index].state = MS_STATE_WAIT_DUAL_GAME
                     self.logger.info("Tournament Requested -> Dual Offered for %s", self.clients[client_index].name)
                     self.spawn_dual_game()
             elif code == M_REQUEST_AI:
                 rmsg = WaitForAiMessage()
-                self.send_client_socket_message(sock, rmsg)
+                self.send_client_socket_message(client, rmsg)
                 self.clients[client_index].state = MS_STATE_AI_PLAYER
                 self.logger.info("AI Requested")
                 self.spawn_single_game()
             elif code == M_REQUEST_VIEW:
                 rmsg = WaitForViewMessage()
-                self.send_client_socket_message(sock, rmsg)
+                self.send_client_socket_message(client, rmsg)
                 self.clients[client_index].state = MS_STATE_VIEWER
+                client.view_player = msg.get_player_name()
                 self.logger.info("View Requested")
+                self.attach_viewer(client)
+            elif code == M_REQUEST_STATS:
+                self.send_client_socket_message(client, StatsMessage(self.get_match_stats()))
             elif code in ALL_MESSAGE_CODES:
                 self.logger.error("Unexpected message in main server, thowing it away. (%s)" , msg)
             elif code == M_EAGAIN:
@@ -366,7 +604,6 @@ class MainServer:
             else:
                 self.logger.error("Unexpected cmd: %s", code)
 
-        self.logger.debug('receive_client_socket_message: done')
         return
 
     def handle_client(self, fd):
@@ -382,23 +619,39 @@ class MainServer:
         self.logger.debug('run')
 
         try:
+            self.start_workers()
             self.prepare_socket()
             self.prepare_poll()
             while not self.done:
-                ready_list = self.poll.poll()
+                timeout = None
+                if self.match_host:
+                    timeout = self.match_host.get_timeout()
+                ready_list = self.poll.poll(timeout)
                 for(fd, event) in ready_list:
                     if self.sock and self.sock.fileno() == fd:
                         self.accept_new_client()
                     elif self.handle_client(fd):
                         pass
+                    elif self.match_host and self.match_host.handle_fd(fd, event):
+                        pass
+                    elif self.handle_worker(fd):
+                        pass
+                    elif self.handle_control(fd):
+                        pass
                     else:
                         self.logger.error("Unexpected fd: %d, unregistering from poll", fd)
                         self.poll.unregister(fd)
+                if self.match_host:
+                    self.match_host.tick()
+                    self.apply_tournament_reports(self.match_host.take_tournament_reports())
                 self.join_processes()
         except:
             self.close_socket()
+            self.close_workers()
+            self.tournament.close()
             raise
                     
+        self.tournament.close()
         self.logger.debug('run finished')
         return
 
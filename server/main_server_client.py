@@ -1,3 +1,7 @@
+import socket, os
+from common.game_comm import GameComm
+from common.game_message import *
+
 MS_STATE_CONNECTED = 1
 MS_STATE_LOGGED_IN = 2
 MS_STATE_WAIT_DUAL_GAME = 3
@@ -9,8 +13,63 @@ MS_STATE_VIEWER = 7
 class MainServerClient:
     def __init__(self, connection, address):
         self.sock = connection
+        # one GameComm for the life of the connection, it is handed to the game with the socket
+        self.gc = GameComm(connection)
+        self.partial_updates = False # set at login, if the client can apply partial updates
         self.address = address
         self.state = MS_STATE_CONNECTED
         self.name  = ""
         self.opponent_name = ""
+        self.view_player = "" # for viewers, whose match to watch, "" for any
         return
+
+    def get_handoff(self):
+        """What another process needs, besides the socket, to take over this client."""
+        return { 'address': self.address,
+                 'state': self.state,
+                 'name': self.name,
+                 'opponent_name': self.opponent_name,
+                 'partial_updates': self.partial_updates,
+                 'binary': self.gc.binary,
+                 'tick_batches': self.gc.tick_batches,
+                 'snapshots': self.gc.snapshots,
+                 'unread': self.gc.get_unread_bytes() }
+
+def client_from_handoff(fd, handoff):
+    """Rebuilds a MainServerClient from a received socket descriptor and get_handoff()."""
+    sock = socket.fromfd(fd, socket.AF_INET, socket.SOCK_STREAM)
+    os.close(fd) # fromfd() made its own copy
+    client = MainServerClient(sock, handoff['address'])
+    client.state = handoff['state']
+    client.name = handoff['name']
+    client.opponent_name = handoff['opponent_name']
+    client.partial_updates = handoff['partial_updates']
+    client.gc.set_binary(handoff['binary'])
+    client.gc.set_tick_batches(handoff['tick_batches'])
+    client.gc.set_snapshots(handoff['snapshots'])
+    client.gc.set_unread_bytes(handoff['unread'])
+    return client
+
+def make_login_response(client, msg):
+    """The response to a login request, granting what the client asked for."""
+    rmsg = GameMessageLogin()
+    rmsg.set_request(False)
+    rmsg.set_result(True)
+    rmsg.set_user(msg.get_user())
+    if msg.get_encoding() == ENCODING_BINARY:
+        rmsg.set_encoding(ENCODING_BINARY)
+    else:
+        rmsg.set_encoding(ENCODING_JSON)
+    client.name = msg.get_user()
+    client.partial_updates = msg.get_partial_updates()
+    rmsg.set_partial_updates(client.partial_updates)
+    rmsg.set_tick_batches(msg.get_tick_batches())
+    rmsg.set_snapshots(msg.get_snapshots())
+    return rmsg
+
+def apply_login_response(client, rmsg):
+    """After the response is sent, updates use what was granted, in the game too."""
+    client.gc.set_binary(rmsg.get_encoding() == ENCODING_BINARY)
+    client.gc.set_tick_batches(rmsg.get_tick_batches())
+    client.gc.set_snapshots(rmsg.get_snapshots())
+    return
@@ -0,0 +1,252 @@
+import time, math, socket, select, logging
+from common.game_comm import *
+from game_server import GameServer
+from config import *
+from send_queue import ClientSendQueue
+
+class ClientEndpoint:
+    """
+    Stands in for the game's end of a relay pipe, but reads and writes
+    the client's socket directly.  MatchHost calls read() when the
+    socket is readable, and GameServer uses poll(), recv(), send()
+    and close() like a multiprocessing Connection.  The socket is
+    non-blocking, and messages wait in a ClientSendQueue until it
+    takes them, so one slow client never holds up the other matches.
+    """
+
+    def __init__(self, host, client):
+        self.logger = logging.getLogger('ClientEndpoint')
+        self.host = host
+        self.client = client
+        self.sock = client.sock
+        self.sock.setblocking(0)
+        self.gc = client.gc
+        self.queue = ClientSendQueue(self.gc)
+        self.poll_out = False # if POLLOUT is requested for the socket
+        self.inbox = []
+        return
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def read(self):
+        """Reads what the socket has for the game.  A closed socket shows up as M_CLOSED."""
+        if not self.sock:
+            return
+        try:
+            msgs = self.gc.read_mesgs()
+        except socket.error as e:
+            self.logger.error("%s closed on recv: %s", self.client.name, e)
+            msgs = [ GameMessageClosed() ]
+        for msg in msgs:
+            code = msg.get_command()
+            if code == M_CLOSED:
+                self.inbox.append(msg)
+                self.close_sock()
+                break
+            elif code in ALL_MESSAGE_CODES:
+                self.inbox.append(msg)
+            else:
+                self.logger.error("Unexpected cmd: %s", code)
+        return
+
+    def poll(self):
+        return len(self.inbox) > 0
+
+    def recv(self):
+        return self.inbox.pop(0)
+
+    def send(self, msg):
+        if msg.get_command() == M_CLOSED:
+            # end of the game, like a relay closing its pipe.  there
+            # is no waiting for a slow client here, it would stall
+            # every match
+            if self.sock and not self.queue.is_empty():
+                self.flush()
+            self.close_sock()
+            return
+        if not self.sock:
+            return
+        self.queue.add(msg)
+        self.flush()
+        return
+
+    def flush(self):
+        """Sends queued messages, as far as the socket takes them."""
+        if not self.sock:
+            return
+        try:
+            done = self.queue.flush()
+        except socket.error as e:
+            # the game finds out on its next receive, as from a relay
+            self.logger.error("%s closed on send: %s", self.client.name, e)
+            self.inbox.append(GameMessageClosed())
+            self.close_sock()
+            return
+        if done == self.poll_out:
+            self.poll_out = not done
+            self.host.set_poll_out(self, self.poll_out)
+        return
+
+    def close(self):
+        self.close_sock()
+        return
+
+    def close_sock(self):
+        if self.sock:
+            self.host.unregister(self)
+            self.logger.info("%s send queue: %s", self.client.name, self.queue.get_stats())
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except:
+                pass
+            self.sock.close()
+            self.sock = None
+        return
+
+class MatchHost:
+    """
+    Runs many matches in this process, with no relay processes or pipes.
+    Each match is a GameServer whose pipes are ClientEndpoints.  The
+    client sockets are watched by a poll object, shared with the
+    caller's loop if one is given, and every match is stepped on a
+    common tick, each advancing by its own fixed steps.  The caller's
+    loop must call handle_fd() for ready descriptors and tick() at
+    least every get_timeout() ms.
+    """
+
+    def __init__(self, poll=None, tick_rate=TICK_RATE, send_rate=SEND_RATE, record_dir=None, profile=False):
+        self.logger = logging.getLogger('MatchHost')
+        if poll is None:
+            poll = select.poll()
+        self.poll = poll
+        self.tick_rate = tick_rate
+        self.send_rate = send_rate
+        self.record_dir = record_dir
+        self.profile = profile
+        self.games = []
+        self.endpoints = {} # fd -> ClientEndpoint
+        self.last_tick = None
+        self.tournament_reports = [] # from the matches, for the lobby's tournament
+        return
+
+    def get_match_count(self):
+        return len(self.games)
+
+    def add_match(self, client1, client2, viewer):
+        endpoints = []
+        for client in (client1, client2, viewer):
+            if client:
+                endpoint = ClientEndpoint(self, client)
+                fd = endpoint.fileno()
+                self.endpoints[fd] = endpoint
+                self.poll.register(fd, select.POLLIN)
+                if client.gc.has_buffered_mesg():
+                    # sent before the lobby handed over the socket
+                    endpoint.read()
+                endpoints.append(endpoint)
+            else:
+                endpoints.append(None)
+        game = GameServer(endpoints[0], endpoints[1], client1, client2, endpoints[2], viewer,
+                          self.tick_rate, self.send_rate, None, self.record_dir, None, self.profile)
+        game.start_tournament_game()
+        self.take_game_reports(game)
+        self.add_game(game)
+        return game
+
+    def take_game_reports(self, game):
+        if game.tournament_reports:
+            self.tournament_reports.extend(game.tournament_reports)
+            game.tournament_reports = []
+        return
+
+    def take_tournament_reports(self):
+        """The matches' tournament reports since the last call, see tournament_cache.py"""
+        reports = self.tournament_reports
+        self.tournament_reports = []
+        return reports
+
+    def add_game(self, game):
+        """Steps game with the others, from the next tick()."""
+        if self.last_tick is None:
+            self.last_tick = time.time()
+        else:
+            # the next tick() covers time from before the match existed
+            game.accumulator = self.last_tick - time.time()
+        self.games.append(game)
+        self.logger.info("match %s vs %s added, %d matches", game.get_names()[0], game.get_names()[1], len(self.games))
+        return
+
+    def unregister(self, endpoint):
+        fd = endpoint.fileno()
+        if fd in self.endpoints:
+            del self.endpoints[fd]
+            self.poll.unregister(fd)
+        return
+
+    def set_poll_out(self, endpoint, value):
+        mask = select.POLLIN
+        if value:
+            mask |= select.POLLOUT
+        self.poll.modify(endpoint.fileno(), mask)
+        return
+
+    def handle_fd(self, fd, event=select.POLLIN):
+        """Returns True if fd is one of the hosted client sockets."""
+        endpoint = self.endpoints.get(fd)
+        if endpoint is None:
+            return False
+        if event & select.POLLOUT:
+            endpoint.flush()
+        if event & ~select.POLLOUT:
+            endpoint.read()
+        return True
+
+    def get_timeout(self):
+        """Milliseconds until a match is due to step, or None with no matches."""
+        if not self.games:
+            return None
+        due = min([ game.tick_dt - game.accumulator for game in self.games ])
+        wait = self.last_tick + due - time.time()
+        return max(0, int(math.ceil(wait * 1000.)))
+
+    def tick(self):
+        """Gives every match the time since the last call, stepping those that are due."""
+        if not self.games:
+            self.last_tick = None
+            return
+        now = time.time()
+        dt = now - self.last_tick
+        self.last_tick = now
+        games = []
+        for game in self.games:
+            try:
+                game.advance(dt)
+            except Exception:
+                # don't let one broken match stop the others
+                self.logger.exception("match failed, closing it")
+                game.done = True
+            self.take_game_reports(game)
+            if game.done:
+                if game.profiler and game.profiler.window.ticks.count:
+                    game.report_profile()
+                game.close_pipes()
+                game.close_recording()
+                game.hub.close()
+                self.logger.info("match done. game time: %f  stats: %s", game.time, game.get_tick_stats())
+            else:
+                games.append(game)
+        self.games = games
+        # between steps, so writing never holds up a tick
+        for game in self.games:
+            game.flush_recording()
+        return
+
+    def run(self):
+        """Hosts matches until there are none left, for use without a lobby."""
+        while self.games:
+            for (fd, event) in self.poll.poll(self.get_timeout()):
+                if not self.handle_fd(fd, event):
+                    self.logger.error("Unexpected fd: %d", fd)
+            self.tick()
+        return
@@ -0,0 +1,136 @@
+import struct, json, time, os, re, logging
+from common.game_comm import ALL_MESSAGES
+from config import *
+
+#
+# A match recording holds everything needed to play the match again:
+# the seed of the match's random numbers, the settings, and every
+# inbound command, with the tick it was applied before.  The file is
+#
+#   RECORD_MAGIC, one line of JSON header, then records
+#
+# where each record is RECORD (tick, kind, oid, payload size) and the
+# payload.  R_COMMAND payloads are the command message as JSON.
+# R_END is the last record, with the number of ticks played and a
+# digest of the final state as its payload.  A file without R_END
+# is from a match that didn't finish, and replays until game over.
+#
+RECORD_MAGIC = "RKREC 1\n"
+RECORD = struct.Struct('<IBiH')
+R_COMMAND = 1
+R_DISCONNECT = 2
+R_END = 3
+
+def safe_name(name):
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', name)
+
+class MatchRecorder:
+    """
+    Appends one match's records to a file.  Records are kept in memory
+    and written by flush(), which the game calls between steps, so a
+    slow disk never holds up a tick.  A write error stops the recording,
+    not the match.
+    """
+
+    def __init__(self, path, header):
+        self.logger = logging.getLogger('MatchRecorder')
+        self.path = path
+        self.file = open(path, 'wb')
+        self.buffer = [ RECORD_MAGIC, json.dumps(header) + "\n" ]
+        self.size = sum([ len(s) for s in self.buffer ])
+        self.last_flush = time.time()
+        self.records = 0
+        return
+
+    def add(self, tick, kind, oid, payload=""):
+        self.buffer.append(RECORD.pack(tick, kind, oid, len(payload)) + payload)
+        self.size += RECORD.size + len(payload)
+        self.records += 1
+        return
+
+    def add_command(self, tick, oid, msg):
+        self.add(tick, R_COMMAND, oid, msg.to_string())
+        return
+
+    def add_disconnect(self, tick, oid):
+        self.add(tick, R_DISCONNECT, oid)
+        return
+
+    def flush(self, force=False):
+        """Writes the records kept so far, if there are enough of them, or they are old enough, or force."""
+        if not self.file or not self.buffer:
+            return
+        if (not force and self.size < RECORD_FLUSH_BYTES and
+            time.time() - self.last_flush < RECORD_FLUSH_INTERVAL):
+            return
+        try:
+            self.file.write("".join(self.buffer))
+            self.file.flush()
+        except IOError as e:
+            self.logger.error("recording %s stopped: %s", self.path, e)
+            self.file.close()
+            self.file = None
+        self.buffer = []
+        self.size = 0
+        self.last_flush = time.time()
+        return
+
+    def close(self, ticks, digest):
+        if not self.file:
+            return
+        self.add(ticks, R_END, 0, digest)
+        self.flush(True)
+        if self.file:
+            self.file.close()
+            self.file = None
+            self.logger.info("recorded %s, %d records", self.path, self.records)
+        return
+
+def open_recorder(record_dir, names, header):
+    """A MatchRecorder for a new file in record_dir, or None if it can't be made."""
+    name = "%s-%s-vs-%s-%d.rec" % (time.strftime('%Y%m%d-%H%M%S'),
+                                   safe_name(names[0]), safe_name(names[1]), header['seed'])
+    path = os.path.join(record_dir, name)
+    try:
+        return MatchRecorder(path, header)
+    except IOError as e:
+        logging.getLogger('MatchRecorder').error("can't record %s: %s", path, e)
+    return None
+
+class MatchRecording:
+    """A recording read back, with the records of each tick."""
+
+    def __init__(self, path):
+        self.path = path
+        f = open(path, 'rb')
+        data = f.read()
+        f.close()
+        if not data.startswith(RECORD_MAGIC):
+            raise ValueError("%s is not a match recording" % (path,))
+        pos = data.index("\n", len(RECORD_MAGIC)) + 1
+        self.header = json.loads(data[len(RECORD_MAGIC):pos])
+        self.ticks = {} # tick -> [ (kind, oid, msg) ]
+        self.end_tick = None
+        self.digest = None
+        self.count = 0
+        while pos + RECORD.size <= len(data):
+            (tick, kind, oid, size) = RECORD.unpack_from(data, pos)
+            pos += RECORD.size
+            payload = data[pos:pos + size]
+            if len(payload) != size:
+                break # cut short
+            pos += size
+            if kind == R_END:
+                self.end_tick = tick
+                self.digest = payload
+                break
+            msg = None
+            if kind == R_COMMAND:
+                code = json.loads(payload)['command']
+                msg = ALL_MESSAGES[code](payload)
+            self.ticks.setdefault(tick, []).append((kind, oid, msg))
+            self.count += 1
+        return
+
+    def get_records(self, tick):
+        return self.ticks.get(tick, [])
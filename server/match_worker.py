@@ -0,0 +1,246 @@
+from multiprocessing import Process, Pipe
+from multiprocessing.reduction import send_handle, recv_handle
+import select, logging, time
+from main_server_client import client_from_handoff
+from match_host import MatchHost
+from config import *
+
+#
+# Lobby <-> worker protocol, on a duplex Pipe (a unix socketpair):
+#
+# lobby -> worker:  (W_MATCH, match id, [handoff1, handoff2, handoff3 or None])
+#                   followed by one descriptor per client, sent with
+#                   send_handle() (SCM_RIGHTS), in the same order.
+#                   (W_VIEW, match id, handoff) followed by the viewer's
+#                   descriptor, to add a viewer to a running match.
+# worker -> lobby:  (W_LOAD, match count, client count, matches received)
+#                   after every change in the number of matches.  The
+#                   lobby adds the matches sent but not yet received.
+#                   (W_DONE, match id) when a match is over.
+#                   (W_STATS, { match id: stats }) every
+#                   PROFILE_LOG_INTERVAL seconds, with the tick profile
+#                   of each match, if matches are profiled.
+#                   (W_TOURNAMENT, [ report, ... ]) after a tick that
+#                   started or ended tournament games, for the lobby's
+#                   TournamentCache.
+#
+W_MATCH = "match"
+W_VIEW = "view"
+W_LOAD = "load"
+W_DONE = "done"
+W_STATS = "stats"
+W_TOURNAMENT = "tournament"
+
+class MatchWorker:
+    """
+    Long lived process that hosts the matches the lobby hands it,
+    in one MatchHost.  It exits when the lobby closes the pipe and
+    its last match is over.
+    """
+
+    def __init__(self, index, conn, tick_rate=TICK_RATE, send_rate=SEND_RATE, record_dir=None, profile=False):
+        self.logger = logging.getLogger('MatchWorker_%d' % (index,))
+        self.index = index
+        self.conn = conn
+        self.poll = select.poll()
+        self.poll.register(self.conn.fileno(), select.POLLIN)
+        self.host = MatchHost(self.poll, tick_rate, send_rate, record_dir, profile)
+        self.profile = profile
+        self.last_stats = time.time()
+        self.games = {} # match id -> GameServer
+        self.lobby_open = True
+        self.received = 0
+        self.reported = (0, 0)
+        return
+
+    def receive_match(self):
+        try:
+            msg = self.conn.recv()
+        except EOFError:
+            self.logger.info("lobby closed the pipe")
+            self.poll.unregister(self.conn.fileno())
+            self.lobby_open = False
+            return
+        if msg[0] == W_VIEW:
+            self.receive_viewer(msg[1], msg[2])
+            return
+        if msg[0] != W_MATCH:
+            self.logger.error("Unexpected lobby message: %s", msg)
+            return
+        clients = []
+        for handoff in msg[2]:
+            if handoff is None:
+                clients.append(None)
+            else:
+                clients.append(client_from_handoff(recv_handle(self.conn), handoff))
+        self.games[msg[1]] = self.host.add_match(clients[0], clients[1], clients[2])
+        self.received += 1
+        return
+
+    def receive_viewer(self, match_id, handoff):
+        client = client_from_handoff(recv_handle(self.conn), handoff)
+        game = self.games.get(match_id)
+        if game is None:
+            # the match ended before the viewer arrived
+            self.logger.info("match %d is over, closing viewer %s", match_id, client.address)
+            client.sock.close()
+            return
+        game.hub.add_viewer(client)
+        return
+
+    def report_done(self):
+        for match_id in self.games.keys():
+            if not self.games[match_id].done:
+                continue
+            del self.games[match_id]
+            if not self.lobby_open:
+                continue
+            try:
+                self.conn.send((W_DONE, match_id))
+            except (IOError, ValueError) as e:
+                self.logger.error("lobby pipe closed on send: %s", e)
+                self.lobby_open = False
+        return
+
+    def report_load(self):
+        load = (self.host.get_match_count(), self.received)
+        if load == self.reported or not self.lobby_open:
+            return
+        try:
+            self.conn.send((W_LOAD, load[0], len(self.host.endpoints), load[1]))
+            self.reported = load
+        except (IOError, ValueError) as e:
+            self.logger.error("lobby pipe closed on send: %s", e)
+            self.lobby_open = False
+        return
+
+    def report_stats(self):
+        if not self.profile or not self.lobby_open:
+            return
+        if time.time() - self.last_stats < PROFILE_LOG_INTERVAL:
+            return
+        self.last_stats = time.time()
+        stats = {}
+        for match_id in self.games:
+            stats[match_id] = self.games[match_id].get_profile_stats()
+        try:
+            self.conn.send((W_STATS, stats))
+        except (IOError, ValueError) as e:
+            self.logger.error("lobby pipe closed on send: %s", e)
+            self.lobby_open = False
+        return
+
+    def report_tournament(self):
+        reports = self.host.take_tournament_reports()
+        if not reports or not self.lobby_open:
+            return
+        try:
+            self.conn.send((W_TOURNAMENT, reports))
+        except (IOError, ValueError) as e:
+            self.logger.error("lobby pipe closed on send, %d tournament reports lost: %s", len(reports), e)
+            self.lobby_open = False
+        return
+
+    def run(self):
+        self.logger.info('run')
+        while self.lobby_open or self.host.get_match_count() > 0:
+            for (fd, event) in self.poll.poll(self.host.get_timeout()):
+                if self.lobby_open and fd == self.conn.fileno():
+                    self.receive_match()
+                elif not self.host.handle_fd(fd, event):
+                    self.logger.error("Unexpected fd: %d", fd)
+            self.host.tick()
+            self.report_tournament()
+            self.report_done()
+            self.report_load()
+            self.report_stats()
+        self.logger.info('run done')
+        return
+
+def start_worker(index, conn, lobby_conns, tick_rate, send_rate, record_dir, profile):
+    """Global function to launch a worker process"""
+    # the lobby's ends of this and earlier workers' pipes, so
+    # only the lobby holds them, and closing them reaches the worker
+    for c in lobby_conns:
+        c.close()
+    w = MatchWorker(index, conn, tick_rate, send_rate, record_dir, profile)
+    w.run()
+    return
+
+class WorkerHandle:
+    """The lobby's side of one MatchWorker."""
+
+    def __init__(self, index, other_conns=[], tick_rate=TICK_RATE, send_rate=SEND_RATE, record_dir=None, profile=False):
+        self.logger = logging.getLogger('WorkerHandle_%d' % (index,))
+        self.index = index
+        (self.conn, worker_conn) = Pipe()
+        lobby_conns = other_conns + [ self.conn ]
+        self.process = Process(target=start_worker, args=(index, worker_conn, lobby_conns, tick_rate, send_rate, record_dir, profile))
+        self.process.start()
+        worker_conn.close()
+        self.load = 0    # matches, as last reported, plus those sent since
+        self.clients = 0
+        self.sent = 0
+        self.running = set() # ids of matches sent and not yet done
+        self.stats = {}      # match id -> tick profile, as last reported
+        self.tournament_reports = []
+        return
+
+    def fileno(self):
+        return self.conn.fileno()
+
+    def hand_off(self, match_id, clients):
+        """Sends the clients of one match, [c0, c1, viewer or None], to the worker."""
+        handoffs = []
+        for client in clients:
+            if client:
+                handoffs.append(client.get_handoff())
+            else:
+                handoffs.append(None)
+        self.conn.send((W_MATCH, match_id, handoffs))
+        for client in clients:
+            if client:
+                send_handle(self.conn, client.sock.fileno(), self.process.pid)
+        self.sent += 1
+        self.load += 1
+        self.running.add(match_id)
+        return
+
+    def add_viewer(self, match_id, client):
+        """Sends a viewer for one of the worker's matches."""
+        self.conn.send((W_VIEW, match_id, client.get_handoff()))
+        send_handle(self.conn, client.sock.fileno(), self.process.pid)
+        return
+
+    def receive_report(self):
+        """Returns False if the worker has gone away."""
+        try:
+            msg = self.conn.recv()
+        except EOFError:
+            self.logger.error("worker closed its pipe")
+            return False
+        if msg[0] == W_LOAD:
+            (code, matches, self.clients, received) = msg
+            self.load = matches + self.sent - received
+        elif msg[0] == W_DONE:
+            self.running.discard(msg[1])
+            self.stats.pop(msg[1], None)
+        elif msg[0] == W_STATS:
+            for match_id in msg[1]:
+                if match_id in self.running:
+                    self.stats[match_id] = msg[1][match_id]
+        elif msg[0] == W_TOURNAMENT:
+            self.tournament_reports.extend(msg[1])
+        else:
+            self.logger.error("Unexpected worker message: %s", msg)
+        return True
+
+    def take_tournament_reports(self):
+        reports = self.tournament_reports
+        self.tournament_reports = []
+        return reports
+
+    def close(self):
+        self.conn.close()
+        self.process.join()
+        return
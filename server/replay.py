@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+import logging, sys, getopt, socket, select, time
+sys.path.append('..')
+from common.game_comm import *
+from common.game_message import *
+from main_server_client import *
+from match_record import MatchRecording, R_COMMAND, R_DISCONNECT
+from match_host import MatchHost
+from game_server import GameServer
+import engine_server.config as engine_config
+
+class ReplayGame(GameServer):
+    """
+    A recorded match played again.  The recorded commands take the
+    place of the players' pipes, applied before the same ticks, from
+    the same seed, so the engine goes through exactly the recorded
+    states.  Viewers watch it through the hub, as a live match.
+    """
+
+    def __init__(self, recording, control=None):
+        self.recording = recording
+        header = recording.header
+        clients = []
+        for name in header['names']:
+            client = MainServerClient(None, ('replay', 0))
+            client.name = name
+            clients.append(client)
+        tick_rate = header['tick_rate']
+        send_rate = tick_rate / header['send_interval']
+        GameServer.__init__(self, None, None, clients[0], clients[1], None, None,
+                            tick_rate, send_rate, control, None, header['seed'])
+        self.keyframe_interval = header['keyframe_interval']
+        for key in header['engine']:
+            value = getattr(engine_config, key, None)
+            if value != header['engine'][key]:
+                self.logger.warning("engine config %s is %s, recorded with %s, the replay may differ",
+                                    key, value, header['engine'][key])
+        return
+
+    def start_tournament_game(self):
+        return
+
+    def end_tournament_game(self, winner):
+        return
+
+    def receive_messages(self):
+        """Applies the commands recorded for this tick."""
+        for (kind, oid, msg) in self.recording.get_records(self.ticks):
+            if kind == R_COMMAND:
+                self.engine.process_command(oid, msg)
+            elif kind == R_DISCONNECT:
+                self.engine.set_player_disconnected(oid)
+        return
+
+    def evolve(self, dt):
+        self.time += dt
+        self.engine.evolve(dt)
+        end_tick = self.recording.end_tick
+        if self.engine.game_over() or (end_tick is not None and self.ticks + 1 >= end_tick):
+            self.done = True
+        return
+
+def replay(recording):
+    """Plays a recording at full speed, returns the finished ReplayGame."""
+    game = ReplayGame(recording)
+    while not game.done:
+        game.step()
+    return game
+
+class ReplayServer:
+    """
+    Serves a recording to viewers as if it were a live match.  Viewers
+    log in and ask to view, as in the lobby.  The first viewer starts
+    the replay, in real time, and later viewers join it where it is.
+    Once it is over, the next viewer starts it again.
+    """
+
+    def __init__(self, path, ip="0.0.0.0", port=20149):
+        self.logger = logging.getLogger('ReplayServer')
+        self.path = path
+        self.ip = ip
+        self.port = port
+        self.sock = None
+        self.poll = select.poll()
+        self.host = None
+        self.clients = {} # fd -> MainServerClient, not yet watching
+        self.game = None
+        return
+
+    def accept_new_client(self):
+        (connection, address) = self.sock.accept()
+        self.logger.info("Accepted connection from %s", address)
+        self.clients[connection.fileno()] = MainServerClient(connection, address)
+        self.poll.register(connection.fileno(), select.POLLIN)
+        return
+
+    def remove_client(self, client):
+        fd = client.sock.fileno()
+        del self.clients[fd]
+        self.poll.unregister(fd)
+        return
+
+    def attach_viewer(self, client):
+        if self.game is None or self.game.done:
+            self.game = ReplayGame(MatchRecording(self.path))
+            self.host.add_game(self.game)
+        names = self.game.get_names()
+        self.remove_client(client)
+        client.name = names[0]
+        client.opponent_name = names[1]
+        client.gc.write_mesg(GameStartingMessage(client.opponent_name))
+        self.game.hub.add_viewer(client)
+        return
+
+    def handle_client(self, client):
+        try:
+            msgs = client.gc.read_mesgs()
+        except socket.error as e:
+            self.logger.info("%s closed on recv: %s", client.address, e)
+            msgs = [ GameMessageClosed() ]
+        for msg in msgs:
+            code = msg.get_command()
+            if code == M_CLOSED:
+                self.remove_client(client)
+                client.sock.close()
+                return
+            elif code == M_LOGIN and msg.get_request():
+                rmsg = make_login_response(client, msg)
+                client.gc.write_mesg(rmsg)
+                apply_login_response(client, rmsg)
+                client.state = MS_STATE_LOGGED_IN
+            elif code == M_REQUEST_VIEW:
+                client.gc.write_mesg(WaitForViewMessage())
+                client.state = MS_STATE_VIEWER
+                self.attach_viewer(client)
+                return
+            else:
+                self.logger.error("Only viewers here, throwing away: %s", msg)
+        return
+
+    def run(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind( (self.ip, self.port) )
+        self.sock.listen(8)
+        self.poll.register(self.sock.fileno(), select.POLLIN)
+        self.host = MatchHost(self.poll)
+        self.logger.info("serving %s on port %d", self.path, self.port)
+        while True:
+            for (fd, event) in self.poll.poll(self.host.get_timeout()):
+                if fd == self.sock.fileno():
+                    self.accept_new_client()
+                elif fd in self.clients:
+                    self.handle_client(self.clients[fd])
+                else:
+                    self.logger.error("Unexpected fd: %d", fd)
+            self.host.tick()
+        return
+
+def usage():
+    print "usage: %s [-s|--serve] [-p|--port port] [-L|--logging level] [-h|--help] recording" % (sys.argv[0])
+    print "plays recording at full speed, and checks it ends in the recorded state"
+    print "-s|--serve       : serve the recording to viewers in real time instead"
+    print "-p|--port port   : port to serve on (default 20149)"
+    print "-L|--logging info|debug|warning|error: logging level"
+    print "-h|--help        : show this message and exit"
+    return
+
+def main():
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hsp:L:", ["help", "serve", "port=", "logging="])
+    except getopt.GetoptError as e:
+        print str(e)
+        usage()
+        sys.exit(1)
+
+    show_help = False
+    serve = False
+    port = 20149
+    logging_level = "info"
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            show_help = True
+        elif o in ("-s", "--serve"):
+            serve = True
+        elif o in ("-p", "--port"):
+            try:
+                port = int(a)
+            except ValueError:
+                show_help = True
+        elif o in ("-L", "--logging"):
+            logging_level = a
+        else:
+            print "Unexpected option: %s" % (o)
+            usage()
+            sys.exit(1)
+    if len(args) != 1:
+        show_help = True
+    if show_help:
+        usage()
+        sys.exit(1)
+
+    FORMAT = '%(asctime)-15s %(levelname)s:%(name)s:%(filename)s:%(lineno)d:%(message)s'
+    levels = { "info": logging.INFO, "debug": logging.DEBUG,
+               "warning": logging.WARNING, "error": logging.ERROR }
+    logging.basicConfig(level=levels.get(logging_level, logging.ERROR), format=FORMAT)
+
+    if serve:
+        ReplayServer(args[0], port=port).run()
+        return
+
+    recording = MatchRecording(args[0])
+    t0 = time.time()
+    game = replay(recording)
+    t1 = time.time()
+    print "%s vs %s: %d ticks, %d commands, replayed in %.3f s" % (
+        recording.header['names'][0], recording.header['names'][1],
+        game.ticks, recording.count, t1 - t0)
+    if recording.digest is None:
+        print "the recording has no end, so there is nothing to check"
+        return
+    if game.ticks == recording.end_tick and game.get_state_digest() == recording.digest:
+        print "final state matches the recording"
+    else:
+        print "final state DIFFERS from the recording (%d ticks recorded)" % (recording.end_tick,)
+        sys.exit(2)
+    return
+
+if __name__ == "__main__":
+    main()
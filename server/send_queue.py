@@ -0,0 +1,123 @@
+import time, socket, copy, logging
+from common.game_comm import *
+
+class ClientSendQueue:
+    """
+    Messages waiting to go to one client, over a non-blocking socket.
+    Object updates are kept per oid, so a client whose socket falls
+    behind gets only the newest state of each object when it catches
+    up, instead of every tick it missed.  Updates holding only the
+    changed fields are merged, so no change is lost.  Every message
+    waits in the order it was added, except that a merged update takes
+    the place of the newest, so nothing goes out before a message it
+    followed in the game.  A snapshot replaces every update and older
+    snapshot waiting before it.  Other messages waiting before it are
+    kept, and go out before it, as they happened before it.  Nothing
+    here ever blocks, so the caller can keep draining its pipe however
+    slow the client is.
+    """
+
+    def __init__(self, gc):
+        self.logger = logging.getLogger('ClientSendQueue')
+        self.gc = gc
+        self.waiting = []     # messages in the order to send, None where an update moved on
+        self.objects = {}     # oid -> index in waiting of its newest update
+        self.snapshot = None  # index in waiting of the newest SnapshotMessage
+        self.added = 0        # object updates added
+        self.coalesced = 0    # object updates merged into one already waiting
+        self.stalls = 0       # flushes that left data in the socket's queue
+        return
+
+    def add(self, msg):
+        if msg.get_command() == M_TICK_BATCH:
+            for m in msg.get_messages():
+                self.add(m)
+            return
+        if msg.get_command() == M_SNAPSHOT:
+            # it has every object, newer than any update waiting
+            self.coalesced += len(self.objects)
+            for i in self.objects.itervalues():
+                self.waiting[i] = None
+            self.objects = {}
+            if self.snapshot is not None:
+                self.waiting[self.snapshot] = None
+            self.snapshot = len(self.waiting)
+            self.waiting.append(msg)
+            return
+        oid = msg.get_data('oid')
+        if msg.get_command() in OBJECT_MESSAGES and oid is not None:
+            self.added += 1
+            i = self.objects.get(oid)
+            if i is not None:
+                self.coalesced += 1
+                # a new message, msg may be queued for other clients too
+                data = dict(self.waiting[i].data)
+                data.update(msg.data)
+                msg = copy.copy(msg)
+                msg.data = data
+                self.waiting[i] = None
+            self.objects[oid] = len(self.waiting)
+        self.waiting.append(msg)
+        return
+
+    def has_pending(self):
+        return bool(self.waiting)
+
+    def is_empty(self):
+        return not (self.has_pending() or self.gc.has_unsent())
+
+    def flush(self):
+        """
+        Sends what the socket will take.  Waiting messages are framed
+        only once the socket has taken everything framed before, so
+        they keep coalescing while the client is behind.  Returns True
+        if nothing is left waiting.  Raises socket.error.
+        """
+        if not self.gc.flush():
+            self.stalls += 1
+            return False
+        if not self.has_pending():
+            return True
+        msgs = [ msg for msg in self.waiting if msg is not None ]
+        self.waiting = []
+        self.objects = {}
+        self.snapshot = None
+        self.gc.queue_mesgs(self.make_batches(msgs))
+        if not self.gc.flush():
+            self.stalls += 1
+            return False
+        return True
+
+    def make_batches(self, msgs):
+        """Groups runs of messages a TickBatchMessage can carry, keeping the order."""
+        out = []
+        batch = None
+        for msg in msgs:
+            if msg.get_command() in BATCH_MESSAGE_CLASSES:
+                if batch is None:
+                    batch = TickBatchMessage()
+                    out.append(batch)
+                batch.add_message(msg)
+            else:
+                out.append(msg)
+                batch = None
+        return out
+
+    def drain(self, timeout):
+        """Waits up to timeout seconds to send everything, before the socket is closed."""
+        deadline = time.time() + timeout
+        try:
+            while not self.flush():
+                remaining = deadline - time.time()
+                if remaining <= 0.:
+                    return False
+                self.gc.sock.settimeout(remaining)
+                self.gc.flush()
+        except socket.timeout:
+            return False
+        return True
+
+    def get_stats(self):
+        return { 'added': self.added,
+                 'coalesced': self.coalesced,
+                 'stalls': self.stalls }
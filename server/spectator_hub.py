@@ -0,0 +1,245 @@
+import time, socket, select, logging
+from multiprocessing.reduction import recv_handle
+from common.game_comm import *
+from common.command_message import *
+from common.snapshot_message import *
+from main_server_client import client_from_handoff
+from config import *
+
+# control pipe message from the lobby, (HUB_VIEW, handoff), followed by
+# the viewer's socket descriptor, sent with send_handle()
+HUB_VIEW = "view"
+# control pipe message to the lobby, (HUB_STATS, stats), with the
+# match's tick profile, see GameServer.get_profile_stats()
+HUB_STATS = "stats"
+# control pipe message to the lobby, (HUB_TOURNAMENT, report), with a
+# TR_START or TR_END report of the game, see tournament_cache.py
+HUB_TOURNAMENT = "tournament"
+
+class Spectator:
+    """One viewer of a match."""
+
+    def __init__(self, client):
+        self.client = client
+        self.sock = client.sock
+        self.sock.setblocking(0)
+        self.gc = client.gc
+        # viewers with the same format get the same bytes
+        self.format = (client.partial_updates,) + self.gc.get_format()
+        self.lagging = False # skipped ticks, needs a snapshot once caught up
+        self.closed = False
+        return
+
+    def fileno(self):
+        return self.sock.fileno()
+
+class SpectatorHub:
+    """
+    Any number of viewers of one match, joining at any time.  A new
+    viewer gets a SnapshotMessage of every object, then the same
+    updates and keyframes as the players.  Each tick is encoded once per viewer
+    format, and the bytes are queued to every viewer with that format.
+    A viewer more than MAX_VIEWER_BACKLOG bytes behind skips ticks
+    until it has caught up, then gets a new snapshot.  Nothing here
+    blocks, so viewers can't slow the match.
+
+    Viewers are added with add_viewer(), or, when the game runs in its
+    own process, arrive from the lobby on the control pipe.
+    """
+
+    def __init__(self, game, control=None):
+        self.logger = logging.getLogger('SpectatorHub')
+        self.game = game
+        self.control = control
+        self.viewers = {} # fd -> Spectator
+        self.poll = select.poll()
+        if self.control:
+            self.poll.register(self.control.fileno(), select.POLLIN)
+        self.max_backlog = MAX_VIEWER_BACKLOG
+        self.snapshots = 0
+        self.skipped = 0
+        return
+
+    def get_viewer_count(self):
+        return len(self.viewers)
+
+    def needs(self, partial):
+        """True if any viewer wants updates with only the changed fields, if partial, or every field."""
+        for v in self.viewers.values():
+            if v.format[0] == partial:
+                return True
+        return False
+
+    def add_viewer(self, client):
+        v = Spectator(client)
+        self.viewers[v.fileno()] = v
+        self.poll.register(v.fileno(), select.POLLIN)
+        self.logger.info("viewer %s added, %d viewers", client.address, len(self.viewers))
+        self.send_snapshot(v)
+        if not v.closed and v.gc.has_buffered_mesg():
+            # sent before the lobby handed over the socket
+            self.read(v)
+        return
+
+    def remove_viewer(self, v):
+        if v.closed:
+            return
+        v.closed = True
+        fd = v.fileno()
+        if fd in self.viewers:
+            del self.viewers[fd]
+            self.poll.unregister(fd)
+        try:
+            v.sock.shutdown(socket.SHUT_RDWR)
+        except:
+            pass
+        v.sock.close()
+        return
+
+    def send_snapshot(self, v):
+        v.gc.queue_mesgs([ self.game.get_snapshot() ])
+        v.lagging = False
+        self.snapshots += 1
+        self.flush(v)
+        return
+
+    def broadcast(self, partial_msgs, full_msgs, snapshot=None):
+        """Queues one tick's messages, after the keyframe if any, to every viewer that is keeping up."""
+        encoded = {} # format -> bytes
+        for v in self.viewers.values():
+            if v.lagging:
+                continue
+            if v.gc.get_unsent_size() > self.max_backlog:
+                v.lagging = True
+                self.skipped += 1
+                continue
+            if v.format not in encoded:
+                if v.format[0]:
+                    msgs = partial_msgs
+                else:
+                    msgs = full_msgs
+                out = []
+                if snapshot:
+                    out.append(snapshot)
+                if msgs:
+                    out.append(TickBatchMessage(msgs))
+                encoded[v.format] = v.gc.encode_mesgs(out)
+            v.gc.queue_bytes(encoded[v.format])
+        for v in self.viewers.values():
+            self.flush(v)
+        return
+
+    def flush(self, v):
+        if v.closed:
+            return
+        try:
+            done = v.gc.flush()
+        except socket.error as e:
+            self.logger.info("viewer %s closed on send: %s", v.client.address, e)
+            self.remove_viewer(v)
+            return
+        if done and v.lagging:
+            self.send_snapshot(v)
+            return
+        mask = select.POLLIN
+        if not done:
+            mask |= select.POLLOUT
+        self.poll.modify(v.fileno(), mask)
+        return
+
+    def read(self, v):
+        try:
+            msgs = v.gc.read_mesgs()
+        except socket.error as e:
+            self.logger.info("viewer %s closed on recv: %s", v.client.address, e)
+            msgs = [ GameMessageClosed() ]
+        for msg in msgs:
+            if v.closed:
+                return
+            code = msg.get_command()
+            if code == M_CLOSED:
+                self.logger.info("viewer %s closed", v.client.address)
+                self.remove_viewer(v)
+                return
+            elif code == M_REQUEST_PLAYER_OID:
+                # viewers watch from player 1's side
+                v.gc.queue_mesgs([ PlayerOidMessage(self.game.engine.get_player1_oid()) ])
+                self.flush(v)
+            elif code == M_REQUEST_SNAPSHOT:
+                self.send_snapshot(v)
+            elif code == M_ECHO:
+                rmsg = GameMessageEcho()
+                rmsg.set_text(msg.get_text())
+                v.gc.queue_mesgs([ rmsg ])
+                self.flush(v)
+            else:
+                self.logger.debug("ignoring viewer message: %s", msg)
+        return
+
+    def receive_control(self):
+        try:
+            msg = self.control.recv()
+        except EOFError:
+            self.poll.unregister(self.control.fileno())
+            self.control = None
+            return
+        if msg[0] == HUB_VIEW:
+            fd = recv_handle(self.control)
+            self.add_viewer(client_from_handoff(fd, msg[1]))
+        else:
+            self.logger.error("Unexpected control message: %s", msg)
+        return
+
+    def report_stats(self, stats):
+        """Sends stats to the lobby, if the match has a control pipe."""
+        self.send_control((HUB_STATS, stats))
+        return
+
+    def report_tournament(self, report):
+        """Sends a tournament report to the lobby, if the match has a control pipe."""
+        self.send_control((HUB_TOURNAMENT, report))
+        return
+
+    def send_control(self, msg):
+        if not self.control:
+            return
+        try:
+            self.control.send(msg)
+        except (IOError, ValueError) as e:
+            self.logger.error("control pipe closed on send: %s", e)
+            self.poll.unregister(self.control.fileno())
+            self.control.close()
+            self.control = None
+        return
+
+    def service(self):
+        """Handles new viewers, viewer requests and room in viewer sockets, without blocking."""
+        for (fd, event) in self.poll.poll(0):
+            if self.control and fd == self.control.fileno():
+                self.receive_control()
+            elif fd in self.viewers:
+                v = self.viewers[fd]
+                if event & select.POLLOUT:
+                    self.flush(v)
+                if fd in self.viewers and event & ~select.POLLOUT:
+                    self.read(v)
+        return
+
+    def close(self, drain_time=0.):
+        """Closes every viewer, after waiting up to drain_time seconds for their last messages."""
+        deadline = time.time() + drain_time
+        for v in self.viewers.values():
+            try:
+                remaining = deadline - time.time()
+                while v.gc.has_unsent() and remaining > 0.:
+                    v.sock.settimeout(remaining)
+                    v.gc.flush()
+                    remaining = deadline - time.time()
+            except socket.error:
+                pass
+            self.remove_viewer(v)
+        if self.control:
+            self.control.close()
+            self.control = None
+        self.logger.info("closed. snapshots: %d  skipped: %d", self.snapshots, self.skipped)
+        return
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+import logging, sys, getopt, socket
+sys.path.append('..')
+from common.game_comm import *
+from common.stats_message import *
+from tick_profiler import PHASES, format_window
+
+def print_match(match, show_phases):
+    names = match['names']
+    profile = match['profile']
+    print "match %d: %s vs %s" % (match['match_id'], names[0], names[1])
+    if profile is None:
+        print "  no profile (is the server running with -P?)"
+        return
+    for key in ('window', 'total'):
+        stats = profile[key]
+        print "  %-6s %.0f s: %s" % (key, stats['seconds'], format_window(stats, profile['budget']))
+    if show_phases:
+        print "  %-16s %8s %8s %8s %8s %8s" % ("phase", "count", "mean", "p50", "p99", "max")
+        for phase in PHASES:
+            p = profile['total']['phases'][phase]
+            print "  %-16s %8d %8.3f %8.3f %8.3f %8.3f" % (phase, p['count'], p['mean'], p['p50'], p['p99'], p['max'])
+    return
+
+def usage():
+    print "usage: %s [-s|--server host] [-p|--port port] [-v|--verbose] [-h|--help]" % (sys.argv[0])
+    print "prints the tick profile of each match running on a server started with -P"
+    print "-s|--server host : server to ask (default localhost)"
+    print "-p|--port port   : port of the server (default 20149)"
+    print "-v|--verbose     : also print every phase's totals"
+    print "-h|--help        : show this message and exit"
+    return
+
+def main():
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hs:p:v", ["help", "server=", "port=", "verbose"])
+    except getopt.GetoptError as e:
+        print str(e)
+        usage()
+        sys.exit(1)
+
+    show_help = False
+    host = "localhost"
+    port = 20149
+    verbose = False
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            show_help = True
+        elif o in ("-s", "--server"):
+            host = a
+        elif o in ("-p", "--port"):
+            try:
+                port = int(a)
+            except ValueError:
+                show_help = True
+        elif o in ("-v", "--verbose"):
+            verbose = True
+        else:
+            print "Unexpected option: %s" % (o)
+            usage()
+            sys.exit(1)
+    if args:
+        show_help = True
+    if show_help:
+        usage()
+        sys.exit(1)
+    logging.basicConfig(level=logging.ERROR)
+
+    sock = socket.create_connection((host, port))
+    gc = GameComm(sock)
+    gc.write_mesg(RequestStatsMessage())
+    msg = gc.read_mesg()
+    sock.close()
+    if msg is None or msg.get_command() != M_STATS:
+        print "unexpected answer: %s" % (msg,)
+        sys.exit(2)
+    matches = msg.get_matches()
+    if not matches:
+        print "no matches running"
+    for match in matches:
+        print_match(match, verbose)
+    return
+
+if __name__ == "__main__":
+    main()
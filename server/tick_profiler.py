@@ -0,0 +1,110 @@
+import time
+from common.histogram import Histogram
+from config import *
+
+# the phases of a GameServer step, in the order they happen.  the
+# engine marks the phases of GameEngine.evolve(), and "other" is what
+# is left when the tick ends
+PHASES = ( 'hub', 'receive',
+           'evolve_objects', 'collisions', 'dead_sweep', 'respawn',
+           'object_messages', 'events', 'send', 'other' )
+
+class ProfileWindow:
+    """Histograms of each phase, and of whole ticks, over some time."""
+
+    def __init__(self):
+        self.start = time.time()
+        self.phases = dict([ (phase, Histogram(PROFILE_BUCKETS)) for phase in PHASES ])
+        self.ticks = Histogram(PROFILE_BUCKETS)
+        self.over_budget = 0
+        return
+
+    def merge(self, other):
+        for phase in PHASES:
+            self.phases[phase].merge(other.phases[phase])
+        self.ticks.merge(other.ticks)
+        self.over_budget += other.over_budget
+        return
+
+    def get_stats(self):
+        return { 'seconds': time.time() - self.start,
+                 'ticks': self.ticks.get_stats(),
+                 'over_budget': self.over_budget,
+                 'phases': dict([ (phase, self.phases[phase].get_stats()) for phase in PHASES ]) }
+
+class TickProfiler:
+    """
+    Times the phases of each tick of one match.  begin() starts a tick,
+    mark(phase) charges the time since the last mark to phase, and
+    end() charges the rest to "other" and counts the tick over budget
+    if it took longer than budget seconds.  Ticks go in a window that
+    roll() closes every PROFILE_LOG_INTERVAL seconds, adding it to the
+    totals.
+
+    A match that isn't profiled has no TickProfiler, so the only cost
+    is the test for one.
+    """
+
+    def __init__(self, budget):
+        self.budget = budget * 1000.
+        self.window = ProfileWindow()
+        self.last = None  # the last closed window's stats
+        self.total = ProfileWindow()
+        self.t = None
+        self.tick_start = None
+        return
+
+    def begin(self):
+        self.t = self.tick_start = time.time()
+        return
+
+    def mark(self, phase):
+        now = time.time()
+        self.window.phases[phase].add((now - self.t) * 1000.)
+        self.t = now
+        return
+
+    def end(self):
+        self.mark('other')
+        ms = (self.t - self.tick_start) * 1000.
+        self.window.ticks.add(ms)
+        if ms > self.budget:
+            self.window.over_budget += 1
+        return
+
+    def is_roll_due(self):
+        return time.time() - self.window.start >= PROFILE_LOG_INTERVAL
+
+    def roll(self):
+        """Closes the window, returns its stats."""
+        self.last = self.window.get_stats()
+        self.total.merge(self.window)
+        self.window = ProfileWindow()
+        return self.last
+
+    def get_stats(self):
+        """Stats of the last closed window, or the current one before any, and the totals."""
+        last = self.last
+        if last is None:
+            last = self.window.get_stats()
+        total = ProfileWindow()
+        total.start = self.total.start
+        total.merge(self.total)
+        total.merge(self.window)
+        return { 'budget': self.budget,
+                 'window': last,
+                 'total': total.get_stats() }
+
+def format_window(stats, budget):
+    """One line about a window's stats, with its slowest phases first."""
+    ticks = stats['ticks']
+    phases = [ (stats['phases'][phase]['mean'] * stats['phases'][phase]['count'], phase)
+               for phase in PHASES if stats['phases'][phase]['count'] ]
+    phases.sort(reverse=True)
+    parts = []
+    for (total, phase) in phases[:4]:
+        p = stats['phases'][phase]
+        parts.append("%s %.3f/%.3f" % (phase, p['mean'], p['max']))
+    return "%d ticks, mean %.3f ms, p99 %.3f ms, max %.3f ms, %d over the %.1f ms budget; mean/max ms: %s" % (
+        ticks['count'], ticks['mean'], ticks['p99'], ticks['max'],
+        stats['over_budget'], budget, ", ".join(parts))
@@ -13,12 +13,30 @@ TOURNAMENT_AVAILABLE = 101
 TOURNAMENT_STARTED = 102
 TOURNAMENT_OVER = 103
 
+# made by open(), for files made before they were
+INDEXES = [ """CREATE INDEX IF NOT EXISTS players_name ON players (name)""",
+            """CREATE INDEX IF NOT EXISTS games_players ON games (player1, player2)""",
+            """CREATE INDEX IF NOT EXISTS games_player2 ON games (player2)""",
+            """CREATE INDEX IF NOT EXISTS games_state ON games (state)""",
+            """CREATE INDEX IF NOT EXISTS games_winner ON games (winner)""",
+            """CREATE INDEX IF NOT EXISTS data_var ON data (var)""" ]
+
 class Tournament:
+    """
+    The tournament's players and games, in an sqlite file.  While the
+    server is up, it is written by the lobby's TournamentWriter, see
+    tournament_cache.py, and by tournament.py when it is run by hand.
+    The file is in WAL mode, so either can read it while the other
+    writes, and a write waits for the other's to finish.  Each change
+    is committed at once, unless it is between begin_batch() and
+    end_batch(), which commit all of the changes between them together.
+    """
 
     def __init__(self):
         self.filename = "tournament.db"
         self.connection  = None
         self.cursor = None
+        self.batch_depth = 0
         return
 
     def get_max_losses(self):
@@ -49,14 +67,22 @@ class Tournament:
 
     def open(self):
         exists = os.path.exists(self.filename)
-        self.connection = sqlite.connect(self.filename)
+        # wait for another process's write, instead of failing at once
+        self.connection = sqlite.connect(self.filename, timeout=10.)
         self.cursor = self.connection.cursor()
+        self.cursor.execute("""PRAGMA journal_mode = WAL""")
+        # in WAL mode, a crash can lose the last commits but can't corrupt the file
+        self.cursor.execute("""PRAGMA synchronous = NORMAL""")
         if not exists:
             self.create_tables()
+        for sql in INDEXES:
+            self.cursor.execute(sql)
+        self.connection.commit()
         return
 
     def close(self):
         if self.connection:
+            self.connection.commit()
             self.connection.close()
             self.connection  = None
             self.cursor = None
@@ -73,6 +99,21 @@ class Tournament:
             self.connection.commit()
         return
 
+    def begin_batch(self):
+        """Holds the commits of the changes that follow, until the matching end_batch()."""
+        self.batch_depth += 1
+        return
+
+    def end_batch(self):
+        self.batch_depth -= 1
+        self.commit()
+        return
+
+    def commit(self):
+        if self.connection and self.batch_depth == 0:
+            self.connection.commit()
+        return
+
     def data_exists(self, var):
         if self.cursor:
             self.cursor.execute("""SELECT value FROM data WHERE var = ?""", (str(var),))
@@ -90,7 +131,7 @@ class Tournament:
                                     (str(var), str(val)))
             else:
                 self.cursor.execute("""UPDATE data SET value = ? WHERE var = ?""", (str(val), str(var)))
-            self.connection.commit()
+            self.commit()
         return
         
     def get_data(self, var):
@@ -117,53 +158,38 @@ class Tournament:
                                    (name) 
                                    VALUES (?)""",
                                 (name,))
-            self.connection.commit()
+            self.commit()
         return
         
     def delete_player(self, name):
         if self.cursor and self.player_exists(name):
             self.cursor.execute("""DELETE FROM players WHERE name = ?""",
                                 (str(name), ))
-            self.connection.commit()
+            self.commit()
         return
         
     def list_players(self):
         players = []
         if self.cursor:
             self.cursor.execute("""SELECT name FROM players""", ())
-            done = False
-            while not done:
-                row = self.cursor.fetchone()
-                if row is None:
-                    done = True
-                else:
-                    players.append(str(row[0]))
+            for row in self.cursor.fetchall():
+                players.append(str(row[0]))
         return players
 
     def list_games(self):
         games = []
         if self.cursor:
             self.cursor.execute("""SELECT player1, player2, state, winner FROM games""", ())
-            done = False
-            while not done:
-                row = self.cursor.fetchone()
-                if row is None:
-                    done = True
-                else:
-                    games.append( (str(row[0]),str(row[1]),str(row[2]),str(row[3])) )
+            for row in self.cursor.fetchall():
+                games.append( (str(row[0]),str(row[1]),str(row[2]),str(row[3])) )
         return games
 
     def list_games_in_state(self, state):
         games = []
         if self.cursor:
             self.cursor.execute("""SELECT player1, player2, state, winner FROM games WHERE state = ?""", (str(state),))
-            done = False
-            while not done:
-                row = self.cursor.fetchone()
-                if row is None:
-                    done = True
-                else:
-                    games.append( (str(row[0]),str(row[1]),str(row[2]),str(row[3])) )
+            for row in self.cursor.fetchall():
+                games.append( (str(row[0]),str(row[1]),str(row[2]),str(row[3])) )
         return games
 
     def game_exists(self, p1, p2):
@@ -175,155 +201,156 @@ class Tournament:
         return False
         
     def either_game_exists(self, p1, p2):
-        return self.game_exists(p1, p2) or self.game_exists(p2, p1)
+        if self.cursor:
+            self.cursor.execute("""SELECT state FROM games
+                                   WHERE (player1 = ? AND player2 = ?) OR (player1 = ? AND player2 = ?)
+                                   LIMIT 1""",
+                                (str(p1), str(p2), str(p2), str(p1)))
+            if self.cursor.fetchone() is not None:
+                return True
+        return False
+        
+    def get_game_pairs(self):
+        """The set of (player1, player2) with a game, both ways around, so either_game_exists(p1, p2) is (p1, p2) in it."""
+        pairs = set()
+        if self.cursor:
+            self.cursor.execute("""SELECT player1, player2 FROM games""", ())
+            for row in self.cursor.fetchall():
+                (p1, p2) = (str(row[0]), str(row[1]))
+                pairs.add((p1, p2))
+                pairs.add((p2, p1))
+        return pairs
         
     def add_game(self, p1, p2):
         if  self.cursor and (not self.either_game_exists(p1, p2)):
+            self.begin_batch()
             self.add_player(p1)
             self.add_player(p2)
             self.cursor.execute("""INSERT INTO games
                                    (player1, player2, state, winner) 
                                    VALUES (?,?,?,?)""",
                                 (str(p1), str(p2), str(TS_PREGAME), ""))
-            self.connection.commit()
+            self.end_batch()
         return
-        
-    def start_game(self, p1, p2):
+
+    def set_game(self, p1, p2, state, winner=None):
+        """Sets the state, and the winner if given, of the game between p1 and p2, either way around."""
+        if not self.cursor:
+            return
+        self.begin_batch()
         if not self.either_game_exists(p1, p2):
             self.add_game(p1, p2)
-        if self.cursor and self.game_exists(p1, p2):
-            self.cursor.execute("""UPDATE games SET state = ? WHERE player1 = ? AND player2 = ?""",
-                                (str(TS_STARTED), str(p1), str(p2)))
-            self.connection.commit()
-        elif self.cursor and self.game_exists(p2, p1):
-            self.cursor.execute("""UPDATE games SET state = ? WHERE player1 = ? AND player2 = ?""",
-                                (str(TS_STARTED), str(p2), str(p1)))
-            self.connection.commit()
+        if winner is None:
+            self.cursor.execute("""UPDATE games SET state = ?
+                                   WHERE (player1 = ? AND player2 = ?) OR (player1 = ? AND player2 = ?)""",
+                                (str(state), str(p1), str(p2), str(p2), str(p1)))
+        else:
+            self.cursor.execute("""UPDATE games SET state = ?, winner = ?
+                                   WHERE (player1 = ? AND player2 = ?) OR (player1 = ? AND player2 = ?)""",
+                                (str(state), str(winner), str(p1), str(p2), str(p2), str(p1)))
+        self.end_batch()
+        return
+        
+    def start_game(self, p1, p2):
+        self.set_game(p1, p2, TS_STARTED)
         return
         
     def end_game(self, p1, p2, winner):
-        if not self.either_game_exists(p1, p2):
-            self.add_game(p1, p2)
-        if self.cursor and self.game_exists(p1, p2):
-            self.cursor.execute("""UPDATE games SET state = ?, winner = ? WHERE player1 = ? AND player2 = ?""",
-                                (str(TS_OVER), str(winner), str(p1), str(p2)))
-            self.connection.commit()
-        elif self.cursor and self.game_exists(p2, p1):
-            self.cursor.execute("""UPDATE games SET state = ?, winner = ? WHERE player1 = ? AND player2 = ?""",
-                                (str(TS_OVER), str(winner), str(p2), str(p1)))
-            self.connection.commit()
+        self.set_game(p1, p2, TS_OVER, winner)
         return
         
     def delete_game(self, p1, p2):
-        if self.cursor and self.game_exists(p1, p2):
-            self.cursor.execute("""DELETE FROM games WHERE player1 = ? AND player2 = ?""",
-                                (str(p1), str(p2)))
-            self.connection.commit()
-        elif self.cursor and self.game_exists(p2, p1):
-            self.cursor.execute("""DELETE FROM games WHERE player1 = ? AND player2 = ?""",
-                                (str(p2), str(p1)))
-            self.connection.commit()
+        if self.cursor:
+            self.cursor.execute("""DELETE FROM games
+                                   WHERE (player1 = ? AND player2 = ?) OR (player1 = ? AND player2 = ?)""",
+                                (str(p1), str(p2), str(p2), str(p1)))
+            self.commit()
         return
         
     def get_game(self, p1, p2):
-        if self.cursor and self.game_exists(p1, p2):
-            self.cursor.execute("""SELECT state, winner FROM games WHERE player1 = ? AND player2 = ?""", (str(p1), str(p2)))
-            row = self.cursor.fetchone()
-            if row is not None:
-                return (int(row[0]), str(row[1]))
-        elif self.cursor and self.game_exists(p2, p1):
-            self.cursor.execute("""SELECT state, winner FROM games WHERE player1 = ? AND player2 = ?""", (str(p2), str(p1)))
+        if self.cursor:
+            self.cursor.execute("""SELECT state, winner FROM games
+                                   WHERE (player1 = ? AND player2 = ?) OR (player1 = ? AND player2 = ?)
+                                   LIMIT 1""",
+                                (str(p1), str(p2), str(p2), str(p1)))
             row = self.cursor.fetchone()
             if row is not None:
                 return (int(row[0]), str(row[1]))
         return (TS_NONE, "")
 
-
     def count_losses(self, player):
         count = 1000
         if self.cursor:
-            count = 0
-            self.cursor.execute("""SELECT state, winner FROM games WHERE (player1 = ? OR player2 = ?) AND state = ? AND winner != ?""",
+            self.cursor.execute("""SELECT COUNT(*) FROM games WHERE (player1 = ? OR player2 = ?) AND state = ? AND winner != ?""",
                                 (str(player), str(player), str(TS_OVER), str(player)))
-            for row in self.cursor.fetchall():
-                count += 1
+            count = self.cursor.fetchone()[0]
         return count
         
     def count_wins(self, player):
         count = 0
         if self.cursor:
-            self.cursor.execute("""SELECT state, winner FROM games WHERE (player1 = ? OR player2 = ?) AND state = ? AND winner == ?""",
-                                (str(player), str(player), str(TS_OVER), str(player)))
-            for row in self.cursor.fetchall():
-                count += 1
+            self.cursor.execute("""SELECT COUNT(*) FROM games WHERE winner = ? AND state = ? AND (player1 = ? OR player2 = ?)""",
+                                (str(player), str(TS_OVER), str(player), str(player)))
+            count = self.cursor.fetchone()[0]
         return count
         
     def player_in_game(self, player):
+        count = 0
         if self.cursor:
-            count = 0
-            self.cursor.execute("""SELECT state FROM games WHERE (player1 = ? OR player2 = ?) AND (state = ? OR state = ?)""",
+            self.cursor.execute("""SELECT COUNT(*) FROM games WHERE (player1 = ? OR player2 = ?) AND (state = ? OR state = ?)""",
                                 (str(player), str(player), str(TS_PREGAME), str(TS_STARTED)))
-            for row in self.cursor.fetchall():
-                count += 1
+            count = self.cursor.fetchone()[0]
         return count
 
+    def get_player_counts(self):
+        """
+        [ (name, wins, losses, games in play) ] of every player, in the
+        order of list_players(), from one pass over the games.
+        """
+        counts = []
+        if self.cursor:
+            self.cursor.execute("""SELECT name, SUM(state = ? AND winner = name),
+                                          SUM(state = ? AND winner != name),
+                                          SUM(state = ? OR state = ?)
+                                   FROM (SELECT player1 AS name, state, winner FROM games
+                                         UNION ALL
+                                         SELECT player2 AS name, state, winner FROM games WHERE player2 != player1)
+                                   GROUP BY name""",
+                                (str(TS_OVER), str(TS_OVER), str(TS_PREGAME), str(TS_STARTED)))
+            by_name = {}
+            for row in self.cursor.fetchall():
+                by_name[str(row[0])] = (int(row[1]), int(row[2]), int(row[3]))
+            for p in self.list_players():
+                (wins, losses, in_game) = by_name.get(p, (0, 0, 0))
+                counts.append( (p, wins, losses, in_game) )
+        return counts
         
     def get_in_game_players(self):
-        players = []
-        all_players = self.list_players()
-        for p in all_players:
-            if self.player_in_game(p):
-                players.append(p)
-        return players
+        return [ c[0] for c in self.get_player_counts() if c[3] ]
         
     def get_not_in_game_players(self):
-        players = []
-        all_players = self.list_players()
-        for p in all_players:
-            if not self.player_in_game(p):
-                players.append(p)
-        return players
+        return [ c[0] for c in self.get_player_counts() if not c[3] ]
         
     def get_eligible_players(self):
         """max_losses or in_game makes ineligible"""
         max_losses = self.get_max_losses()
-        players = []
-        all_players = self.list_players()
-        for p in all_players:
-            losses = self.count_losses(p)
-            if losses < max_losses and not self.player_in_game(p):
-                players.append(p)
-        return players
+        return [ c[0] for c in self.get_player_counts() if c[2] < max_losses and not c[3] ]
         
     def get_ineligible_players(self):
         """max_losses or in_game makes ineligible"""
         max_losses = self.get_max_losses()
-        players = []
-        all_players = self.list_players()
-        for p in all_players:
-            losses = self.count_losses(p)
-            if losses >= max_losses or self.player_in_game(p):
-                players.append(p)
-        return players
+        return [ c[0] for c in self.get_player_counts() if c[2] >= max_losses or c[3] ]
 
     def reset(self):
-        for g in self.list_games():
-            self.delete_game(g[0], g[1])
-        for p in self.list_players():
-            self.delete_player(p)
+        if self.cursor:
+            self.cursor.execute("""DELETE FROM games""")
+            self.cursor.execute("""DELETE FROM players""")
+            self.commit()
         return
         
     def get_player_stats(self):
         """list of (name, wins, losses) tuples"""
-        stats = []
-        all_players = self.list_players()
-        for p in all_players:
-            losses = self.count_losses(p)
-            wins = self.count_wins(p)
-            stats.append( (p, wins, losses) )
-        return stats
-        
-
+        return [ (c[0], c[1], c[2]) for c in self.get_player_counts() ]
 
 def usage():
     print "usage: %s options" % (sys.argv[0])
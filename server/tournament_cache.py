@@ -0,0 +1,228 @@
+import threading, Queue, logging
+import sqlite3 as sqlite
+from tournament import *
+
+# a game's report of a tournament game to the lobby, (TR_START, p1, p2, None)
+# when it starts and (TR_END, p1, p2, winner) when it is over
+TR_START = "start"
+TR_END = "end"
+
+class TournamentWriter(threading.Thread):
+    """
+    Writes the lobby's tournament changes to the sqlite file, in its
+    own thread with its own connection, so the lobby never waits on
+    the disk.  write() queues a call of a Tournament method.  Every
+    call waiting when the thread wakes is written in one transaction.
+    """
+
+    def __init__(self, filename):
+        threading.Thread.__init__(self, name='TournamentWriter')
+        self.logger = logging.getLogger('TournamentWriter')
+        self.daemon = True
+        self.filename = filename
+        self.queue = Queue.Queue()
+        self.writes = 0
+        self.batches = 0
+        return
+
+    def write(self, method, *args):
+        self.queue.put((method, args))
+        return
+
+    def run(self):
+        tournament = Tournament()
+        tournament.filename = self.filename
+        tournament.open()
+        done = False
+        while not done:
+            ops = [ self.queue.get() ]
+            try:
+                while True:
+                    ops.append(self.queue.get_nowait())
+            except Queue.Empty:
+                pass
+            try:
+                tournament.begin_batch()
+                for op in ops:
+                    if op is None:
+                        done = True
+                        continue
+                    getattr(tournament, op[0])(*op[1])
+                    self.writes += 1
+                tournament.end_batch()
+            except sqlite.Error as e:
+                self.logger.error("%d tournament changes lost: %s", len(ops), e)
+                tournament.batch_depth = 0
+                tournament.connection.rollback()
+            self.batches += 1
+        tournament.close()
+        self.logger.info("closed. writes: %d  batches: %d", self.writes, self.batches)
+        return
+
+    def close(self, timeout=None):
+        """Writes what is queued, then stops.  Waits up to timeout seconds for it."""
+        self.queue.put(None)
+        self.join(timeout)
+        if self.is_alive():
+            self.logger.error("tournament changes still unwritten after %s s", timeout)
+        return
+
+class TournamentCache:
+    """
+    The lobby's copy of the tournament: the players, each player's wins,
+    losses and games in play, and the game of each pair of players.
+    It is read from the file once, when the lobby starts, and every
+    lookup after that is in memory.  Changes are made here at once and
+    written to the file behind the lobby's back by a TournamentWriter.
+
+    The games don't touch the file.  They report to the lobby, which
+    applies the reports here, so the lobby's writer is the only one.
+    Changes made to the file with tournament.py while the lobby runs
+    are not seen until it starts again.
+    """
+
+    def __init__(self, filename="tournament.db"):
+        self.logger = logging.getLogger('TournamentCache')
+        self.players = []    # names, in the order they were added
+        self.player_set = set()
+        self.wins = {}       # name -> games over and won, for any name in a game
+        self.losses = {}     # name -> games over and not won
+        self.in_game = {}    # name -> games not yet over
+        self.games = {}      # (player1, player2) -> [ state, winner ]
+        self.pairs = {}      # (p1, p2) and (p2, p1) -> the key of their game in games
+        tournament = Tournament()
+        tournament.filename = filename
+        tournament.open()
+        self.max_losses = tournament.get_max_losses()
+        self.state = tournament.get_tournament_state()
+        for name in tournament.list_players():
+            self.add_player_data(name)
+        for (p1, p2, state, winner) in tournament.list_games():
+            self.add_game_data(p1, p2, int(state), winner)
+        tournament.close()
+        self.logger.info("%d players, %d games", len(self.players), len(self.games))
+        self.writer = TournamentWriter(filename)
+        self.writer.start()
+        return
+
+    def close(self, timeout=5.):
+        self.writer.close(timeout)
+        return
+
+    def add_player_data(self, name):
+        if name in self.player_set:
+            return
+        self.players.append(name)
+        self.player_set.add(name)
+        return
+
+    def add_game_data(self, p1, p2, state, winner):
+        key = (p1, p2)
+        if key in self.games:
+            self.uncount_game(key)
+        self.games[key] = [ state, winner ]
+        self.pairs[(p1, p2)] = key
+        self.pairs[(p2, p1)] = key
+        self.count_game(key, 1)
+        return
+
+    def count_game(self, key, n):
+        """Adds n times game key to its players' counts."""
+        (state, winner) = self.games[key]
+        for name in set(key):
+            if state == TS_OVER:
+                if winner == name:
+                    self.wins[name] = self.wins.get(name, 0) + n
+                else:
+                    self.losses[name] = self.losses.get(name, 0) + n
+            elif state == TS_PREGAME or state == TS_STARTED:
+                self.in_game[name] = self.in_game.get(name, 0) + n
+        return
+
+    def uncount_game(self, key):
+        self.count_game(key, -1)
+        return
+
+    def get_max_losses(self):
+        return self.max_losses
+
+    def set_max_losses(self, ml):
+        self.max_losses = int(ml)
+        self.writer.write('set_max_losses', ml)
+        return
+
+    def get_tournament_state(self):
+        return self.state
+
+    def player_exists(self, name):
+        return name in self.player_set
+
+    def add_player(self, name):
+        if not self.player_exists(name):
+            self.add_player_data(name)
+            self.writer.write('add_player', name)
+        return
+
+    def list_players(self):
+        return list(self.players)
+
+    def either_game_exists(self, p1, p2):
+        return (p1, p2) in self.pairs
+
+    def get_game(self, p1, p2):
+        key = self.pairs.get((p1, p2))
+        if key is None:
+            return (TS_NONE, "")
+        return tuple(self.games[key])
+
+    def add_game(self, p1, p2):
+        if not self.either_game_exists(p1, p2):
+            self.add_player(p1)
+            self.add_player(p2)
+            self.add_game_data(p1, p2, TS_PREGAME, "")
+            self.writer.write('add_game', p1, p2)
+        return
+
+    def set_game(self, p1, p2, state, winner=None):
+        if not self.either_game_exists(p1, p2):
+            self.add_game(p1, p2)
+        key = self.pairs[(p1, p2)]
+        if winner is None:
+            winner = self.games[key][1]
+        self.add_game_data(key[0], key[1], state, winner)
+        return
+
+    def start_game(self, p1, p2):
+        self.set_game(p1, p2, TS_STARTED)
+        self.writer.write('start_game', p1, p2)
+        return
+
+    def end_game(self, p1, p2, winner):
+        self.set_game(p1, p2, TS_OVER, str(winner))
+        self.writer.write('end_game', p1, p2, winner)
+        return
+
+    def is_eligible(self, name):
+        """max_losses or in_game makes ineligible"""
+        return (name in self.player_set and self.losses.get(name, 0) < self.max_losses and
+                not self.in_game.get(name, 0))
+
+    def get_eligible_players(self):
+        return [ p for p in self.players if self.is_eligible(p) ]
+
+    def get_player_stats(self):
+        """list of (name, wins, losses) tuples"""
+        return [ (p, self.wins.get(p, 0), self.losses.get(p, 0)) for p in self.players ]
+
+    def apply_report(self, report):
+        """A game's TR_START or TR_END report, for the game of its players, if they have one."""
+        (kind, p1, p2, winner) = report
+        if not self.either_game_exists(p1, p2):
+            return
+        if kind == TR_START:
+            self.start_game(p1, p2)
+        elif kind == TR_END:
+            self.end_game(p1, p2, winner)
+        else:
+            self.logger.error("Unexpected tournament report: %s", report)
+        return
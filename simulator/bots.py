@@ -0,0 +1,53 @@
+import random
+from client_ai.ai_client import AiClient
+
+class IdleBot:
+    """Never sends a command."""
+
+    def __init__(self, name, seed=0):
+        self.name = name
+        self.act_time = 1.0
+        return
+
+    def act(self, engine):
+        return
+
+class RandomBot:
+    """Wanders and fires in random directions."""
+
+    def __init__(self, name, seed=0):
+        self.name = name
+        self.act_time = 0.5
+        self.random = random.Random(seed)
+        return
+
+    def act(self, engine):
+        r = self.random.random()
+        if r < 0.3:
+            engine.set_player_direction(self.random.uniform(-180., 180.))
+            engine.set_player_speed_slow()
+        elif r < 0.4:
+            engine.set_player_speed_stop()
+        engine.set_missile_range_short()
+        engine.set_missile_direction(self.random.uniform(-180., 180.))
+        engine.fire_missile()
+        return
+
+class AiBot:
+    """The strategy from client_ai.AiClient, acting once a second like AiClient.main_loop()."""
+
+    def __init__(self, name, seed=0):
+        self.name = name
+        self.act_time = 1.0
+        # the socket is never connected, only act() is used
+        self.client = AiClient(name)
+        return
+
+    def act(self, engine):
+        self.client.act(engine)
+        return
+
+BOTS = { "ai": AiBot, "idle": IdleBot, "random": RandomBot }
+
+def make_bot(kind, name, seed=0):
+    return BOTS[kind](name, seed)
@@ -0,0 +1,125 @@
+import time, logging
+from engine_server.array_engine import make_engine
+from engine_server.game_engine import PLAYER_COMMANDS
+from engine_server.object import UPDATE_MESSAGE_CLASSES
+from engine_server.config import ENGINE_BACKEND
+from engine_client.game_engine import ClientGameEngine, MODE_AI
+from common.command_message import PlayerOidMessage
+from bots import make_bot
+
+DEFAULT_DT = 1.0/30.0
+
+def object_to_message(obj):
+    message_class = UPDATE_MESSAGE_CLASSES.get(obj.kind)
+    if message_class is None:
+        return None
+    return message_class(obj.get_data())
+
+class HeadlessMatch:
+    """
+    Plays one match between two bots with no sockets, pipes or sleeping.
+    Each bot sees the game through its own ClientGameEngine, the same as
+    a networked client, and its commands are applied to the server
+    engine directly.  The engine is evolved with a fixed dt, as fast as
+    the CPU allows.
+    """
+
+    def __init__(self, seed, bot_kinds, dt=DEFAULT_DT, max_time=None, backend=ENGINE_BACKEND):
+        self.logger = logging.getLogger('HeadlessMatch')
+        self.seed = seed
+        self.dt = dt
+        self.engine = make_engine(backend, seed)
+        if max_time is not None:
+            self.engine.max_total_time = max_time
+        self.oids = [ self.engine.get_player1_oid(), self.engine.get_player2_oid() ]
+        self.bots = []
+        self.views = []
+        self.next_act = []
+        for i in range(2):
+            name = "%s%d" % (bot_kinds[i], i + 1)
+            self.bots.append(make_bot(bot_kinds[i], name, seed * 2 + i))
+            view = ClientGameEngine(name, MODE_AI)
+            view.clear_message_queue()
+            view.process_server_message(PlayerOidMessage(self.oids[i]))
+            self.views.append(view)
+            self.next_act.append(0.)
+        # per view, objects changed since it was last updated
+        self.pending = [ {}, {} ]
+        self.collect_changed_objects()
+        self.time = 0.
+        self.ticks = 0
+        self.tick_time = 0.
+        self.max_tick_time = 0.
+        return
+
+    def collect_changed_objects(self):
+        for obj in self.engine.get_changed_objects():
+            oid = obj.get_object_id()
+            for pending in self.pending:
+                pending[oid] = obj
+        self.engine.clear_changed_objects()
+        return
+
+    def update_view(self, i):
+        """Views are only brought up to date when their bot is about to look at them."""
+        pending = self.pending[i]
+        for oid in pending:
+            msg = object_to_message(pending[oid])
+            if msg:
+                self.views[i].process_server_message(msg)
+        self.pending[i] = {}
+        return
+
+    def run_bots(self):
+        for i in range(2):
+            if self.time < self.next_act[i]:
+                continue
+            self.update_view(i)
+            view = self.views[i]
+            self.bots[i].act(view)
+            for msg in view.get_message_queue():
+                if msg.get_command() in PLAYER_COMMANDS and self.oids[i] in self.engine.players:
+                    self.engine.process_command(self.oids[i], msg)
+            view.clear_message_queue()
+            self.next_act[i] = self.time + self.bots[i].act_time
+        return
+
+    def step(self):
+        self.run_bots()
+        t0 = time.time()
+        self.engine.evolve(self.dt)
+        t = time.time() - t0
+        self.tick_time += t
+        if t > self.max_tick_time:
+            self.max_tick_time = t
+        self.collect_changed_objects()
+        self.engine.clear_events()
+        self.time += self.dt
+        self.ticks += 1
+        return
+
+    def get_winner(self):
+        """Returns 0 or 1 for the winning player, or -1 for a draw."""
+        oid = self.engine.get_winner_oid()
+        if oid in self.oids:
+            return self.oids.index(oid)
+        return -1
+
+    def run(self):
+        t0 = time.time()
+        while not self.engine.game_over():
+            self.step()
+        wall_time = time.time() - t0
+        return { 'seed': self.seed,
+                 'winner': self.get_winner(),
+                 'ticks': self.ticks,
+                 'sim_time': self.time,
+                 'wall_time': wall_time,
+                 'tick_time': self.tick_time,
+                 'max_tick_time': self.max_tick_time }
+
+def run_match(args):
+    """Plays one match; args is (seed, bot_kinds, dt, max_time, backend), for Pool.map()."""
+    (seed, bot_kinds, dt, max_time, backend) = args
+    match = HeadlessMatch(seed, bot_kinds, dt, max_time, backend)
+    return match.run()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+import logging, sys, getopt, time
+from multiprocessing import Pool
+sys.path.append('..')
+from headless import run_match, DEFAULT_DT
+from bots import BOTS
+from engine_server.config import ENGINE_BACKEND
+
+def usage():
+    print "usage: %s [-n|--matches count] [-s|--seed seed] [-1|--bot1 kind] [-2|--bot2 kind] [-j|--jobs count] [-t|--max-time seconds] [-d|--dt seconds] [-b|--backend name] [-L|--logging level] [-h|--help]" % (sys.argv[0])
+    print "-n|--matches count     : number of matches to play"
+    print "-s|--seed seed         : seed of the first match, match i uses seed+i"
+    print "-1|--bot1 kind         : bot for player 1, one of %s" % (", ".join(sorted(BOTS.keys())))
+    print "-2|--bot2 kind         : bot for player 2"
+    print "-j|--jobs count        : number of worker processes, 0 to play in this process"
+    print "-t|--max-time seconds  : simulated time limit of each match (default 300)"
+    print "-d|--dt seconds        : fixed time step"
+    print "-b|--backend name      : engine backend, object or numpy"
+    print "-L|--logging info|debug|warning|error: logging level"
+    print "-h|--help              : show this message and exit"
+    return
+
+def report(results, bot_kinds, wall_time):
+    count = len(results)
+    wins = [ 0, 0 ]
+    draws = 0
+    ticks = 0
+    sim_time = 0.
+    tick_time = 0.
+    max_tick_time = 0.
+    for r in results:
+        if r['winner'] < 0:
+            draws += 1
+        else:
+            wins[r['winner']] += 1
+        ticks += r['ticks']
+        sim_time += r['sim_time']
+        tick_time += r['tick_time']
+        max_tick_time = max(max_tick_time, r['max_tick_time'])
+    print "matches: %d in %.2f s" % (count, wall_time)
+    for i in range(2):
+        print "player %d (%s) wins: %d (%.1f%%)" % (i + 1, bot_kinds[i], wins[i], 100. * wins[i] / count)
+    print "draws: %d (%.1f%%)" % (draws, 100. * draws / count)
+    print "ticks: %d, mean %.3f ms, max %.3f ms per tick" % (ticks, 1000. * tick_time / max(ticks, 1), 1000. * max_tick_time)
+    print "simulated %.1f s, %.1fx real time" % (sim_time, sim_time / max(wall_time, 1e-9))
+    return
+
+def main():
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hn:s:1:2:j:t:d:b:L:",
+                                   ["help", "matches=", "seed=", "bot1=", "bot2=", "jobs=",
+                                    "max-time=", "dt=", "backend=", "logging="])
+    except getopt.GetoptError as e:
+        print str(e)
+        usage()
+        sys.exit(1)
+
+    show_help = False
+    matches = 100
+    seed = 1
+    bot_kinds = [ "ai", "ai" ]
+    jobs = None
+    max_time = 5. * 60.
+    dt = DEFAULT_DT
+    backend = ENGINE_BACKEND
+    logging_level = "error"
+    try:
+        for o, a in opts:
+            if o in ("-h", "--help"):
+                show_help = True
+            elif o in ("-n", "--matches"):
+                matches = int(a)
+            elif o in ("-s", "--seed"):
+                seed = int(a)
+            elif o in ("-1", "--bot1"):
+                bot_kinds[0] = a
+            elif o in ("-2", "--bot2"):
+                bot_kinds[1] = a
+            elif o in ("-j", "--jobs"):
+                jobs = int(a)
+            elif o in ("-t", "--max-time"):
+                max_time = float(a)
+            elif o in ("-d", "--dt"):
+                dt = float(a)
+            elif o in ("-b", "--backend"):
+                backend = a
+            elif o in ("-L", "--logging"):
+                logging_level = a
+            else:
+                print "Unexpected option: %s" % (o)
+                usage()
+                sys.exit(1)
+    except ValueError as e:
+        print str(e)
+        usage()
+        sys.exit(1)
+    for kind in bot_kinds:
+        if kind not in BOTS:
+            print "Unknown bot: %s" % (kind)
+            show_help = True
+    if show_help or matches < 1:
+        usage()
+        sys.exit(1)
+
+    if logging_level == "info":
+        logging.basicConfig(level=logging.INFO)
+    elif logging_level == "debug":
+        logging.basicConfig(level=logging.DEBUG)
+    elif logging_level == "warning":
+        logging.basicConfig(level=logging.WARNING)
+    else:
+        logging.basicConfig(level=logging.ERROR)
+
+    work = [ (seed + i, bot_kinds, dt, max_time, backend) for i in range(matches) ]
+    t0 = time.time()
+    if jobs == 0:
+        results = map(run_match, work)
+    else:
+        # jobs=None uses one process per cpu
+        pool = Pool(jobs)
+        results = pool.map(run_match, work, 1)
+        pool.close()
+        pool.join()
+    report(results, bot_kinds, time.time() - t0)
+    return
+
+if __name__ == "__main__":
+    main()